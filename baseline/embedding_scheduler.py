@@ -0,0 +1,226 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from dotenv import load_dotenv
+from llama_index.core.utils import get_tokenizer
+from baseline.registry import EMBEDDING_MODEL
+from utils.logger import logger
+
+load_dotenv()
+
+# OpenAI's limits for text-embedding-3-*: inputs per request, tokens per request and tokens per input
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", 2048))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", 300000))
+EMBED_MAX_INPUT_TOKENS = int(os.getenv("EMBED_MAX_INPUT_TOKENS", 8191))
+# Tokens per minute the account may embed; 0 disables the budget
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", 1000000))
+# Embedding requests in flight at once, across every index build in the process
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 8))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", 1.0))
+EMBED_BACKOFF_MAX_SECONDS = float(os.getenv("EMBED_BACKOFF_MAX_SECONDS", 60.0))
+# Window over which tokens/sec is reported
+THROUGHPUT_WINDOW_SECONDS = 60
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class TokenBudget:
+    # Tokens-per-minute budget, refilled continuously. A rate-limit response pauses it for everyone,
+    # so concurrent builds back off together instead of taking turns hitting the limit.
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        if self.capacity <= 0:
+            return
+        # A batch bigger than the whole budget waits for a full bucket rather than forever
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.available >= tokens:
+                        self.available -= tokens
+                        return
+                    wait = (tokens - self.available) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # Called on a 429: the upstream bucket is empty, so this one starts refilling from zero too.
+        # Requests sent just after the bucket was full can leave the two out of step otherwise.
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.available = 0.0
+
+
+class EmbeddingScheduler:
+    # Embeds texts for every index build through one worker pool and one token budget: texts are
+    # packed into the largest batches the API accepts, each batch waits for its tokens, and
+    # transient failures are retried with exponential backoff and full jitter.
+
+    def __init__(self, model: str = EMBEDDING_MODEL, tokens_per_minute: int = EMBED_TOKENS_PER_MINUTE,
+                 concurrency: int = EMBED_CONCURRENCY):
+        self.model = model
+        self.budget = TokenBudget(tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+        self._lock = threading.Lock()
+        self._client = None
+        self._completed = deque()  # (finished at, tokens) within the throughput window
+        self._first_batch_at = None
+        self.batches_queued = 0
+        self.batches_in_flight = 0
+        self.batches_completed = 0
+        self.tokens_embedded = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def get_client(self):
+        # The SDK's own retries are off; this scheduler decides when to try again
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_API_BASE"),
+                    max_retries=0
+                )
+            return self._client
+
+    def prepare(self, texts: list):
+        # Newlines become spaces as in llama-index's OpenAIEmbedding, so vectors match query-time ones.
+        # Inputs over the per-input limit are truncated rather than failing the whole batch.
+        # llama-index's default tokenizer is cl100k_base, the encoding text-embedding-3-* uses.
+        tokenizer = get_tokenizer()
+        prepared, token_counts = [], []
+        for text in texts:
+            text = text.replace("\n", " ")
+            count = len(tokenizer(text))
+            while count > EMBED_MAX_INPUT_TOKENS:
+                text = text[:len(text) * EMBED_MAX_INPUT_TOKENS // count]
+                count = len(tokenizer(text))
+            prepared.append(text)
+            token_counts.append(count)
+        return prepared, token_counts
+
+    def plan_batches(self, token_counts: list) -> list:
+        # Consecutive (start, end, tokens) slices within the per-request input and token limits. A batch
+        # larger than the per-minute budget would be rejected however long it waited, so that caps it too.
+        max_tokens = min(EMBED_BATCH_MAX_TOKENS, self.budget.capacity) if self.budget.capacity > 0 else EMBED_BATCH_MAX_TOKENS
+        batches = []
+        start, tokens = 0, 0
+        for i, count in enumerate(token_counts):
+            if i > start and (i - start >= EMBED_BATCH_MAX_INPUTS or tokens + count > max_tokens):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts), tokens))
+        return batches
+
+    def embed(self, texts: list):
+        # Returns (vectors in input order, tokens billed)
+        if not texts:
+            return [], 0
+        prepared, token_counts = self.prepare(texts)
+        batches = self.plan_batches(token_counts)
+        with self._lock:
+            self.batches_queued += len(batches)
+
+        started = time.monotonic()
+        futures = [self._executor.submit(self._embed_batch, prepared[start:end], tokens) for start, end, tokens in batches]
+        vectors, billed = [], 0
+        for future in futures:
+            batch_vectors, batch_tokens = future.result()
+            vectors.extend(batch_vectors)
+            billed += batch_tokens
+
+        stats = self.stats()
+        logger.info(
+            f"Embedded {len(texts)} texts ({billed} tokens) in {len(batches)} batches, "
+            f"{time.monotonic() - started:.2f}s; scheduler at {stats['tokens_per_second']:.0f} tokens/s, "
+            f"{stats['batches_in_flight']} batches in flight"
+        )
+        return vectors, billed
+
+    def _embed_batch(self, texts: list, tokens: int):
+        with self._lock:
+            self.batches_queued -= 1
+            if self._first_batch_at is None:
+                self._first_batch_at = time.monotonic()
+        response = self._request_with_retries(texts, tokens)
+
+        billed = response.usage.total_tokens if response.usage else tokens
+        with self._lock:
+            self.batches_completed += 1
+            self.tokens_embedded += billed
+            self._completed.append((time.monotonic(), billed))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], billed
+
+    def _request_with_retries(self, texts: list, tokens: int):
+        # A rejected request spent nothing upstream, so every attempt waits for its tokens again
+        client = self.get_client()
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self.budget.acquire(tokens)
+            with self._lock:
+                self.batches_in_flight += 1
+            try:
+                return client.embeddings.create(input=texts, model=self.model)
+            except RETRYABLE_ERRORS as e:
+                if attempt == EMBED_MAX_RETRIES:
+                    logger.error(f"Embedding batch of {len(texts)} texts failed after {attempt + 1} attempts: {e}")
+                    raise
+                delay = random.uniform(0, min(EMBED_BACKOFF_MAX_SECONDS, EMBED_BACKOFF_SECONDS * 2 ** attempt))
+                with self._lock:
+                    self.retries += 1
+                if isinstance(e, openai.RateLimitError):
+                    delay = max(delay, retry_after_seconds(e))
+                    self.budget.pause(delay)
+                    with self._lock:
+                        self.rate_limited += 1
+                logger.warning(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            finally:
+                with self._lock:
+                    self.batches_in_flight -= 1
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            while self._completed and self._completed[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self._completed.popleft()
+            window_tokens = sum(tokens for _, tokens in self._completed)
+            # Until the scheduler has been busy for a full window, divide by the time it has been busy
+            window = min(THROUGHPUT_WINDOW_SECONDS, now - self._first_batch_at) if self._first_batch_at else 1
+            return {
+                "tokens_per_second": window_tokens / max(window, 1e-3),
+                "batches_queued": self.batches_queued,
+                "batches_in_flight": self.batches_in_flight,
+                "batches_completed": self.batches_completed,
+                "tokens_embedded": self.tokens_embedded,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "tokens_per_minute_budget": int(self.budget.capacity)
+            }
+
+
+def retry_after_seconds(error) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+embedding_scheduler = EmbeddingScheduler()
@@ -1,29 +1,33 @@
-from llama_index.llms.openai import OpenAI
-from llama_index.core.callbacks import TokenCountingHandler
+import logging
+import os
+import time
 from llama_index.core.prompts import RichPromptTemplate
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+from llama_index.core.utils import get_tokenizer
 from llama_index.core import get_response_synthesizer
-import os
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+from baseline.registry import registry, run_chroma
+from baseline.retriever.filters import describe_filters, is_identifier_query, parse_filters, query_filters
+from utils.answer_cache import aanswer_cache_scope, afind_similar_answer, aget_exact_answer, aset_answer, semantic_tier_enabled
+from utils.lexical_index import search as lexical_search
 from utils.logger import logger
+from utils.accounting import RequestUsage, aenforce_budget, current_usage, enforce_budget, usage_scope
+from utils.tracing import count_cache_lookup, record_stage, span
 
 load_dotenv()
 
-EXPANSIVE_QUERY_TRIGGERS = [
-    "all comments",
-    "list all",
-    "summarize all",
-    "show everything",
-    "give full history",
-    "every pr",
-    "all prs",
-    "full discussion",
-    "all commits",
-    "give me all commits",
-    "every commit",
-    "commits from all",
-    "full commit history",
-    "show commits for all prs"
-]
+# Context selection: retrieve CONTEXT_CANDIDATES chunks, drop near-duplicates, then pack them in
+# score order until CONTEXT_TOKEN_BUDGET prompt tokens are used or the scores drop off a cliff.
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 40))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 4000))
+CONTEXT_MIN_CHUNKS = int(os.getenv("CONTEXT_MIN_CHUNKS", 2))
+# Stop once a chunk scores this much lower than the one ranked just above it
+CONTEXT_SCORE_CLIFF = float(os.getenv("CONTEXT_SCORE_CLIFF", 0.1))
+# Word-set Jaccard similarity at which a chunk counts as a duplicate of one already packed
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv("CONTEXT_DEDUP_SIMILARITY", 0.9))
+# Reciprocal rank fusion constant for merging vector and BM25 rankings
+RRF_K = int(os.getenv("RRF_K", 60))
 
 prompt_template_str = """You are CodeReview Genie, an expert code reviewer.
 
@@ -40,50 +44,311 @@ If something isn't applicable, write 'Sorry I am unaware of this information.'.
 
 custom_prompt = RichPromptTemplate(prompt_template_str)
 
-def ask_query(index, query: str, token_counter: TokenCountingHandler, use_custom_prompt: bool = True):
-    logger.info(f"Asking question: {query}")
-    try:
-        llm = OpenAI(model="gpt-4.1-nano", api_key=os.getenv("OPENAI_API_KEY"), temperature=0)
+def build_synthesizer(use_custom_prompt: bool = True, streaming: bool = False):
+    # Token usage is picked up by the shared UsageHandler (see baseline.registry), not a per-request handler
+    llm = registry.get_llm()
+    if use_custom_prompt:
+        return get_response_synthesizer(llm=llm, text_qa_template=custom_prompt, streaming=streaming)
+    return get_response_synthesizer(llm=llm, streaming=streaming)
+
+def vector_nodes(index, query_bundle: QueryBundle) -> list:
+    # Pre-filter on node metadata when the question names a PR, status, author, content type or
+    # period. A filter that matches nothing (e.g. a misread author) falls back to plain retrieval.
+    filters = query_filters(query_bundle.query_str)
+    if filters is not None:
+        logger.info(f"Query metadata filters: {describe_filters(filters)}")
+        retriever = index.as_retriever(similarity_top_k=CONTEXT_CANDIDATES, filters=filters)
+        retrieved_nodes = retriever.retrieve(query_bundle)
+        if retrieved_nodes:
+            return retrieved_nodes
+        logger.info("No chunks matched the query filters; retrying without them.")
+
+    retriever = index.as_retriever(similarity_top_k=CONTEXT_CANDIDATES)
+    return retriever.retrieve(query_bundle)
+
+def lexical_nodes(index, question: str) -> list:
+    # BM25 hits from the lexical index kept next to the index's Chroma collection, under the same
+    # metadata constraints as the vector pre-filter
+    rows = lexical_search(index.vector_store.client.name, question, CONTEXT_CANDIDATES, parse_filters(question))
+    return [
+        NodeWithScore(
+            node=TextNode(
+                id_=node_id,
+                text=text,
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(metadata),
+                excluded_llm_metadata_keys=list(metadata)
+            ),
+            score=score
+        )
+        for node_id, text, metadata, score in rows
+    ]
+
+def fuse_rankings(*rankings) -> list:
+    # Reciprocal rank fusion: a node scores 1 / (RRF_K + rank) for each list it appears in
+    scores, nodes = {}, {}
+    for ranking in rankings:
+        for rank, node in enumerate(ranking, start=1):
+            node_id = node.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (RRF_K + rank)
+            nodes.setdefault(node_id, node.node)
+    return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in sorted(scores, key=scores.get, reverse=True)]
+
+def serve_lexically(question: str, lexical: list) -> bool:
+    # Exact identifiers (SHAs, PR numbers, file names, quoted errors) are answered from BM25 alone,
+    # without embedding the question
+    if lexical and is_identifier_query(question):
+        logger.info(f"Identifier query served from the lexical index ({len(lexical)} hits)")
+        return True
+    return False
+
+def merge_candidates(vector: list, lexical: list):
+    # Returns (candidates, score cliff). Fused scores are rank-based, so the cliff only applies
+    # to a plain similarity ranking.
+    if not lexical:
+        return vector, CONTEXT_SCORE_CLIFF
+    return fuse_rankings(vector, lexical), None
+
+def gather_candidates(index, query: str, query_embedding: list = None):
+    with span("lexical_search"):
+        lexical = lexical_nodes(index, query)
+    if serve_lexically(query, lexical):
+        return QueryBundle(query_str=query, embedding=query_embedding), lexical, None
+
+    # A precomputed embedding (e.g. from the answer cache lookup) is reused; otherwise the question
+    # is embedded exactly once
+    if query_embedding is None:
+        with span("embed_query"):
+            query_embedding = registry.get_embed_model().get_query_embedding(query)
+    query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+    with span("vector_search"):
+        vector = vector_nodes(index, query_bundle)
+    return (query_bundle, *merge_candidates(vector, lexical))
+
+async def agather_candidates(index, query: str, query_embedding: list = None):
+    # Async counterpart of gather_candidates: the question is embedded with the async OpenAI client,
+    # and the SQLite and Chroma searches run on worker threads
+    with span("lexical_search"):
+        lexical = await run_in_threadpool(lexical_nodes, index, query)
+    if serve_lexically(query, lexical):
+        return QueryBundle(query_str=query, embedding=query_embedding), lexical, None
+
+    if query_embedding is None:
+        with span("embed_query"):
+            query_embedding = await registry.get_embed_model().aget_query_embedding(query)
+    query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+    with span("vector_search"):
+        vector = await run_chroma(vector_nodes, index, query_bundle)
+    return (query_bundle, *merge_candidates(vector, lexical))
+
+def word_set(text: str) -> set:
+    return set(text.lower().split())
+
+def pack_context(candidates: list, budget: int = CONTEXT_TOKEN_BUDGET, score_cliff: float = CONTEXT_SCORE_CLIFF):
+    # Returns (chosen nodes, their token counts), best first. Near-duplicates are skipped and chunks
+    # that would overflow the budget are passed over in favour of smaller ones further down.
+    tokenizer = get_tokenizer()
+    ranked = sorted(candidates, key=lambda n: n.score if n.score is not None else 0.0, reverse=True)
+
+    chosen, token_counts, seen = [], [], []
+    used = 0
+    previous_score = None
+    for node in ranked:
+        if score_cliff is not None and len(chosen) >= CONTEXT_MIN_CHUNKS and previous_score is not None \
+                and node.score is not None and previous_score - node.score > score_cliff:
+            logger.info(f"Score cliff after {len(chosen)} chunks ({previous_score:.3f} -> {node.score:.3f})")
+            break
+        previous_score = node.score
+
+        text = node.node.get_content(metadata_mode=MetadataMode.LLM)
+        words = word_set(text)
+        if any(len(words & other) / max(1, len(words | other)) >= CONTEXT_DEDUP_SIMILARITY for other in seen):
+            continue
+
+        tokens = len(tokenizer(text))
+        if used + tokens > budget and chosen:
+            continue
+        chosen.append(node)
+        token_counts.append(tokens)
+        seen.append(words)
+        used += tokens
+        if used >= budget:
+            break
+
+    logger.info(f"Packed {len(chosen)} of {len(candidates)} candidate chunks into {used} tokens (budget {budget})")
+    return chosen, token_counts
+
+def chunks_from_nodes(retrieved_nodes, token_counts: list) -> list:
+    chunks_data = []
+    for i, (node, tokens) in enumerate(zip(retrieved_nodes, token_counts)):
+        chunks_data.append({
+            "chunk_number": i + 1,
+            "content": node.text,
+            "score": getattr(node, 'score', None),
+            "tokens": tokens
+        })
+
+    # Chunk dumps are large; only build them when LOG_LEVEL=DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        for chunk in chunks_data:
+            logger.debug(f"--- Chunk #{chunk['chunk_number']} (score {chunk['score']}) ---\n{chunk['content']}")
+
+    return chunks_data
+
+def prepare_query(index, query: str, use_custom_prompt: bool = True, query_embedding: list = None, streaming: bool = False):
+    response_synthesizer = build_synthesizer(use_custom_prompt, streaming)
+
+    # Retrieve once and synthesize from those same nodes
+    query_bundle, candidates, score_cliff = gather_candidates(index, query, query_embedding)
+    with span("pack_context"):
+        retrieved_nodes, token_counts = pack_context(candidates, score_cliff=score_cliff)
 
-        is_expansive = any(phrase in query.lower() for phrase in EXPANSIVE_QUERY_TRIGGERS)
-        top_k = 50 if is_expansive else 5
+    return query_bundle, retrieved_nodes, chunks_from_nodes(retrieved_nodes, token_counts), response_synthesizer
 
-        if use_custom_prompt:
-            response_synthesizer = get_response_synthesizer(text_qa_template=custom_prompt)
-            query_engine = index.as_query_engine(similarity_top_k=top_k, response_synthesizer=response_synthesizer, llm=llm)
-        else:
-            query_engine = index.as_query_engine(similarity_top_k=top_k, llm=llm) # No response_synthesizer
+async def aprepare_query(index, query: str, use_custom_prompt: bool = True, query_embedding: list = None, streaming: bool = False):
+    response_synthesizer = build_synthesizer(use_custom_prompt, streaming)
 
-        query_engine.callback_manager.add_handler(token_counter)
+    query_bundle, candidates, score_cliff = await agather_candidates(index, query, query_embedding)
+    with span("pack_context"):
+        retrieved_nodes, token_counts = await run_in_threadpool(pack_context, candidates, score_cliff=score_cliff)
 
-        logger.info(f"Using similarity_top_k={top_k} for this query.")
+    return query_bundle, retrieved_nodes, chunks_from_nodes(retrieved_nodes, token_counts), response_synthesizer
 
-        retrieved_nodes = query_engine.retriever.retrieve(query)
-        print("\n=== Retrieved Chunks for Query ===")
-        for i, node in enumerate(retrieved_nodes):
-            print(f"\n--- Chunk #{i+1} ---\n{node.text}\n")
+def token_usage(usage):
+    # (LLM tokens, dollars) for a RequestUsage; the dollars include embedding the question
+    prompt_tokens, completion_tokens = usage.total("prompt"), usage.total("completion")
+    logger.info(f"Tokens used -> prompt: {prompt_tokens}, completion: {completion_tokens}, total: {prompt_tokens + completion_tokens}")
+    return prompt_tokens + completion_tokens, usage.cost_usd()
 
-        chunks_data = []
-        for i, node in enumerate(retrieved_nodes):
-            chunks_data.append({
-                "chunk_number": i + 1,
-                "content": node.text,
-                "score": getattr(node, 'score', None)
-            })
-            print(f"\n--- Chunk #{i+1} ---\n{node.text}\n")    
+def usage_since(snapshot: dict):
+    usage = current_usage()
+    return usage.since(snapshot) if usage is not None else RequestUsage()
 
-        # Run the actual query
-        response = query_engine.query(query)
+def ask_query(index, query: str, use_custom_prompt: bool = True, query_embedding: list = None):
+    # Raises BudgetExceeded before anything is spent if the caller's repo or user is over budget
+    logger.info(f"Asking question: {query}")
+    enforce_budget()
+    try:
+        with usage_scope() as usage:
+            query_bundle, retrieved_nodes, chunks_data, response_synthesizer = prepare_query(
+                index, query, use_custom_prompt=use_custom_prompt, query_embedding=query_embedding
+            )
+            with span("synthesize"):
+                response = response_synthesizer.synthesize(query_bundle, nodes=retrieved_nodes)
 
-        prompt_tokens = token_counter.prompt_llm_token_count
-        completion_tokens = token_counter.completion_llm_token_count
-        total_tokens = token_counter.total_llm_token_count
+        total_tokens, cost_usd = token_usage(usage)
+        return str(response), total_tokens, cost_usd, chunks_data
 
-        cost_usd = (prompt_tokens * 0.0001 + completion_tokens * 0.0004)
+    except Exception as e:
+        logger.error(f"Error while querying GPT: {e}", exc_info=True)
+        raise
 
-        logger.info(f"Tokens used -> prompt: {prompt_tokens}, completion: {completion_tokens}, total: {total_tokens}")
+async def aask_query(index, query: str, use_custom_prompt: bool = True, query_embedding: list = None):
+    logger.info(f"Asking question: {query}")
+    await aenforce_budget()
+    try:
+        with usage_scope() as usage:
+            query_bundle, retrieved_nodes, chunks_data, response_synthesizer = await aprepare_query(
+                index, query, use_custom_prompt=use_custom_prompt, query_embedding=query_embedding
+            )
+            with span("synthesize"):
+                response = await response_synthesizer.asynthesize(query_bundle, nodes=retrieved_nodes)
+
+        total_tokens, cost_usd = token_usage(usage)
         return str(response), total_tokens, cost_usd, chunks_data
 
     except Exception as e:
         logger.error(f"Error while querying GPT: {e}", exc_info=True)
         raise
+
+async def astream_ask_query(index, query: str, use_custom_prompt: bool = True, query_embedding: list = None):
+    # Yields ("chunks", chunks_data) first, then ("token", text) as the LLM streams,
+    # then ("done", {"answer", "llm_tokens", "cost_usd"}) once token counts are final.
+    # Counts come from the caller's usage scope, which a generator can't safely open across yields.
+    logger.info(f"Asking question (streaming): {query}")
+    await aenforce_budget()
+    try:
+        snapshot = current_usage().snapshot() if current_usage() is not None else {}
+        query_bundle, retrieved_nodes, chunks_data, response_synthesizer = await aprepare_query(
+            index, query, use_custom_prompt=use_custom_prompt, query_embedding=query_embedding, streaming=True
+        )
+        yield "chunks", chunks_data
+
+        started = time.time()
+        response = await response_synthesizer.asynthesize(query_bundle, nodes=retrieved_nodes)
+        parts = []
+        async for delta in response.async_response_gen():
+            parts.append(delta)
+            yield "token", delta
+        record_stage("synthesize", started, streamed=True)
+
+        total_tokens, cost_usd = token_usage(usage_since(snapshot))
+        yield "done", {"answer": "".join(parts), "llm_tokens": total_tokens, "cost_usd": cost_usd}
+
+    except Exception as e:
+        logger.error(f"Error while streaming from GPT: {e}", exc_info=True)
+        raise
+
+async def alookup_answer_cache(owner: str, repo: str, query: str, use_custom_prompt: bool = True):
+    # Exact question match first, then nearest cached question by embedding.
+    # Returns (scope, query_embedding, cached payload or None, outcome) where outcome is
+    # "exact", "semantic", "miss" or "disabled".
+    mode = "custom" if use_custom_prompt else "default"
+    scope = await aanswer_cache_scope(owner, repo, mode)
+    if scope is None:
+        return None, None, None, "disabled"
+
+    cached = await aget_exact_answer(scope, query)
+    if cached:
+        return scope, None, cached, "exact"
+
+    query_embedding = None
+    # "PR #12" and "PR #13" questions embed almost identically, so identifier questions skip this tier
+    if semantic_tier_enabled() and not is_identifier_query(query):
+        query_embedding = await registry.get_embed_model().aget_query_embedding(query)
+        cached = await afind_similar_answer(scope, query_embedding)
+        if cached:
+            return scope, query_embedding, cached, "semantic"
+
+    return scope, query_embedding, None, "miss"
+
+async def acached_ask_query(index, owner: str, repo: str, query: str, use_custom_prompt: bool = True):
+    # Answer cache in front of aask_query; returns aask_query's tuple plus the cache outcome
+    with span("answer_cache_lookup"):
+        scope, query_embedding, cached, outcome = await alookup_answer_cache(owner, repo, query, use_custom_prompt)
+    count_cache_lookup("answer", outcome)
+    if cached:
+        return cached["answer"], 0, 0.0, cached["retrieved_chunks"], outcome
+
+    answer, total_tokens, cost_usd, chunks_data = await aask_query(
+        index, query, use_custom_prompt=use_custom_prompt, query_embedding=query_embedding
+    )
+    if scope is not None:
+        await aset_answer(scope, query, {"answer": answer, "retrieved_chunks": chunks_data}, embedding=query_embedding)
+    return answer, total_tokens, cost_usd, chunks_data, outcome
+
+async def astream_cached_ask_query(index, owner: str, repo: str, query: str, use_custom_prompt: bool = True):
+    # Streaming counterpart of acached_ask_query; the "done" event also carries answer_cache
+    with span("answer_cache_lookup"):
+        scope, query_embedding, cached, outcome = await alookup_answer_cache(owner, repo, query, use_custom_prompt)
+    count_cache_lookup("answer", outcome)
+    if cached:
+        yield "chunks", cached["retrieved_chunks"]
+        yield "token", cached["answer"]
+        yield "done", {"answer": cached["answer"], "llm_tokens": 0, "cost_usd": 0.0, "answer_cache": outcome}
+        return
+
+    chunks_data = []
+    events = astream_ask_query(index, query, use_custom_prompt=use_custom_prompt, query_embedding=query_embedding)
+    try:
+        async for event, data in events:
+            if event == "chunks":
+                chunks_data = data
+            elif event == "done":
+                if scope is not None:
+                    await aset_answer(scope, query, {"answer": data["answer"], "retrieved_chunks": chunks_data}, embedding=query_embedding)
+                data["answer_cache"] = outcome
+            yield event, data
+    finally:
+        # Client disconnects close this generator early; close the LLM stream with it
+        await events.aclose()
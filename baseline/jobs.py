@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from baseline.retriever.retriever import build_index_from_github
+from utils.logger import logger
+
+load_dotenv()
+
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", 2))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", 200))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IndexJob:
+    def __init__(self, owner: str, repo: str, access_token: str = None):
+        self.job_id = str(uuid.uuid4())
+        self.owner = owner
+        self.repo = repo
+        self.access_token = access_token
+        self.status = "queued"
+        self.prs_fetched = 0
+        self.chunks_embedded = 0
+        self.error = ""
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def update_progress(self, prs_fetched: int, chunks_embedded: int):
+        # Called by the build between batches; also the point where cancellation takes effect
+        self.prs_fetched = prs_fetched
+        self.chunks_embedded = chunks_embedded
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Index job {self.job_id} was cancelled")
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = "cancelled"
+            self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "repo": f"{self.owner}/{self.repo}",
+            "status": self.status,
+            "prs_fetched": self.prs_fetched,
+            "chunks_embedded": self.chunks_embedded,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    # Runs index builds on a bounded worker pool; at most one live job per repo
+
+    def __init__(self, max_workers: int = INDEX_WORKERS, history_size: int = JOB_HISTORY_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> IndexJob
+        self._active = {}  # "owner/repo" -> IndexJob
+        self.history_size = history_size
+
+    def submit(self, owner: str, repo: str, access_token: str = None) -> IndexJob:
+        key = f"{owner}/{repo}"
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None and not job.finished:
+                return job
+
+            job = IndexJob(owner, repo, access_token=access_token)
+            self._jobs[job.job_id] = job
+            self._active[key] = job
+            self._prune()
+            job.future = self._executor.submit(self._run, job)
+
+        logger.info(f"Queued index job {job.job_id} for {key}")
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel()
+            logger.info(f"Cancellation requested for index job {job_id}")
+        return job
+
+    def _run(self, job: IndexJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            build_index_from_github(job.owner, job.repo, access_token=job.access_token, job=job)
+            job.status = "completed"
+        except JobCancelled:
+            job.status = "cancelled"
+            logger.info(f"Index job {job.job_id} cancelled")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Index job {job.job_id} failed: {e}", exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            job.access_token = None
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history is full
+        for job_id in [jid for jid, j in self._jobs.items() if j.finished][:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
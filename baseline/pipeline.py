@@ -1,18 +1,30 @@
+import asyncio
 import json
-from chromadb import PersistentClient
-from fastapi import Body, FastAPI, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from typing import Optional
+from fastapi import BackgroundTasks, Body, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 import httpx
 from pydantic import BaseModel, HttpUrl
 from urllib.parse import urlparse
-from llama_index.core.callbacks import TokenCountingHandler
-from baseline.retriever.retriever import build_index_from_github
-from baseline.generator.generator import ask_query
-from evaluation.testutils import load_test_entry, save_test_entry
-from specialization.github_client import fetch_commits, fetch_pull_requests
-from utils.cache import check_redis_connection, invalidate_repo_cache
+from baseline.embedding_scheduler import embedding_scheduler
+from baseline.jobs import job_manager
+from baseline.retriever.retriever import abuild_index_from_github, ais_index_ready, sync_all_indexes, sync_repo_index
+from baseline.generator.generator import acached_ask_query, aask_query, astream_cached_ask_query
+from baseline.router import structured_answer
+from evaluation.scoring import score_answer
+from evaluation.testutils import EVAL_QUESTION, build_test_entry, load_test_entry, save_test_entry
+from specialization.github_client import fetch_pr_commits_async
+from specialization.rate_limit import governor
+from utils.accounting import BudgetExceeded, enforce_budget, spend_report, usage_scope, user_identity
+from utils.cache import (
+    ainvalidate_repo_cache, check_redis_connection, invalidate_repo_cache, monitor_redis_health, repo_cache_stats
+)
+from utils.http_cache import prune_entries
 from utils.logger import logger
-from utils.metrics import log_metrics
+from utils.metrics import log_metrics, metrics_writer, summarize_metrics
+from utils.sqlite_connections import close_all_connections
+from utils.tracing import telemetry
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from dotenv import load_dotenv
@@ -27,6 +39,7 @@ load_dotenv()
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
 GITHUB_CALLBACK_URL = "http://localhost:8000/auth/github/callback"
+SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", 0))  # 0 disables periodic sync
 
 app.add_middleware(
     CORSMiddleware,
@@ -38,6 +51,7 @@ app.add_middleware(
 class QueryInput(BaseModel):
     repo_url: str
     question: str
+    stream: bool = False
 
 def extract_owner_repo(repo_url: str):
     try:
@@ -49,23 +63,162 @@ def extract_owner_repo(repo_url: str):
         logger.error(f"Invalid GitHub URL format: {repo_url}", exc_info=True)
         raise ValueError("Invalid GitHub URL. Format must be: https://github.com/owner/repo")
 
+def indexing_response(owner: str, repo: str, access_token: str = None):
+    # Cold repo: hand the build to the job queue instead of holding this request for minutes
+    job = job_manager.submit(owner, repo, access_token=access_token)
+    logger.info(f"Index for {owner}/{repo} not ready; job {job.job_id} is {job.status}")
+    return {
+        "status": "indexing",
+        "message": f"Indexing {owner}/{repo} is in progress. Poll /index/{job.job_id} and ask again when it completes.",
+        "job": job.to_dict()
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def context_stats(chunks: list) -> dict:
+    # How many chunks went into the prompt and how many tokens they took (for tuning the budget);
+    # answers cached before context packing carry no per-chunk token counts
+    return {"context_k": len(chunks), "context_tokens": sum(chunk.get("tokens", 0) for chunk in chunks)}
+
+def structured_response(request_id: str, start_time: float, question: str, structured: dict, metrics_extra: dict, stream: bool):
+    # Enumeration answers straight from the PR store: no retrieval, no LLM call, no tokens
+    duration = round(time.time() - start_time, 2)
+    logger.info(f"[{request_id}] Answered from the PR store ({structured['rows']} rows), duration: {duration}s")
+
+    log_metrics({
+        "request_id": request_id,
+        **metrics_extra,
+        "question": question,
+        "answer": structured["answer"],
+        "retrieved_chunks": [],
+        "route": "structured",
+        "embedding_tokens": 0,
+        "llm_tokens": 0,
+        "tokens_total": 0,
+        "cost_usd": 0,
+        "latency_seconds": duration,
+        "error": ""
+    })
+
+    usage = {"route": "structured", "llm_tokens": 0, "embedding_tokens": 0, "tokens_total": 0, "estimated_cost_usd": 0,
+             "rows": structured["rows"], "summary": structured["summary"]}
+    if stream:
+        return sse_response(iter([
+            sse_event("chunks", {"retrieved_chunks": []}),
+            sse_event("token", {"delta": structured["answer"]}),
+            sse_event("done", usage)
+        ]))
+    return {"answer": structured["answer"], **usage, "retrieved_chunks": []}
+
+async def stream_answer(request_id: str, start_time: float, index, owner: str, repo: str,
+                  question: str, user: str, metrics_extra: dict):
+    # Server-sent events: "chunks" (retrieved chunks), "token" (LLM deltas), then "done" with
+    # token counts and cost, or "error". Metrics are logged once the stream has finished.
+    try:
+        chunks = []
+        done = {}
+        # Opened here rather than in the handler, which returns before the stream runs
+        with usage_scope(f"{owner}/{repo}", user) as usage:
+            async for event, data in astream_cached_ask_query(index, owner, repo, question):
+                if event == "chunks":
+                    chunks = data
+                    yield sse_event("chunks", {"retrieved_chunks": data})
+                elif event == "token":
+                    yield sse_event("token", {"delta": data})
+                else:
+                    done = data
+
+        token_count = usage.llm_tokens
+        cost_usd = usage.cost_usd()
+        embedding_tokens = usage.embedding_tokens
+
+        duration = round(time.time() - start_time, 2)
+        logger.info(f"[{request_id}] Streamed query successful (answer cache: {done['answer_cache']}), tokens used: {token_count}, cost: ${cost_usd:.6f}, duration: {duration}s")
+
+        log_metrics({
+            "request_id": request_id,
+            **metrics_extra,
+            "question": question,
+            "answer": done["answer"],
+            "retrieved_chunks": chunks,
+            **context_stats(chunks),
+            "embedding_tokens": embedding_tokens,
+            "answer_cache": done["answer_cache"],
+            "route": "llm",
+            "llm_tokens": token_count,
+            "tokens_total": token_count + embedding_tokens,
+            "cost_usd": round(cost_usd, 6),
+            "latency_seconds": duration,
+            "streamed": True,
+            "error": ""
+        })
+
+        yield sse_event("done", {
+            "llm_tokens": token_count,
+            "embedding_tokens": embedding_tokens,
+            "answer_cache": done["answer_cache"],
+            "route": "llm",
+            "tokens_total": token_count + embedding_tokens,
+            "estimated_cost_usd": round(cost_usd, 6)
+        })
+
+    except Exception as e:
+        duration = round(time.time() - start_time, 2)
+        logger.error(f"[{request_id}] Error while streaming query: {e}", exc_info=True)
+        log_metrics({
+            "request_id": request_id,
+            **metrics_extra,
+            "question": question,
+            "tokens_total": 0,
+            "llm_tokens": 0,
+            "embedding_tokens": 0,
+            "cost_usd": 0,
+            "latency_seconds": duration,
+            "streamed": True,
+            "error": str(e)
+        })
+        yield sse_event("error", {"error": str(e)})
+
 @app.post("/query")
-def query(input: QueryInput):
+async def query(input: QueryInput):
     request_id = str(uuid.uuid4())
     start_time = time.time()
 
     logger.info(f"[{request_id}] Received query for repo: {input.repo_url}")
     try:
         owner, repo = extract_owner_repo(input.repo_url)
+        if not await ais_index_ready(owner, repo):
+            response = indexing_response(owner, repo)
+            return sse_response(iter([sse_event("indexing", response)])) if input.stream else response
+
+        structured = await run_in_threadpool(structured_answer, owner, repo, input.question)
+        if structured is not None:
+            return structured_response(request_id, start_time, input.question, structured, {"repo_url": input.repo_url}, input.stream)
+
         logger.info(f"[{request_id}] Building index for {owner}/{repo}")
-        index, token_counter = build_index_from_github(owner, repo)
+        index, _ = await abuild_index_from_github(owner, repo)
+
+        if input.stream:
+            return sse_response(stream_answer(
+                request_id, start_time, index, owner, repo, input.question, "anonymous",
+                {"repo_url": input.repo_url}
+            ))
 
         logger.info(f"[{request_id}] Asking question: {input.question}")
-        answer, token_count, cost_usd, chunks = ask_query(index, input.question, token_counter)
-        embedding_tokens = token_counter.total_embedding_token_count
+        with usage_scope(f"{owner}/{repo}", "anonymous") as usage:
+            answer, _, _, chunks, answer_cache = await acached_ask_query(index, owner, repo, input.question)
+        token_count, cost_usd, embedding_tokens = usage.llm_tokens, usage.cost_usd(), usage.embedding_tokens
 
         duration = round(time.time() - start_time, 2)
-        logger.info(f"[{request_id}] Query successful, tokens used: {token_count}, cost: ${cost_usd:.6f}, duration: {duration}s")
+        logger.info(f"[{request_id}] Query successful (answer cache: {answer_cache}), tokens used: {token_count}, cost: ${cost_usd:.6f}, duration: {duration}s")
 
         log_metrics({
             "request_id": request_id,
@@ -73,7 +226,10 @@ def query(input: QueryInput):
             "question": input.question,
             "answer": answer,
             "retrieved_chunks": chunks,
+            **context_stats(chunks),
             "embedding_tokens": embedding_tokens,
+            "answer_cache": answer_cache,
+            "route": "llm",
             "llm_tokens": token_count,
             "tokens_total": token_count + embedding_tokens,
             "cost_usd": round(cost_usd, 6),
@@ -85,11 +241,16 @@ def query(input: QueryInput):
             "answer": answer,
             "llm_tokens": token_count,
             "embedding_tokens": embedding_tokens,
+            "answer_cache": answer_cache,
+            "route": "llm",
             "tokens_total": token_count + embedding_tokens,
             "estimated_cost_usd": round(cost_usd, 6),
             "retrieved_chunks": chunks
         }
 
+    except BudgetExceeded as e:
+        logger.warning(f"[{request_id}] Query refused: {e}")
+        return JSONResponse(status_code=402, content={"error": str(e)})
     except Exception as e:
         duration = round(time.time() - start_time, 2)
         error_msg = str(e)
@@ -109,8 +270,17 @@ def query(input: QueryInput):
 
         return {"error": error_msg}
     
+def webhook_pr_number(payload: dict):
+    # pull_request / pull_request_review events carry the PR; issue_comment events carry it as an issue
+    if "pull_request" in payload:
+        return payload["pull_request"].get("number")
+    issue = payload.get("issue") or {}
+    if "pull_request" in issue:
+        return issue.get("number")
+    return None
+
 @app.post("/webhook")
-async def github_webhook(request: Request):
+async def github_webhook(request: Request, background_tasks: BackgroundTasks):
     if not check_redis_connection():
         logger.error("Webhook blocked: Redis is not available.")
         return {"status": "error", "message": "Redis is not available."}
@@ -126,114 +296,175 @@ async def github_webhook(request: Request):
             logger.warning("Webhook received but owner/repo missing in payload")
             return {"status": "ignored"}
 
-        logger.info(f"Webhook received. Invalidating cache and index for: {owner}/{name}")
+        pr_number = webhook_pr_number(payload)
+        logger.info(f"Webhook received. Invalidating cache and syncing index for: {owner}/{name} (PR: {pr_number})")
 
-        # Invalidate Redis cache
-        invalidate_repo_cache(owner, name)
+        # Invalidate Redis cache: just that PR's record for PR events, otherwise the whole repo
+        await ainvalidate_repo_cache(owner, name, pr_number=pr_number)
 
-        # Delete Chroma collection for this repo
-        chroma_client = PersistentClient(path="./chroma_db")
-        collection_name = f"code_review_chunks_{owner}_{name}"
-        try:
-            chroma_client.delete_collection(collection_name)
-            logger.info(f"Deleted Chroma collection: {collection_name}")
-        except Exception as e:
-            logger.warning(f"Chroma collection '{collection_name}' may not exist or failed to delete: {e}")
+        # Re-embed only what changed; runs after the response so GitHub's delivery doesn't time out
+        background_tasks.add_task(sync_repo_index, owner, name, pr_number=pr_number)
 
-        return {"status": "cache and index invalidated", "repo": f"{owner}/{name}"}
+        return {"status": "cache invalidated, index sync scheduled", "repo": f"{owner}/{name}", "pr_number": pr_number}
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
-    
+
+class SyncInput(BaseModel):
+    repo_url: str
+    pr_number: Optional[int] = None
+
+@app.post("/sync")
+def sync_index(input: SyncInput):
+    try:
+        owner, repo = extract_owner_repo(input.repo_url)
+        invalidate_repo_cache(owner, repo, pr_number=input.pr_number)
+        synced = sync_repo_index(owner, repo, pr_number=input.pr_number)
+        return {"status": "synced", "repo": f"{owner}/{repo}", "prs_synced": synced}
+    except Exception as e:
+        logger.error(f"Error syncing index: {e}", exc_info=True)
+        return {"status": "error", "message": str(e)}
+
+async def periodic_sync():
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL_SECONDS)
+        logger.info("Running periodic index sync")
+        try:
+            await run_in_threadpool(sync_all_indexes)
+        except Exception as e:
+            logger.error(f"Periodic sync failed: {e}", exc_info=True)
+
+@app.on_event("startup")
+async def start_periodic_sync():
+    if SYNC_INTERVAL_SECONDS > 0:
+        logger.info(f"Periodic index sync enabled every {SYNC_INTERVAL_SECONDS}s")
+        asyncio.create_task(periodic_sync())
+
+@app.on_event("startup")
+async def start_redis_health_check():
+    # Keeps check_redis_connection's cached status fresh, so handlers never ping Redis themselves
+    asyncio.create_task(monitor_redis_health())
+
+@app.on_event("shutdown")
+def flush_metrics():
+    metrics_writer.close()
+
+@app.on_event("startup")
+async def prune_http_cache():
+    await run_in_threadpool(prune_entries)
+
+@app.on_event("shutdown")
+def close_sqlite_connections():
+    close_all_connections()
+
+class IndexInput(BaseModel):
+    repo_url: str
+    access_token: Optional[str] = None
+
+@app.post("/index")
+def enqueue_index(input: IndexInput):
+    try:
+        owner, repo = extract_owner_repo(input.repo_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        enforce_budget(f"{owner}/{repo}", user_identity(input.access_token))
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=402, detail=str(e))
+    job = job_manager.submit(owner, repo, access_token=input.access_token)
+    return job.to_dict()
+
+@app.get("/index/{job_id}")
+def get_index_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Index job '{job_id}' not found")
+    return job.to_dict()
+
+@app.delete("/index/{job_id}")
+def cancel_index_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Index job '{job_id}' not found")
+    return job.to_dict()
+
+@app.get("/github/rate-limit")
+def get_github_rate_limit():
+    return governor.stats()
+
+@app.get("/embeddings/stats")
+def get_embedding_stats():
+    return embedding_scheduler.stats()
+
+@app.get("/metrics")
+def get_prometheus_metrics():
+    # Prometheus text format; stage timings and counters are only collected with TRACING_ENABLED=true
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/summary")
+def get_metrics_summary(repo_url: Optional[str] = None, since: Optional[str] = None):
+    # since is an ISO timestamp (UTC), compared with each record's timestamp
+    repo = "/".join(extract_owner_repo(repo_url)) if repo_url else None
+    return summarize_metrics(repo=repo, since=since)
+
+@app.get("/cache/stats")
+def get_cache_stats(repo_url: Optional[str] = None):
+    # Process-wide hit ratio and byte counts, plus the stored copy of one repo if repo_url is given
+    if repo_url:
+        owner, repo = extract_owner_repo(repo_url)
+        return repo_cache_stats(owner, repo)
+    return repo_cache_stats()
+
+@app.get("/usage")
+def get_usage(repo_url: Optional[str] = None, user: Optional[str] = None, period: Optional[str] = None):
+    # This month's (or period's, as YYYY-MM) spend and budget for a repo and/or a user identity
+    repo = "/".join(extract_owner_repo(repo_url)) if repo_url else None
+    return spend_report(repo, user, period)
 
 @app.post("/generate-test")
-def generate_test_case(repo_url: HttpUrl = Body(..., embed=True)):
+async def generate_test_case(repo_url: HttpUrl = Body(..., embed=True)):
     parsed = urlparse(str(repo_url))
     try:
         owner, repo = parsed.path.strip("/").split("/", 1)
     except ValueError:
         raise ValueError("Invalid GitHub URL format")
 
-    prs = fetch_pull_requests(owner, repo, state="open", per_page=20)
+    prs = await fetch_pr_commits_async(owner, repo, state="open", per_page=20, max_prs=20)
     if not prs:
         return {"status": "skipped", "reason": "No open PRs found."}
 
-    all_commits = []
-    for pr in prs:
-        pr_commits = fetch_commits(owner, repo, pr["number"])
-        for commit in pr_commits:
-            all_commits.append({
-                "message": commit["commit"]["message"],
-                "author": commit["commit"]["author"]["name"]
-            })
-
-    test_entry = {
-        "repo": f"{owner}/{repo}",
-        "total_commits": len(all_commits),
-        "commits": all_commits
-    }
-
-    save_test_entry(test_entry)
+    test_entry = build_test_entry(f"{owner}/{repo}", prs)
+    await run_in_threadpool(save_test_entry, test_entry)
 
     return {
         "status": "success",
         "repo": test_entry["repo"],
-        "commits_collected": len(all_commits)
+        "commits_collected": test_entry["total_commits"]
     }
 
 @app.get("/run-test")
-def run_single_test(repo: str = Query(...)):
-    test_entry = load_test_entry(repo)
+async def run_single_test(repo: str = Query(...)):
+    test_entry = await run_in_threadpool(load_test_entry, repo)
     if not test_entry:
         return {"status": "error", "message": f"Test data not found for repo '{repo}'"}
 
     owner, name = repo.split("/")
-    token_counter = TokenCountingHandler()
-    index, _ = build_index_from_github(owner, name)
-
-    question = "List all commit messages from open PRs."
-    response_text, _, _, _ = ask_query(index, question, token_counter, use_custom_prompt=False)
-
-    expected = [c["message"].strip().lower() for c in test_entry["commits"]]
-    predicted = [line.strip().lower() for line in response_text.strip().splitlines() if line.strip()]
-    
-    matched_count = 0
-    unmatched = []
-
-    for msg in expected:
-        matched_predicted_line = None
-        found = False
-        for line in predicted:
-            if msg in line:
-                matched_predicted_line = line
-                found = True
-                break # Found a match, no need to check further for this 'msg'
-        if found:
-            matched_count += 1
-        unmatched.append({
-            "expected": msg,
-            "predicted": matched_predicted_line,
-            "found": found
-        })
-
-    total_expected = len(expected)
-    total_predicted = len(predicted)
-
-    precision = matched_count / total_predicted if total_predicted else 0.0
-    recall = matched_count / total_expected if total_expected else 0.0
-    f1_score = (
-        2 * (precision * recall) / (precision + recall) if (precision + recall) else 0.0
-    )
+    # The build is inside the scope so a cold index's embedding tokens are part of the reported usage
+    try:
+        with usage_scope(repo) as usage:
+            index, _ = await abuild_index_from_github(owner, name)
+            structured = await run_in_threadpool(structured_answer, owner, name, EVAL_QUESTION)
+            if structured is not None:
+                response_text = structured["answer"]
+            else:
+                response_text, _, _, _ = await aask_query(index, EVAL_QUESTION, use_custom_prompt=False)
+    except BudgetExceeded as e:
+        return JSONResponse(status_code=402, content={"status": "error", "message": str(e)})
 
     return {
         "repo": repo,
-        "total_commits_expected": total_expected,
-        "total_commits_predicted": total_predicted,
-        "commits_matched": matched_count,
-        "precision": round(precision, 3),
-        "recall": round(recall, 3),
-        "f1_score": round(f1_score, 3),
-        "unmatched_commits": unmatched,
+        **score_answer([c["message"] for c in test_entry["commits"]], response_text),
+        "usage": usage.to_dict(),
     }
 
 # 1. Redirect user to GitHub login
@@ -319,26 +550,44 @@ class AuthQueryInput(BaseModel):
     repo: str
     question: str
     access_token: str
+    stream: bool = False
 
 @app.post("/query/auth")
-def query_with_auth(input: AuthQueryInput):
+async def query_with_auth(input: AuthQueryInput):
     request_id = str(uuid.uuid4())
     start_time = time.time()
 
     try:
         logger.info(f"[{request_id}] Received AUTH query for {input.owner}/{input.repo}")
-        
-        index, token_counter = build_index_from_github(
+        if not await ais_index_ready(input.owner, input.repo):
+            response = indexing_response(input.owner, input.repo, access_token=input.access_token)
+            return sse_response(iter([sse_event("indexing", response)])) if input.stream else response
+
+        structured = await run_in_threadpool(structured_answer, input.owner, input.repo, input.question)
+        if structured is not None:
+            return structured_response(
+                request_id, start_time, input.question, structured,
+                {"repo_url": f"{input.owner}/{input.repo}", "auth_used": True}, input.stream
+            )
+
+        index, _ = await abuild_index_from_github(
             owner=input.owner,
             repo=input.repo,
             access_token=input.access_token
         )
-        
-        answer, token_count, cost_usd, chunks = ask_query(index, input.question, token_counter)
-        embedding_tokens = token_counter.total_embedding_token_count
+
+        if input.stream:
+            return sse_response(stream_answer(
+                request_id, start_time, index, input.owner, input.repo, input.question,
+                user_identity(input.access_token), {"repo_url": f"{input.owner}/{input.repo}", "auth_used": True}
+            ))
+
+        with usage_scope(f"{input.owner}/{input.repo}", user_identity(input.access_token)) as usage:
+            answer, _, _, chunks, answer_cache = await acached_ask_query(index, input.owner, input.repo, input.question)
+        token_count, cost_usd, embedding_tokens = usage.llm_tokens, usage.cost_usd(), usage.embedding_tokens
 
         duration = round(time.time() - start_time, 2)
-        logger.info(f"[{request_id}] AUTH query successful: tokens={token_count}, cost=${cost_usd:.6f}, duration={duration}s")
+        logger.info(f"[{request_id}] AUTH query successful (answer cache: {answer_cache}): tokens={token_count}, cost=${cost_usd:.6f}, duration={duration}s")
 
         log_metrics({
             "request_id": request_id,
@@ -346,7 +595,10 @@ def query_with_auth(input: AuthQueryInput):
             "question": input.question,
             "answer": answer,
             "retrieved_chunks": chunks,
+            **context_stats(chunks),
             "embedding_tokens": embedding_tokens,
+            "answer_cache": answer_cache,
+            "route": "llm",
             "llm_tokens": token_count,
             "tokens_total": token_count + embedding_tokens,
             "cost_usd": round(cost_usd, 6),
@@ -359,11 +611,16 @@ def query_with_auth(input: AuthQueryInput):
             "answer": answer,
             "llm_tokens": token_count,
             "embedding_tokens": embedding_tokens,
+            "answer_cache": answer_cache,
+            "route": "llm",
             "tokens_total": token_count + embedding_tokens,
             "estimated_cost_usd": round(cost_usd, 6),
             "retrieved_chunks": chunks
         }
 
+    except BudgetExceeded as e:
+        logger.warning(f"[{request_id}] AUTH query refused: {e}")
+        return JSONResponse(status_code=402, content={"error": str(e), "request_id": request_id})
     except Exception as e:
         duration = round(time.time() - start_time, 2)
         logger.error(f"[{request_id}] AUTH query failed: {e}", exc_info=True)
@@ -0,0 +1,115 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+import anyio
+import chromadb
+from dotenv import load_dotenv
+from llama_index.core import Settings
+from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.llms.openai import OpenAI
+from utils.accounting import UsageHandler
+from utils.logger import logger
+
+load_dotenv()
+
+CHROMA_PATH = "./chroma_db"
+EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_MODEL = "gpt-4.1-nano"
+
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", 16))
+INDEX_IDLE_SECONDS = int(os.getenv("INDEX_IDLE_SECONDS", 30 * 60))
+# Worker threads allowed to run Chroma calls at once for async request handlers
+CHROMA_CONCURRENCY = int(os.getenv("CHROMA_CONCURRENCY", 8))
+
+# One handler for the life of the app; it attributes tokens to the calling request's usage scope
+Settings.callback_manager.add_handler(UsageHandler(LLM_MODEL, EMBEDDING_MODEL))
+
+
+class Registry:
+    # Objects that are expensive to set up and safe to share for the life of the app:
+    # one Chroma client, the LLM and embedding clients, and an LRU of loaded per-repo indexes.
+
+    def __init__(self, max_indexes: int = INDEX_CACHE_SIZE, idle_seconds: int = INDEX_IDLE_SECONDS):
+        self.max_indexes = max_indexes
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # collection name -> (index, last used)
+        self._chroma_client = None
+        self._llm = None
+        self._embed_model = None
+        self._chroma_limiter = None
+
+    def get_chroma_client(self):
+        with self._lock:
+            if self._chroma_client is None:
+                self._chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+            return self._chroma_client
+
+    def get_chroma_limiter(self):
+        # anyio limiters bind to the running event loop, so this is created on first async use
+        with self._lock:
+            if self._chroma_limiter is None:
+                self._chroma_limiter = anyio.CapacityLimiter(CHROMA_CONCURRENCY)
+            return self._chroma_limiter
+
+    def get_llm(self):
+        with self._lock:
+            if self._llm is None:
+                self._llm = OpenAI(
+                    model=LLM_MODEL,
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    temperature=0,
+                    callback_manager=Settings.callback_manager
+                )
+            return self._llm
+
+    def get_embed_model(self):
+        # Query-time embeddings must come from the same model the collection was built with
+        with self._lock:
+            if self._embed_model is None:
+                self._embed_model = OpenAIEmbedding(
+                    model=EMBEDDING_MODEL,
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    callback_manager=Settings.callback_manager
+                )
+            return self._embed_model
+
+    def get_index(self, name: str):
+        with self._lock:
+            self._evict_idle()
+            entry = self._indexes.get(name)
+            if entry is None:
+                return None
+            self._indexes[name] = (entry[0], time.monotonic())
+            self._indexes.move_to_end(name)
+            return entry[0]
+
+    def put_index(self, name: str, index):
+        with self._lock:
+            self._indexes[name] = (index, time.monotonic())
+            self._indexes.move_to_end(name)
+            while len(self._indexes) > self.max_indexes:
+                evicted, _ = self._indexes.popitem(last=False)
+                logger.info(f"Evicted index '{evicted}' from registry (size limit {self.max_indexes})")
+
+    def evict_index(self, name: str):
+        with self._lock:
+            if self._indexes.pop(name, None) is not None:
+                logger.info(f"Evicted index '{name}' from registry")
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for name in [n for n, (_, last_used) in self._indexes.items() if last_used < cutoff]:
+            del self._indexes[name]
+            logger.info(f"Evicted idle index '{name}' from registry")
+
+
+registry = Registry()
+
+
+async def run_chroma(func, *args, **kwargs):
+    # The Chroma client is synchronous. Async handlers run it on worker threads, at most
+    # CHROMA_CONCURRENCY at a time, so it neither blocks the event loop nor drains the shared threadpool.
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=registry.get_chroma_limiter())
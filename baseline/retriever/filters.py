@@ -0,0 +1,121 @@
+import re
+import time
+from datetime import datetime, timezone
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+
+DAY_SECONDS = 24 * 60 * 60
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 30, "year": 365}
+
+PR_NUMBER_PATTERN = re.compile(r"\b(?:pr|pull request)\s*#?(\d+)\b|#(\d+)\b", re.IGNORECASE)
+STATUS_PATTERN = re.compile(r"\b(open|merged|closed)\b", re.IGNORECASE)
+# "from" only counts with an @-mention; "commits from open PRs" or "from last week" name no author
+AUTHOR_PATTERN = re.compile(r"\bby\s+@?([A-Za-z0-9][A-Za-z0-9-]{0,38})\b|\bfrom\s+@([A-Za-z0-9][A-Za-z0-9-]{0,38})\b", re.IGNORECASE)
+COUNT_PERIOD_PATTERN = re.compile(r"\b(?:last|past)\s+(\d+)\s+(day|week|month|year)s?\b", re.IGNORECASE)
+PERIOD_PATTERN = re.compile(r"\b(?:last|past|this)\s+(day|week|month|year)\b", re.IGNORECASE)
+SINCE_PATTERN = re.compile(r"\bsince\s+(\d{4}-\d{2}-\d{2})\b", re.IGNORECASE)
+COMMITS_PATTERN = re.compile(r"\bcommit", re.IGNORECASE)
+COMMENTS_PATTERN = re.compile(r"\b(?:comment|review|discussion|feedback)", re.IGNORECASE)
+
+# Exact identifiers that lexical search finds reliably and embeddings don't: commit SHAs, PR
+# references, file names and paths, snake_case/camelCase names and quoted strings (error messages)
+IDENTIFIER_PATTERNS = [
+    re.compile(r"\b(?=[0-9a-f]*[a-f])(?=[0-9a-f]*[0-9])[0-9a-f]{7,40}\b"),
+    re.compile(r"#\d+\b|\b(?:pr|pull request)\s*#?\d+\b", re.IGNORECASE),
+    re.compile(r"\b[\w-]+(?:/[\w.-]+)*\.(?:py|js|jsx|ts|tsx|java|go|rs|rb|php|c|cc|cpp|h|hpp|cs|md|json|ya?ml|toml|ini|cfg|txt|sql|sh|css|html)\b"),
+    re.compile(r"\b[a-z0-9]+_[a-z0-9_]+\b|\b[a-z]+[A-Z][A-Za-z0-9]*\b"),
+    re.compile(r"[\"`][^\"`]{3,}[\"`]"),
+]
+
+# Words that follow "by" in questions without naming a GitHub user
+NOT_AUTHORS = {
+    "a", "all", "an", "any", "anyone", "author", "closed", "date", "day", "default", "each", "every", "last", "me", "merged", "open",
+    "month", "now", "number", "past", "pr", "prs", "pull", "someone", "status", "that", "the", "them",
+    "this", "today", "us", "week", "year", "yesterday"
+}
+
+
+def start_of_utc_day(now: float, days_ago: int = 0) -> int:
+    return int(now // DAY_SECONDS - days_ago) * DAY_SECONDS
+
+
+def since_timestamp(question: str, now: float):
+    # Dates and calendar days are UTC, like the timestamps GitHub returns
+    match = SINCE_PATTERN.search(question)
+    if match:
+        return int(datetime.fromisoformat(match.group(1)).replace(tzinfo=timezone.utc).timestamp())
+    match = COUNT_PERIOD_PATTERN.search(question)
+    if match:
+        return int(now - int(match.group(1)) * PERIOD_DAYS[match.group(2).lower()] * DAY_SECONDS)
+    match = PERIOD_PATTERN.search(question)
+    if match:
+        return int(now - PERIOD_DAYS[match.group(1).lower()] * DAY_SECONDS)
+    if re.search(r"\byesterday\b", question, re.IGNORECASE):
+        return start_of_utc_day(now, days_ago=1)
+    if re.search(r"\btoday\b", question, re.IGNORECASE):
+        return start_of_utc_day(now)
+    return None
+
+
+def is_identifier_query(question: str) -> bool:
+    return any(pattern.search(question) for pattern in IDENTIFIER_PATTERNS)
+
+
+def parse_filters(question: str, now: float = None) -> dict:
+    # Constraints the question names: PR number, statuses, author, content type ("commits" or
+    # "comments") and a recency bound in epoch seconds. Missing ones are None.
+    now = time.time() if now is None else now
+
+    match = PR_NUMBER_PATTERN.search(question)
+    pr_number = int(match.group(1) or match.group(2)) if match else None
+
+    statuses = sorted({m.lower() for m in STATUS_PATTERN.findall(question)}) or None
+
+    authors = [by or at for by, at in AUTHOR_PATTERN.findall(question) if (by or at).lower() not in NOT_AUTHORS]
+
+    # Only narrow by content type when the question is clearly about one kind of content
+    wants_commits = bool(COMMITS_PATTERN.search(question))
+    wants_comments = bool(COMMENTS_PATTERN.search(question))
+    node_type = None
+    if wants_commits != wants_comments:
+        node_type = "commits" if wants_commits else "comments"
+
+    return {
+        "pr_number": pr_number,
+        "statuses": statuses,
+        "author": authors[0] if authors else None,
+        "node_type": node_type,
+        "since": since_timestamp(question, now)
+    }
+
+
+def query_filters(question: str, now: float = None):
+    # Chroma metadata pre-filters for the question, or None when it names no constraint.
+    # Matches the node metadata written by retriever.record_to_nodes.
+    parsed = parse_filters(question, now)
+    filters = []
+
+    if parsed["pr_number"] is not None:
+        filters.append(MetadataFilter(key="pr_number", value=parsed["pr_number"]))
+
+    statuses = parsed["statuses"]
+    if statuses and len(statuses) == 1:
+        filters.append(MetadataFilter(key="status", value=statuses[0]))
+    elif statuses:
+        filters.append(MetadataFilter(key="status", value=statuses, operator=FilterOperator.IN))
+
+    if parsed["author"]:
+        filters.append(MetadataFilter(key="author", value=parsed["author"]))
+
+    if parsed["node_type"]:
+        filters.append(MetadataFilter(key="node_type", value=parsed["node_type"]))
+
+    if parsed["since"] is not None:
+        filters.append(MetadataFilter(key="updated_ts", value=parsed["since"], operator=FilterOperator.GTE))
+
+    return MetadataFilters(filters=filters) if filters else None
+
+
+def describe_filters(filters) -> str:
+    if filters is None:
+        return "none"
+    return ", ".join(f"{f.key} {f.operator.value} {f.value}" for f in filters.filters)
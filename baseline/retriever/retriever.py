@@ -1,64 +1,392 @@
-from llama_index.core import VectorStoreIndex, StorageContext, Document
+from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
-import chromadb
+from llama_index.core.callbacks.token_counting import TokenCountingEvent
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode, NodeRelationship, RelatedNodeInfo, TextNode
+from chromadb.errors import NotFoundError
+import functools
 import os
+from datetime import datetime
+import anyio
 from dotenv import load_dotenv
-from specialization.github_client import fetch_and_format
+from baseline.embedding_scheduler import embedding_scheduler
+from baseline.registry import EMBEDDING_MODEL, registry, run_chroma
+from specialization.github_client import (
+    fetch_pr_record, format_pr_comments, format_pr_commits, format_pr_header, iter_pr_records, iter_updated_pr_records
+)
+from utils.accounting import enforce_budget, record_tokens, usage_scope, user_identity
+from utils.cache import bump_repo_version, cache_pr_records, single_flight
+from utils.embedding_cache import get_cached_embeddings, set_cached_embeddings
+from utils.lexical_index import clear_collection, replace_nodes
 from utils.logger import logger
+from utils.pr_store import clear_repo, replace_pr_records
+from utils.tracing import count_cache_lookup, span, timed_iter
 
 load_dotenv()
 
-CHROMA_PATH = "./chroma_db"
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", 50))
+COMMITS_PER_NODE = int(os.getenv("COMMITS_PER_NODE", 20))
+COMMENTS_PER_NODE = int(os.getenv("COMMENTS_PER_NODE", 10))
 
-def build_index_from_github(owner: str, repo: str, access_token: str = None):
-    logger.info(f"Checking for existing index for GitHub repo: {owner}/{repo}")
-    collection_name = f"code_review_chunks_{owner}_{repo}"
+# Bump when the node layout changes; collections stamped with an older schema are rebuilt
+INDEX_SCHEMA_VERSION = 4
 
-    token_counter = TokenCountingHandler()
-    callback_manager = CallbackManager([token_counter])
+# Metadata kept on every node and filterable in Chroma; excluded from the embedded and LLM text.
+# Chroma only compares numbers with $gt/$lt, so dates are also stored as epoch seconds.
+PR_METADATA_KEYS = ["pr_number", "node_type", "status", "author", "created_at", "updated_at", "created_ts", "updated_ts"]
+
+node_splitter = SentenceSplitter()
+
+class IndexTokenCounter(TokenCountingHandler):
+    # Token counts plus how many chunk embeddings came from the embedding cache
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.embedding_cache_hits = 0
+        self.embedding_cache_misses = 0
+
+    def add_embedding_tokens(self, tokens: int):
+        # Index builds embed through the shared scheduler, which bypasses the callback manager
+        self.embedding_token_counts.append(
+            TokenCountingEvent(prompt="", completion="", prompt_token_count=tokens, completion_token_count=0)
+        )
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def get_collection_name(owner: str, repo: str) -> str:
+    return f"code_review_chunks_{owner}_{repo}"
+
+def pr_doc_id(pr_number: int) -> str:
+    return f"pr-{pr_number}"
+
+def iso_to_ts(value: str) -> int:
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
 
-    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    all_collections = [c.name for c in chroma_client.list_collections()]
+def record_sections(record: dict) -> list:
+    # (node_type, context, body) per typed node: the header and description, then the commit list
+    # and the comment thread in fixed-size groups. The context line keeps every node self-describing.
+    context = f"PR #{record['pr_number']}: {record['title']} ({record['status'].upper()}, by {record['author']})\n"
+    sections = [("header", "", format_pr_header(record))]
 
-    if collection_name in all_collections:
-        logger.info(f"Found existing collection '{collection_name}'. Reusing index.")
+    commits = record["commits"]
+    for start in range(0, len(commits), COMMITS_PER_NODE):
+        sections.append(("commits", context, format_pr_commits(commits[start:start + COMMITS_PER_NODE], total=len(commits))))
+
+    comments = record["comments"]
+    for start in range(0, len(comments), COMMENTS_PER_NODE):
+        sections.append(("comments", context, format_pr_comments(comments[start:start + COMMENTS_PER_NODE], total=len(comments))))
+    return sections
+
+def record_to_nodes(record: dict) -> list:
+    # All nodes of a PR share its doc id as their source, so delete_ref_doc replaces them together
+    doc_id = pr_doc_id(record["pr_number"])
+    metadata = {
+        "pr_number": record["pr_number"],
+        "status": record["status"],
+        "author": record["author"],
+        "created_at": record["created_at"],
+        "updated_at": record["updated_at"],
+        "created_ts": iso_to_ts(record["created_at"]),
+        "updated_ts": iso_to_ts(record["updated_at"])
+    }
+
+    nodes = []
+    for node_type, context, body in record_sections(record):
+        # Oversized sections (long descriptions or comments) are split further by size
+        for text in node_splitter.split_text(body):
+            nodes.append(TextNode(
+                id_=f"{doc_id}:{node_type}:{len(nodes)}",
+                text=context + text,
+                metadata={**metadata, "node_type": node_type},
+                excluded_embed_metadata_keys=PR_METADATA_KEYS,
+                excluded_llm_metadata_keys=PR_METADATA_KEYS,
+                relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc_id)}
+            ))
+    return nodes
+
+def get_indexed_collection(chroma_client, collection_name: str):
+    # A collection only counts as an index once a build has finished and stamped it
+    try:
         collection = chroma_client.get_collection(collection_name)
-        vector_store = ChromaVectorStore(chroma_collection=collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    except NotFoundError:
+        return None
 
-        index = VectorStoreIndex.from_vector_store(vector_store=vector_store, storage_context=storage_context)
-        return index, token_counter
+    metadata = collection.metadata or {}
+    if not metadata.get("last_synced_at"):
+        return None
+    if metadata.get("schema") != INDEX_SCHEMA_VERSION:
+        logger.info(f"Collection '{collection_name}' uses an older node layout and needs a rebuild.")
+        return None
+    return collection
 
-    logger.info(f"No existing index. Building new index for {owner}/{repo}")
-    texts = fetch_and_format(owner, repo, access_token=access_token)
+def index_lock_key(owner: str, repo: str) -> str:
+    return f"index:{owner}/{repo}"
 
-    if not texts:
-        logger.warning(f"No PR data found for {owner}/{repo}")
-        raise ValueError(f"No pull request data found for repo: {owner}/{repo}")
+def drop_collection(chroma_client, collection_name: str):
+    registry.evict_index(collection_name)
+    chroma_client.delete_collection(collection_name)
+    clear_collection(collection_name)
 
-    documents = [Document(text=t) for t in texts]
+def mark_synced(collection, last_synced_at: str):
+    metadata = dict(collection.metadata or {})
+    if last_synced_at and last_synced_at > metadata.get("last_synced_at", ""):
+        metadata["last_synced_at"] = last_synced_at
+        collection.modify(metadata=metadata)
 
-    embed_model = OpenAIEmbedding(
-        model="text-embedding-3-small",
-        api_key=os.getenv("OPENAI_API_KEY"),
-        callback_manager=callback_manager
-    )
+def embed_nodes_with_cache(nodes: list, embed_model, token_counter: IndexTokenCounter = None):
+    # Fills node.embedding from the cache and sends only the misses to the embedding API, through the
+    # scheduler shared by every build
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    vectors = get_cached_embeddings(embed_model.model_name, texts)
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        new_vectors, tokens = embedding_scheduler.embed(miss_texts)
+        record_tokens("embedding", embed_model.model_name, tokens)
+        if token_counter is not None:
+            token_counter.add_embedding_tokens(tokens)
+        set_cached_embeddings(embed_model.model_name, miss_texts, new_vectors)
+        for i, vector in zip(misses, new_vectors):
+            vectors[i] = vector
+
+    for node, vector in zip(nodes, vectors):
+        node.embedding = vector
 
-    collection = chroma_client.get_or_create_collection(collection_name)
+    hits = len(nodes) - len(misses)
+    count_cache_lookup("embedding", "hit", hits)
+    count_cache_lookup("embedding", "miss", len(misses))
+    if token_counter is not None:
+        token_counter.embedding_cache_hits += hits
+        token_counter.embedding_cache_misses += len(misses)
+    logger.info(f"Embedding cache: {hits} hits, {len(misses)} misses")
+
+def upsert_pr_records(index: VectorStoreIndex, records: list, embed_model, replace: bool = True, token_counter: IndexTokenCounter = None):
+    # Replace the PR's previous nodes (stored under its stable doc id) with freshly embedded ones,
+    # in Chroma and in the lexical index kept next to it
+    doc_ids = [pr_doc_id(record["pr_number"]) for record in records] if replace else []
+    nodes = [node for record in records for node in record_to_nodes(record)]
+    with span("embed", nodes=len(nodes)):
+        embed_nodes_with_cache(nodes, embed_model, token_counter)
+    with span("vector_store_write", nodes=len(nodes)):
+        for doc_id in doc_ids:
+            index.delete_ref_doc(doc_id)
+        index.insert_nodes(nodes)
+    with span("lexical_index_write", nodes=len(nodes)):
+        replace_nodes(index.vector_store.client.name, doc_ids, nodes)
+    return max((record["updated_at"] for record in records), default="")
+
+def load_index(collection, callback_manager=None, embed_model=None):
     vector_store = ChromaVectorStore(chroma_collection=collection)
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    index = VectorStoreIndex.from_documents(
-        documents,
+    return VectorStoreIndex.from_vector_store(
+        vector_store=vector_store,
         storage_context=storage_context,
         embed_model=embed_model,
         callback_manager=callback_manager
     )
 
+def build_embed_model(callback_manager):
+    return OpenAIEmbedding(
+        model=EMBEDDING_MODEL,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        callback_manager=callback_manager
+    )
+
+def is_index_ready(owner: str, repo: str) -> bool:
+    collection_name = get_collection_name(owner, repo)
+    if registry.get_index(collection_name) is not None:
+        return True
+    return get_indexed_collection(registry.get_chroma_client(), collection_name) is not None
+
+def build_index_from_github(owner: str, repo: str, access_token: str = None, job=None):
+    # job, when given, is a baseline.jobs.IndexJob that receives progress and may cancel the build
+    logger.info(f"Checking for existing index for GitHub repo: {owner}/{repo}")
+    collection_name = get_collection_name(owner, repo)
+
+    token_counter = IndexTokenCounter()
+
+    # Warm path: the index is already loaded in this process
+    index = registry.get_index(collection_name)
+    if index is not None:
+        return index, token_counter
+
+    with span("chroma_client"):
+        chroma_client = registry.get_chroma_client()
+        collection = get_indexed_collection(chroma_client, collection_name)
+
+    if collection is None:
+        # Single flight: one build per repo across threads and workers; the rest wait and reuse it
+        with single_flight(index_lock_key(owner, repo)):
+            collection = get_indexed_collection(chroma_client, collection_name)
+            if collection is None:
+                with span("index_build", repo=f"{owner}/{repo}"):
+                    return build_new_index(owner, repo, chroma_client, token_counter, access_token=access_token, job=job)
+            logger.info(f"Index for {owner}/{repo} was built by a concurrent request.")
+
+    logger.info(f"Found existing collection '{collection_name}'. Reusing index.")
+    with span("index_load", repo=f"{owner}/{repo}"):
+        index = load_index(collection, embed_model=registry.get_embed_model())
+    registry.put_index(collection_name, index)
+    return index, token_counter
+
+async def ais_index_ready(owner: str, repo: str) -> bool:
+    if registry.get_index(get_collection_name(owner, repo)) is not None:
+        return True
+    return await run_chroma(is_index_ready, owner, repo)
+
+async def abuild_index_from_github(owner: str, repo: str, access_token: str = None):
+    # Async entry point for request handlers. Loaded indexes come straight from the registry and an
+    # existing collection is loaded under the Chroma limiter; a cold build (minutes of GitHub and
+    # embedding calls) runs on the regular threadpool so it doesn't hold a Chroma slot.
+    index = registry.get_index(get_collection_name(owner, repo))
+    if index is not None:
+        return index, IndexTokenCounter()
+    if await run_chroma(is_index_ready, owner, repo):
+        return await run_chroma(build_index_from_github, owner, repo, access_token=access_token)
+    return await anyio.to_thread.run_sync(functools.partial(build_index_from_github, owner, repo, access_token=access_token))
+
+def build_new_index(owner: str, repo: str, chroma_client, token_counter: IndexTokenCounter, access_token: str = None, job=None):
+    # Callers must hold the repo's single-flight lock. Embedding spend is charged to the repo and
+    # the token's user, and a repo or user over budget is refused before anything is fetched.
+    with usage_scope(f"{owner}/{repo}", user_identity(access_token)):
+        enforce_budget()
+        return build_index_locked(owner, repo, chroma_client, token_counter, access_token=access_token, job=job)
+
+def build_index_locked(owner: str, repo: str, chroma_client, token_counter: IndexTokenCounter, access_token: str = None, job=None):
+    logger.info(f"No existing index. Building new index for {owner}/{repo}")
+    collection_name = get_collection_name(owner, repo)
+
+    try:
+        chroma_client.get_collection(collection_name)
+        logger.warning(f"Collection '{collection_name}' is unfinished or outdated. Dropping it for a rebuild.")
+        drop_collection(chroma_client, collection_name)
+    except NotFoundError:
+        pass
+
+    callback_manager = CallbackManager([token_counter])
+    embed_model = build_embed_model(callback_manager)
+
+    collection = chroma_client.get_or_create_collection(
+        collection_name, metadata={"repo": f"{owner}/{repo}", "schema": INDEX_SCHEMA_VERSION}
+    )
+    # The structured PR store and the lexical index are filled alongside the collection and must match it
+    clear_repo(f"{owner}/{repo}")
+    clear_collection(collection_name)
+    index = load_index(collection, callback_manager=callback_manager, embed_model=embed_model)
+
+    # Consume the PR stream in batches so memory stays bounded on large repos
+    document_count = 0
+    last_synced_at = ""
+    try:
+        records_stream = timed_iter("fetch_prs", iter_pr_records(owner, repo, access_token=access_token), repo=f"{owner}/{repo}")
+        for records in batched(records_stream, INDEX_BATCH_SIZE):
+            last_synced_at = max(last_synced_at, upsert_pr_records(index, records, embed_model, replace=False, token_counter=token_counter))
+            with span("pr_store_write", records=len(records)):
+                replace_pr_records(f"{owner}/{repo}", records)
+            document_count += len(records)
+            logger.info(f"Indexed {document_count} PR documents for {owner}/{repo}")
+            if job is not None:
+                chunks_embedded = token_counter.embedding_cache_hits + token_counter.embedding_cache_misses
+                job.update_progress(document_count, chunks_embedded)
+    except Exception:
+        # Never leave a half-built collection behind to be picked up as a finished index
+        drop_collection(chroma_client, collection_name)
+        raise
+
+    if not document_count:
+        logger.warning(f"No PR data found for {owner}/{repo}")
+        drop_collection(chroma_client, collection_name)
+        raise ValueError(f"No pull request data found for repo: {owner}/{repo}")
+
+    mark_synced(collection, last_synced_at)
+
     embedding_tokens = token_counter.total_embedding_token_count
-    logger.info(f"Embedding tokens used: {embedding_tokens}")
+    logger.info(
+        f"Embedding tokens used: {embedding_tokens} "
+        f"(cache hits: {token_counter.embedding_cache_hits}, misses: {token_counter.embedding_cache_misses})"
+    )
+
+    # Serve queries from an index bound to the shared embedding client, not this build's counter
+    index = load_index(collection, embed_model=registry.get_embed_model())
+    registry.put_index(collection_name, index)
 
     logger.info(f"Index built and stored for {owner}/{repo}")
     return index, token_counter
+
+def sync_repo_index(owner: str, repo: str, pr_number: int = None, access_token: str = None) -> int:
+    # Re-embeds only the PRs that changed and upserts them into the existing collection.
+    # With pr_number, just that PR is refreshed; otherwise every PR updated since the last sync.
+    with usage_scope(f"{owner}/{repo}", user_identity(access_token)):
+        enforce_budget()
+        with single_flight(index_lock_key(owner, repo)):
+            return sync_index_locked(owner, repo, pr_number=pr_number, access_token=access_token)
+
+def sync_index_locked(owner: str, repo: str, pr_number: int = None, access_token: str = None) -> int:
+    collection_name = get_collection_name(owner, repo)
+    chroma_client = registry.get_chroma_client()
+    collection = get_indexed_collection(chroma_client, collection_name)
+
+    if collection is None:
+        logger.info(f"No index for {owner}/{repo} yet; nothing to sync.")
+        return 0
+
+    token_counter = IndexTokenCounter()
+    callback_manager = CallbackManager([token_counter])
+    embed_model = build_embed_model(callback_manager)
+    index = load_index(collection, callback_manager=callback_manager, embed_model=embed_model)
+
+    if pr_number is not None:
+        with span("fetch_prs", repo=f"{owner}/{repo}", pr_number=pr_number):
+            records = [fetch_pr_record(owner, repo, pr_number, access_token=access_token)]
+    else:
+        since = collection.metadata["last_synced_at"]
+        records = timed_iter("fetch_prs", iter_updated_pr_records(owner, repo, since=since, access_token=access_token), repo=f"{owner}/{repo}")
+
+    synced = 0
+    last_synced_at = ""
+    for batch in batched(records, INDEX_BATCH_SIZE):
+        last_synced_at = max(last_synced_at, upsert_pr_records(index, batch, embed_model, token_counter=token_counter))
+        replace_pr_records(f"{owner}/{repo}", batch)
+        # Only the changed PRs' fields in the repo cache are rewritten
+        cache_pr_records(owner, repo, batch, only_if_cached=True)
+        synced += len(batch)
+
+    # A single-PR refresh says nothing about other PRs, so only a full pass moves the watermark
+    if pr_number is None:
+        mark_synced(collection, last_synced_at)
+
+    # Answers cached while the sync was running may predate it
+    if synced:
+        bump_repo_version(owner, repo)
+
+    logger.info(
+        f"Synced {synced} PRs for {owner}/{repo}, "
+        f"embedding tokens used: {token_counter.total_embedding_token_count} "
+        f"(cache hits: {token_counter.embedding_cache_hits}, misses: {token_counter.embedding_cache_misses})"
+    )
+    return synced
+
+def sync_all_indexes(access_token: str = None) -> dict:
+    chroma_client = registry.get_chroma_client()
+    results = {}
+    for collection in chroma_client.list_collections():
+        full_name = (collection.metadata or {}).get("repo")
+        if not full_name:
+            continue
+        owner, repo = full_name.split("/", 1)
+        try:
+            results[full_name] = sync_repo_index(owner, repo, access_token=access_token)
+        except Exception as e:
+            logger.error(f"Periodic sync failed for {full_name}: {e}", exc_info=True)
+            results[full_name] = None
+    return results
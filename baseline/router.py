@@ -0,0 +1,138 @@
+import os
+import re
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from baseline.retriever.filters import (
+    AUTHOR_PATTERN, COUNT_PERIOD_PATTERN, PERIOD_PATTERN, PR_NUMBER_PATTERN, SINCE_PATTERN, STATUS_PATTERN, parse_filters
+)
+from utils.logger import logger
+from utils.pr_store import find_rows, has_author
+
+load_dotenv()
+
+# Longest list the structured path writes out; the answer still reports the full count
+STRUCTURED_MAX_ROWS = int(os.getenv("STRUCTURED_MAX_ROWS", 1000))
+
+ENUMERATION_PATTERN = re.compile(
+    r"^\s*(?:please\s+)?(?:list|show|enumerate|give me|get|display|print|which|what are|how many|count)\b"
+    r"|\b(?:list|show) (?:all|every)\b|\bnumber of\b",
+    re.IGNORECASE
+)
+COUNT_PATTERN = re.compile(r"\bhow many\b|\bcount\b|\bnumber of\b", re.IGNORECASE)
+# Questions that need reasoning over the content go to the LLM even when phrased as a list
+OPEN_ENDED_PATTERN = re.compile(
+    r"\b(?:why|explain|summari[sz]e|summary|describe|about|how does|how do|what does|should|"
+    r"improve|risk|bug|issue|problem|reason|purpose|opinion|quality)\b",
+    re.IGNORECASE
+)
+ENTITY_PATTERN = re.compile(r"\b(?:prs?|pull requests?|commits?|comments?|reviews?)\b", re.IGNORECASE)
+
+RELATIVE_DAY_PATTERN = re.compile(r"\b(?:today|yesterday)\b", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+# Phrases the PR store can act on; anything else left in a question is a topic it can't search
+FILTER_PHRASE_PATTERNS = (
+    ENUMERATION_PATTERN, COUNT_PATTERN, ENTITY_PATTERN, PR_NUMBER_PATTERN, STATUS_PATTERN, AUTHOR_PATTERN,
+    COUNT_PERIOD_PATTERN, PERIOD_PATTERN, SINCE_PATTERN, RELATIVE_DAY_PATTERN
+)
+# Words that say nothing about what the PRs, commits or comments contain
+FILLER_WORDS = {
+    "a", "ago", "all", "an", "and", "any", "are", "authored", "been", "by", "created", "day", "days", "did", "do",
+    "does", "each", "ever", "every", "far", "for", "from", "get", "give", "has", "have", "in", "is", "it", "its",
+    "last", "latest", "left", "list", "made", "me", "message", "messages", "month", "months", "most", "my", "of",
+    "on", "opened", "or", "our", "past", "please", "posted", "pull", "pushed", "recent", "recently", "repo",
+    "repository", "request", "requests", "show", "since", "so", "submitted", "that", "the", "their", "there",
+    "these", "this", "those", "to", "total", "was", "we", "week", "weeks", "were", "what", "which", "who",
+    "with", "written", "year", "years"
+}
+
+ENTITY_TABLES = {None: "prs", "commits": "commits", "comments": "comments"}
+ENTITY_NAMES = {"prs": "PRs", "commits": "commits", "comments": "comments"}
+
+
+def iso_since(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def content_terms(question: str) -> list:
+    # What the question asks about beyond the filters the PR store applies, e.g. ["touch", "module_7"]
+    # for "Which PRs touch module_7?"
+    text = question
+    for pattern in FILTER_PHRASE_PATTERNS:
+        text = pattern.sub(" ", text)
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in FILLER_WORDS]
+
+
+def is_enumeration(question: str) -> bool:
+    # Only questions made up entirely of filters: a topic ("PRs that change the README") needs retrieval
+    return (
+        bool(ENUMERATION_PATTERN.search(question))
+        and bool(ENTITY_PATTERN.search(question))
+        and not OPEN_ENDED_PATTERN.search(question)
+        and not content_terms(question)
+    )
+
+
+def format_row(table: str, row: dict) -> str:
+    if table == "prs":
+        return f"- PR #{row['pr_number']}: {row['title']} ({row['status'].upper()}, by {row['author']}, updated {row['updated_at']})"
+    if table == "commits":
+        return f"- {row['message']} (by {row['author']} on {row['date']}) [{row['sha'][:7]}] in PR #{row['pr_number']}"
+    return f"- Comment by {row['author']} on {row['created_at']} in PR #{row['pr_number']}: {row['body']}"
+
+
+def describe_scope(table: str, filters: dict) -> str:
+    parts = [ENTITY_NAMES[table]]
+    if filters["statuses"]:
+        states = " or ".join(filters["statuses"])
+        parts = [f"{states} PRs"] if table == "prs" else parts + [f"in {states} PRs"]
+    if filters["pr_number"] is not None:
+        parts.append(f"in PR #{filters['pr_number']}")
+    if filters["author"]:
+        parts.append(f"by {filters['author']}")
+    if filters["since"] is not None:
+        parts.append(f"since {iso_since(filters['since'])}")
+    return " ".join(parts)
+
+
+def structured_answer(owner: str, repo: str, question: str):
+    # Answers list/count/filter questions about PRs, commits and comments straight from the PR store,
+    # with complete results and no LLM call. Returns None when the question needs the LLM.
+    if not is_enumeration(question):
+        return None
+
+    filters = parse_filters(question)
+    table = ENTITY_TABLES[filters["node_type"]]
+    full_name = f"{owner}/{repo}"
+
+    # An unknown "author" is more likely a misread phrase than a real user with nothing to show
+    if filters["author"] and not has_author(full_name, filters["author"]):
+        logger.info(f"Router: '{filters['author']}' is not an author in {full_name}; using the LLM")
+        return None
+
+    result = find_rows(
+        table, full_name,
+        pr_number=filters["pr_number"],
+        statuses=filters["statuses"],
+        author=filters["author"],
+        since=iso_since(filters["since"]) if filters["since"] is not None else None,
+        limit=STRUCTURED_MAX_ROWS
+    )
+    if result is None:
+        return None
+    total, rows = result
+
+    # A listing's answer is its rows alone, one per line, so scoring it doesn't count a header or
+    # trailer as predicted lines; the count and any truncation go in "summary"
+    scope = describe_scope(table, filters)
+    summary = f"{total} {scope}"
+    if total > len(rows):
+        summary += f", showing the first {len(rows)}"
+    if COUNT_PATTERN.search(question):
+        answer = f"There are {total} {scope}."
+    elif not rows:
+        answer = f"No {scope} found."
+    else:
+        answer = "\n".join(format_row(table, row) for row in rows)
+
+    logger.info(f"Router: answered '{question}' from the PR store ({table}, {total} rows)")
+    return {"answer": answer, "rows": total, "summary": summary}
@@ -0,0 +1,109 @@
+"""Per-request setup overhead of loading a repo index, before and after the registry.
+
+Runs fully offline against a throwaway Chroma directory filled with synthetic vectors:
+
+    python -m benchmarks.bench_registry --chunks 2000 --requests 50
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")  # clients are constructed, never called
+
+import chromadb
+from llama_index.core import MockEmbedding, StorageContext, VectorStoreIndex
+from llama_index.llms.openai import OpenAI
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+import baseline.registry as registry_module
+from baseline.registry import LLM_MODEL, Registry
+from baseline.retriever import retriever
+
+OWNER, REPO = "bench", "repo"
+EMBED_DIM = 1536
+
+
+def seed_collection(path: str, chunks: int):
+    client = chromadb.PersistentClient(path=path)
+    collection = client.get_or_create_collection(
+        retriever.get_collection_name(OWNER, REPO),
+        metadata={"repo": f"{OWNER}/{REPO}", "last_synced_at": "2024-01-01T00:00:00Z"}
+    )
+    rng = random.Random(0)
+    for start in range(0, chunks, 500):
+        ids = [f"chunk-{i}" for i in range(start, min(start + 500, chunks))]
+        collection.add(
+            ids=ids,
+            embeddings=[[rng.random() for _ in range(EMBED_DIM)] for _ in ids],
+            documents=[f"PR #{i}: synthetic chunk" for i in range(len(ids))],
+            metadatas=[{"document_id": f"pr-{i}", "doc_id": f"pr-{i}", "ref_doc_id": f"pr-{i}"} for i in range(len(ids))]
+        )
+
+
+def setup_before(path: str, embed_model):
+    # What every /query paid before: new client, collection scan, index rebuild, new LLM client
+    chroma_client = chromadb.PersistentClient(path=path)
+    collection_name = retriever.get_collection_name(OWNER, REPO)
+    all_collections = [c.name for c in chroma_client.list_collections()]
+    assert collection_name in all_collections
+    collection = chroma_client.get_collection(collection_name)
+    vector_store = ChromaVectorStore(chroma_collection=collection)
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    index = VectorStoreIndex.from_vector_store(
+        vector_store=vector_store, storage_context=storage_context, embed_model=embed_model
+    )
+    llm = OpenAI(model=LLM_MODEL, api_key=os.getenv("OPENAI_API_KEY"), temperature=0)
+    return index, llm
+
+
+def setup_after():
+    index, _ = retriever.build_index_from_github(OWNER, REPO)
+    return index, registry_module.registry.get_llm()
+
+
+def measure(fn, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list):
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<28} mean {statistics.mean(timings):8.3f} ms   p50 {statistics.median(timings):8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix="bench_chroma_")
+    registry_module.CHROMA_PATH = path
+    seed_collection(path, args.chunks)
+
+    embed_model = MockEmbedding(embed_dim=EMBED_DIM)
+    registry_module.registry = Registry()
+    registry_module.registry._embed_model = embed_model
+    retriever.registry = registry_module.registry
+
+    before = measure(lambda: setup_before(path, embed_model), args.requests)
+
+    first = measure(setup_after, 1)  # cold: loads the collection into the registry
+    after = measure(setup_after, args.requests)
+
+    print(f"Setup overhead per request ({args.chunks} chunks, {args.requests} requests)")
+    report("before (per-request setup)", before)
+    report("after, first request", first)
+    report("after, warm requests", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Checks that the REST and GraphQL ingestion backends produce identical PR records.
+
+First both backends fetch the recorded repository in benchmarks/fixtures (GitHub's real REST and
+GraphQL response shapes, served by benchmarks.stubs.create_fixture_github_app) and their records
+must equal expected_records.json. Then both run against the synthetic GitHub stub for a full
+fetch, an updated-since fetch and a single-PR fetch, the records are compared field by field, and
+the report shows how many HTTP requests and how much time each backend needed. Exits non-zero on
+a mismatch.
+
+    python -m benchmarks.compare_backends --prs 300
+    python -m benchmarks.compare_backends --prs 50 --commits-per-pr 150   # nested pagination
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from benchmarks.loadtest import free_port
+from benchmarks.stubs import create_fixture_github_app, create_github_app, load_expected_records, start_server
+
+
+def without_text(records: list) -> list:
+    # "text" is rendered from the other fields, so comparing those is enough
+    return [{key: value for key, value in record.items() if key != "text"} for record in records]
+
+
+def check_fixtures(github_client, github_graphql) -> dict:
+    # Each backend's records for the recorded repository, compared with the expected ones
+    port = free_port()
+    start_server(create_fixture_github_app(), port)
+    expected = load_expected_records()
+    owner, repo = expected["repository"].split("/")
+    since = expected["since"]
+    checks = {
+        "full": (
+            lambda source: list(github_client.iter_sync(source.iter_pr_records_async(owner, repo))),
+            expected["records"],
+        ),
+        "updated_since": (
+            lambda source: list(github_client.iter_sync(source.iter_updated_pr_records_async(owner, repo, since=since))),
+            sorted((r for r in expected["records"] if r["updated_at"] > since), key=lambda r: r["updated_at"], reverse=True),
+        ),
+        "single_pr": (
+            lambda source: [github_client.asyncio.run(source.fetch_pr_record_async(owner, repo, r["pr_number"]))
+                            for r in expected["records"]],
+            expected["records"],
+        ),
+    }
+
+    saved = github_client.GITHUB_API_URL, github_graphql.GITHUB_GRAPHQL_URL
+    github_client.GITHUB_API_URL = f"http://127.0.0.1:{port}"
+    github_graphql.GITHUB_GRAPHQL_URL = f"http://127.0.0.1:{port}/graphql"
+    report = {}
+    try:
+        for name, (fetch, wanted) in checks.items():
+            report[name] = {}
+            for backend in ("rest", "graphql"):
+                github_client.GITHUB_BACKEND = backend
+                records = without_text(fetch(github_client.record_source()))
+                report[name][backend] = {
+                    "matches_fixture": records == wanted,
+                    "differing_prs": sorted({r["pr_number"] for r in records if r not in wanted} |
+                                            {r["pr_number"] for r in wanted if r not in records}),
+                }
+    finally:
+        github_client.GITHUB_API_URL, github_graphql.GITHUB_GRAPHQL_URL = saved
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prs", type=int, default=300)
+    parser.add_argument("--commits-per-pr", type=int, default=3)
+    parser.add_argument("--comments-per-pr", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    port = free_port()
+    stub = create_github_app(args.prs, args.latency_ms, comments_per_pr=args.comments_per_pr, commits_per_pr=args.commits_per_pr)
+    start_server(stub, port)
+    workdir = tempfile.mkdtemp(prefix="compare-backends-")
+    # The GraphQL API needs a token. Request counts include 304s from the REST backend's ETag cache.
+    os.environ.update(
+        GITHUB_API_URL=f"http://127.0.0.1:{port}",
+        GITHUB_TOKEN="stub-token",
+        HTTP_CACHE_PATH=os.path.join(workdir, "http_cache.db"),
+    )
+
+    # Imported after the environment points at the stub
+    import specialization.github_client as github_client
+    import specialization.github_graphql as github_graphql
+
+    report, mismatches = {"fixtures": check_fixtures(github_client, github_graphql)}, []
+    for name, backends in report["fixtures"].items():
+        mismatches += [f"fixtures/{name}/{backend}" for backend, result in backends.items() if not result["matches_fixture"]]
+
+    def run(backend: str, fetch):
+        github_client.GITHUB_BACKEND = backend
+        source = github_client.record_source()
+        before = sum(stub.state.requests.values())
+        started = time.monotonic()
+        records = fetch(source)
+        return records, {
+            "requests": sum(stub.state.requests.values()) - before,
+            "seconds": round(time.monotonic() - started, 2),
+        }
+
+    since = "2024-02-20T00:00:00Z"
+    checks = {
+        "full": lambda source: list(github_client.iter_sync(source.iter_pr_records_async("bench", "repo"))),
+        "updated_since": lambda source: list(github_client.iter_sync(
+            source.iter_updated_pr_records_async("bench", "repo", since=since)
+        )),
+        "single_pr": lambda source: [github_client.asyncio.run(source.fetch_pr_record_async("bench", "repo", 1))],
+    }
+
+    for name, fetch in checks.items():
+        rest_records, rest_stats = run("rest", fetch)
+        graphql_records, graphql_stats = run("graphql", fetch)
+        identical = rest_records == graphql_records
+        if not identical:
+            mismatches.append(name)
+        report[name] = {
+            "records": len(rest_records),
+            "identical": identical,
+            "statuses": {
+                "rest": dict(Counter(record["status"] for record in rest_records)),
+                "graphql": dict(Counter(record["status"] for record in graphql_records)),
+            },
+            "rest": rest_stats,
+            "graphql": graphql_stats,
+        }
+
+    # The stub serves REST PRs the way GitHub does (merged_at, no "merged" flag), so a backend that
+    # misreads merged PRs shows up here as a missing "merged" status rather than passing unnoticed
+    if args.prs >= 2 and "merged" not in report["full"]["statuses"]["rest"]:
+        mismatches.append("merged status")
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if mismatches:
+        print(f"Backends disagree on: {', '.join(mismatches)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
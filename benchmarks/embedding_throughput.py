@@ -0,0 +1,88 @@
+"""Throughput of the shared embedding scheduler against the local OpenAI stub.
+
+Simulates several index builds embedding at once through one EmbeddingScheduler while the stub
+enforces a tokens-per-minute limit, and reports wall time, tokens per second, 429 responses and
+retries. Compare a run with the scheduler's token budget against one without it:
+
+    python -m benchmarks.embedding_throughput --builds 4 --texts 400 --tpm 120000
+    python -m benchmarks.embedding_throughput --builds 4 --texts 400 --tpm 120000 --no-budget
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from benchmarks.loadtest import free_port
+from benchmarks.stubs import create_openai_app, start_server
+
+
+def synthetic_texts(build: int, count: int, words: int) -> list:
+    return [
+        " ".join(f"build{build}_text{i}_word{w}" if w % 8 == 0 else f"word{w}" for w in range(words))
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--builds", type=int, default=4, help="Concurrent index builds")
+    parser.add_argument("--texts", type=int, default=400, help="Texts embedded per build")
+    parser.add_argument("--words", type=int, default=60, help="Words per text")
+    parser.add_argument("--batch", type=int, default=50, help="Texts per embed call, like an index batch")
+    parser.add_argument("--tpm", type=int, default=120000, help="Stub's tokens-per-minute limit")
+    parser.add_argument("--concurrency", type=int, default=4, help="Scheduler requests in flight")
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--no-budget", action="store_true", help="Disable the scheduler's token budget")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    port = free_port()
+    stub = create_openai_app(embed_latency_ms=args.embed_latency_ms, embed_tokens_per_minute=args.tpm)
+    start_server(stub, port)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    # Imported after the environment points at the stub
+    from baseline.embedding_scheduler import EmbeddingScheduler
+    scheduler = EmbeddingScheduler(tokens_per_minute=0 if args.no_budget else args.tpm, concurrency=args.concurrency)
+
+    errors = []
+
+    def build(n: int):
+        texts = synthetic_texts(n, args.texts, args.words)
+        try:
+            for start in range(0, len(texts), args.batch):
+                scheduler.embed(texts[start:start + args.batch])
+        except Exception as e:
+            errors.append(f"build {n}: {type(e).__name__}: {e}")
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=build, args=(n,)) for n in range(args.builds)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    stats = scheduler.stats()
+    report = {
+        "budget": not args.no_budget,
+        "builds": args.builds,
+        "texts": args.builds * args.texts,
+        "seconds": round(elapsed, 2),
+        "tokens": stats["tokens_embedded"],
+        "tokens_per_second": round(stats["tokens_embedded"] / elapsed, 1),
+        "batches": stats["batches_completed"],
+        "retries": stats["retries"],
+        "stub_requests": dict(stub.state.embed_requests),
+        "errors": errors,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Offline end-to-end benchmark: fetch -> build_index_from_github -> ask_query on synthetic repos.
+
+For each repository size, a fresh child process (so memory and caches start cold) serves a
+synthetic repository from the GitHub stub and fake embeddings and chat answers from the OpenAI
+stub (benchmarks.stubs), with realistic latencies, and measures:
+
+- cold index: time to fetch, embed and store every PR into an empty Chroma directory, the
+  GitHub requests it took, its embedding tokens and the time spent in each indexing stage
+- refetch: fetch_and_format after the Redis repo cache is dropped, i.e. revalidating every
+  GitHub page against the ETag cache
+- warm queries: latency of ask_query on the loaded index for distinct questions (the answer
+  cache is bypassed), with tokens and time per answering stage
+- peak RSS of the process, and how much of it the run added on top of the imports
+
+Results are written as JSON with sorted keys and rounded values, so two runs can be diffed, and
+--compare prints the relative change of every metric against an earlier result file:
+
+    python -m benchmarks.end_to_end --sizes 10 1000 10000 --output e2e.json
+    python -m benchmarks.end_to_end --sizes 10 1000 --compare e2e.json
+
+Redis must be reachable at REDIS_HOST/REDIS_PORT; each run uses a repository name of its own, so
+cached PRs from earlier runs never make an index build warm.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = "RESULT "
+INDEX_STAGES = ("fetch_prs", "embed", "vector_store_write", "lexical_index_write", "pr_store_write")
+QUERY_STAGES = ("lexical_search", "embed_query", "vector_search", "pack_context", "synthesize")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_questions(count: int, pr_count: int) -> list:
+    # Distinct questions that need retrieval and the LLM (none of them is a list/count question the
+    # router would answer from the PR store)
+    templates = (
+        "Why was module_{m} reworked?",
+        "What did reviewers suggest about helper_{n}_1?",
+        "Explain the change made in PR #{n}.",
+        "What issue does the fix for issue #{i} address?",
+    )
+    questions = []
+    for q in range(count):
+        n = 1 + (q * 7919) % pr_count
+        questions.append(templates[q % len(templates)].format(m=q % 50, n=n, i=1000 + n))
+    return questions
+
+
+def stage_seconds(before: dict, after: dict, stages: tuple) -> dict:
+    return {stage: round(after.get(stage, (0, 0.0))[1] - before.get(stage, (0, 0.0))[1], 3) for stage in stages}
+
+
+def request_delta(before: dict, after: dict) -> dict:
+    return {outcome: after[outcome] - before.get(outcome, 0) for outcome in after}
+
+
+def run_size(args, pr_count: int) -> dict:
+    # Runs in the child process: starts the stubs, points the app at them, then imports the app
+    from benchmarks.loadtest import free_port
+    from benchmarks.stubs import create_github_app, create_openai_app, start_server
+
+    workdir = tempfile.mkdtemp(prefix="e2e-bench-")
+    github_port, openai_port = free_port(), free_port()
+    github = create_github_app(pr_count, latency_ms=args.github_latency_ms)
+    start_server(github, github_port)
+    start_server(create_openai_app(embed_latency_ms=args.embed_latency_ms, llm_latency_ms=args.llm_latency_ms), openai_port)
+    os.environ.update(
+        GITHUB_API_URL=f"http://127.0.0.1:{github_port}",
+        OPENAI_API_BASE=f"http://127.0.0.1:{openai_port}/v1",
+        OPENAI_API_KEY="stub",
+        GITHUB_BACKEND=args.backend,
+        TRACING_ENABLED="true",
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.db"),
+    )
+    if args.backend == "graphql":
+        os.environ["GITHUB_TOKEN"] = "stub-token"
+    os.chdir(workdir)
+
+    from baseline.generator.generator import ask_query
+    from baseline.retriever.retriever import build_index_from_github
+    from specialization.github_client import fetch_and_format
+    from utils.accounting import usage_scope
+    from utils.cache import invalidate_repo_cache
+    from utils.tracing import telemetry
+
+    owner, repo = "bench", f"e2e-{pr_count}-{uuid.uuid4().hex[:8]}"
+    rss_at_start = peak_rss_mb()
+
+    requests_before, stages_before = dict(github.state.requests), telemetry.stage_totals()
+    started = time.perf_counter()
+    with usage_scope(f"{owner}/{repo}") as usage:
+        index, _ = build_index_from_github(owner, repo)
+    cold_index = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "github_requests": request_delta(requests_before, github.state.requests),
+        "embedding_tokens": usage.embedding_tokens,
+        "stage_seconds": stage_seconds(stages_before, telemetry.stage_totals(), INDEX_STAGES),
+        "chunks": index.vector_store._collection.count(),
+    }
+
+    invalidate_repo_cache(owner, repo)
+    requests_before = dict(github.state.requests)
+    started = time.perf_counter()
+    documents = fetch_and_format(owner, repo)
+    refetch = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "github_requests": request_delta(requests_before, github.state.requests),
+        "documents": len(documents),
+    }
+    del documents
+
+    # Warm: the index comes from the registry, as for every query after the first
+    started = time.perf_counter()
+    index, _ = build_index_from_github(owner, repo)
+    warm_load_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    latencies = []
+    stages_before = telemetry.stage_totals()
+    with usage_scope(f"{owner}/{repo}") as usage:
+        for question in benchmark_questions(args.queries, pr_count):
+            started = time.perf_counter()
+            ask_query(index, question)
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    queries = {
+        "count": len(latencies),
+        "index_load_ms": warm_load_ms,
+        "p50_ms": round(statistics.median(latencies), 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        "mean_ms": round(statistics.fmean(latencies), 1),
+        "tokens": {"embedding": usage.embedding_tokens, "prompt": usage.total("prompt"), "completion": usage.total("completion")},
+        "stage_seconds": stage_seconds(stages_before, telemetry.stage_totals(), QUERY_STAGES),
+    }
+
+    invalidate_repo_cache(owner, repo)
+    peak = peak_rss_mb()
+    return {
+        "prs": pr_count,
+        "cold_index": cold_index,
+        "refetch": refetch,
+        "warm_queries": queries,
+        "memory": {"peak_rss_mb": round(peak, 1), "added_rss_mb": round(peak - rss_at_start, 1)},
+    }
+
+
+def run_child(args, pr_count: int) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.end_to_end", "--child", str(pr_count),
+        "--queries", str(args.queries), "--backend", args.backend,
+        "--github-latency-ms", str(args.github_latency_ms),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--llm-latency-ms", str(args.llm_latency_ms),
+    ]
+    process = subprocess.run(command, cwd=REPO_ROOT, env=dict(os.environ, PYTHONPATH=REPO_ROOT),
+                             stdout=subprocess.PIPE, text=True)
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Benchmark for {pr_count} PRs failed (exit code {process.returncode})")
+
+
+def flatten(result: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def print_table(results: dict):
+    print(f"{'PRs':>7} {'cold s':>9} {'GH reqs':>8} {'refetch s':>10} {'304s':>6} {'embed tok':>10} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'LLM tok':>8} {'peak MB':>8}")
+    for size, r in results.items():
+        llm_tokens = r["warm_queries"]["tokens"]["prompt"] + r["warm_queries"]["tokens"]["completion"]
+        print(f"{size:>7} {r['cold_index']['seconds']:>9} {r['cold_index']['github_requests']['ok']:>8} "
+              f"{r['refetch']['seconds']:>10} {r['refetch']['github_requests']['not_modified']:>6} "
+              f"{r['cold_index']['embedding_tokens']:>10} {r['warm_queries']['p50_ms']:>8} "
+              f"{r['warm_queries']['p95_ms']:>8} {llm_tokens:>8} {r['memory']['peak_rss_mb']:>8}")
+
+
+def print_comparison(baseline: dict, results: dict):
+    # Relative change of every numeric metric present in both runs
+    print(f"\nChange against {baseline.get('commit') or 'baseline'}:")
+    for size, result in results.items():
+        old = flatten(baseline["results"].get(size, {}))
+        for metric, value in flatten(result).items():
+            before = old.get(metric)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before != value:
+                change = f"{(value - before) / before * 100:+.1f}%" if before else "new"
+                print(f"  {size:>6} PRs  {metric:<45} {before:>12} -> {value:<12} {change}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="PRs per synthetic repo")
+    parser.add_argument("--queries", type=int, default=20, help="warm questions per size")
+    parser.add_argument("--backend", choices=("rest", "graphql"), default="rest")
+    parser.add_argument("--github-latency-ms", type=float, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="an earlier --output file to compare against")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(RESULT_PREFIX + json.dumps(run_size(args, args.child)), flush=True)
+        return
+
+    results = {}
+    for size in args.sizes:
+        print(f"Benchmarking {size} PRs...", flush=True)
+        results[str(size)] = run_child(args, size)
+    print()
+    print_table(results)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "child")}
+    report = {"commit": git_commit(), "config": config, "results": results}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
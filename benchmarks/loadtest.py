@@ -0,0 +1,208 @@
+"""Concurrent load test of /query against local stub GitHub and OpenAI servers.
+
+Starts benchmarks.stubs and the app (uvicorn, in subprocesses with a scratch working directory
+so Chroma, logs and metrics stay out of the repo), indexes a synthetic repo through /index, then
+runs closed-loop clients at each concurrency level and reports p50/p99 latency and requests per
+second. Every request asks a distinct question, so the answer cache never short-circuits it.
+
+Redis must be reachable at REDIS_HOST/REDIS_PORT; without it every cache lookup waits on
+connection retries and the numbers mostly measure that.
+
+    python -m benchmarks.loadtest --concurrency 50 200 1000 --duration 20
+    python -m benchmarks.loadtest --app-url http://127.0.0.1:8000   # an app you started yourself
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_URL = "https://github.com/bench/repo"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    # 1000 clients plus the app's upstream connections exceed the usual soft limit of 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+
+
+def wait_for(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def start_stack(args, workdir: str):
+    github_port, openai_port, app_port = free_port(), free_port(), free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+
+    stubs = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.stubs",
+        "--github-port", str(github_port), "--openai-port", str(openai_port), "--prs", str(args.prs),
+        "--github-latency-ms", str(args.github_latency_ms),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--llm-latency-ms", str(args.llm_latency_ms),
+    ], cwd=REPO_ROOT, env=env)
+
+    env.update({
+        "GITHUB_API_URL": f"http://127.0.0.1:{github_port}",
+        "GITHUB_TOKEN": "",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_API_KEY": "sk-stub",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.db"),
+    })
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "baseline.pipeline:app",
+        "--host", "127.0.0.1", "--port", str(app_port), "--workers", str(args.workers),
+        "--log-level", "warning", "--no-access-log",
+    ], cwd=workdir, env=env)
+
+    wait_for(f"http://127.0.0.1:{github_port}/repos/bench/repo/pulls")
+    app_url = f"http://127.0.0.1:{app_port}"
+    wait_for(f"{app_url}/docs")
+    return [stubs, app], app_url
+
+
+def index_repo(app_url: str, timeout: float = 600):
+    job = httpx.post(f"{app_url}/index", json={"repo_url": REPO_URL}, timeout=30).json()
+    deadline = time.monotonic() + timeout
+    while job["status"] in ("queued", "running"):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Indexing did not finish within {timeout}s: {job}")
+        time.sleep(0.5)
+        job = httpx.get(f"{app_url}/index/{job['job_id']}", timeout=30).json()
+    if job["status"] != "completed":
+        raise RuntimeError(f"Indexing failed: {job}")
+    print(f"Indexed {REPO_URL}: {job['prs_fetched']} PRs, {job['chunks_embedded']} chunks "
+          f"in {job['finished_at'] - job['started_at']:.1f}s")
+
+
+async def send_query(client: httpx.AsyncClient, app_url: str, stream: bool) -> bool:
+    payload = {"repo_url": REPO_URL, "question": f"What changed in module_{uuid.uuid4().hex[:8]}?", "stream": stream}
+    if not stream:
+        response = await client.post(f"{app_url}/query", json=payload)
+        return response.status_code == 200 and "error" not in response.json()
+
+    async with client.stream("POST", f"{app_url}/query", json=payload) as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            if event in ("done", "error"):
+                break
+        return response.status_code == 200 and event == "done"
+
+
+async def client_loop(client, app_url: str, stream: bool, deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = await send_query(client, app_url, stream)
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(time.perf_counter() - start)
+
+
+async def run_level(app_url: str, concurrency: int, duration: float, stream: bool) -> dict:
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(300, pool=None)) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(
+            client_loop(client, app_url, stream, deadline, latencies, errors) for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": None,
+        "p99_ms": None,
+    }
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        result["p50_ms"] = round(quantiles[49] * 1000, 1)
+        result["p99_ms"] = round(quantiles[98] * 1000, 1)
+    return result
+
+
+def print_table(results: list):
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for r in results:
+        print(f"{r['concurrency']:>8} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9} "
+              f"{str(r['p50_ms']):>9} {str(r['p99_ms']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--duration", type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument("--stream", action="store_true", help="ask for server-sent events instead of JSON")
+    parser.add_argument("--prs", type=int, default=200)
+    parser.add_argument("--github-latency-ms", type=float, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--app-url", help="use a running app (already pointed at the stubs) instead of starting one")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        if args.app_url:
+            app_url = args.app_url.rstrip("/")
+        else:
+            processes, app_url = start_stack(args, workdir)
+        index_repo(app_url)
+
+        results = []
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_level(app_url, concurrency, args.duration, args.stream))
+            results.append(result)
+            print(f"{concurrency} clients: {result['rps']} req/s, p50 {result['p50_ms']} ms, "
+                  f"p99 {result['p99_ms']} ms, {result['errors']} errors", flush=True)
+        print()
+        print_table(results)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"config": vars(args), "results": results}, f, indent=2)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
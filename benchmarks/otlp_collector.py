@@ -0,0 +1,69 @@
+"""Minimal local OTLP/gRPC trace collector for checking the app's span export.
+
+It accepts the spans the backend exports when tracing is enabled and prints one line per
+span (name, duration, attributes), so the exporter can be tested without running a real
+OpenTelemetry Collector or Jaeger. Start it, then run the backend with:
+
+    TRACING_ENABLED=true
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://127.0.0.1:4317
+
+Run standalone:
+
+    python -m benchmarks.otlp_collector --port 4317
+"""
+import argparse
+import time
+from concurrent import futures
+
+import grpc
+from opentelemetry.proto.collector.trace.v1 import trace_service_pb2, trace_service_pb2_grpc
+
+
+def attribute_value(value):
+    kind = value.WhichOneof("value")
+    return getattr(value, kind) if kind else None
+
+
+class TraceCollector(trace_service_pb2_grpc.TraceServiceServicer):
+    def __init__(self, quiet: bool = False):
+        self.spans = []  # (name, duration in seconds, attributes)
+        self.quiet = quiet
+
+    def Export(self, request, context):
+        for resource_spans in request.resource_spans:
+            for scope_spans in resource_spans.scope_spans:
+                for span in scope_spans.spans:
+                    duration = (span.end_time_unix_nano - span.start_time_unix_nano) / 1e9
+                    attributes = {a.key: attribute_value(a.value) for a in span.attributes}
+                    self.spans.append((span.name, duration, attributes))
+                    if not self.quiet:
+                        print(f"{span.name:<22} {duration * 1000:9.1f} ms  {attributes}", flush=True)
+        return trace_service_pb2.ExportTraceServiceResponse()
+
+
+def start_collector(port: int, host: str = "127.0.0.1", quiet: bool = False):
+    # Returns (grpc server, collector); spans received so far are in collector.spans
+    collector = TraceCollector(quiet=quiet)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    trace_service_pb2_grpc.add_TraceServiceServicer_to_server(collector, server)
+    server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, collector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=4317)
+    args = parser.parse_args()
+
+    server, _ = start_collector(args.port)
+    print(f"OTLP trace collector on 127.0.0.1:{args.port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""Local stand-ins for the GitHub REST API and the OpenAI embeddings/chat APIs.
+
+Both servers are deterministic: the GitHub stub serves a synthetic repository of N pull
+requests (with Link-header pagination, ETags and optional per-token rate limits), and the
+OpenAI stub returns hash-seeded embeddings and canned answers after a configurable delay.
+The embeddings endpoint can also enforce a tokens-per-minute limit, answering 429 with
+Retry-After like OpenAI does. create_fixture_github_app serves a small recorded repository
+(benchmarks/fixtures) in GitHub's real REST and GraphQL response shapes instead. Point the app at them with:
+
+    GITHUB_API_URL=http://127.0.0.1:9101
+    OPENAI_API_BASE=http://127.0.0.1:9102/v1
+
+Run standalone:
+
+    python -m benchmarks.stubs --github-port 9101 --openai-port 9102 --prs 200
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from llama_index.core.utils import get_tokenizer
+
+EMBED_DIM = 256
+# Recorded GitHub responses for one small repository, see create_fixture_github_app
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ANSWER_WORDS = 64
+
+
+def synthetic_prs(pr_count: int, comments_per_pr: int = 3, commits_per_pr: int = 3):
+    # Every fourth PR is open; closed PRs alternate between merged and not. Like GitHub's list
+    # endpoint, PRs carry merged_at (null unless merged) and no "merged" flag.
+    prs, comments, commits = {}, {}, {}
+    for n in range(1, pr_count + 1):
+        day = 1 + n % 28
+        prs[n] = {
+            "number": n,
+            "title": f"Change {n}: update module_{n % 50}",
+            "user": {"login": f"dev{n % 7}"},
+            "body": f"This PR reworks module_{n % 50} and fixes issue #{1000 + n}.",
+            "state": "open" if n % 4 == 0 else "closed",
+            "created_at": f"2024-01-{day:02d}T00:00:00Z",
+            "merged_at": f"2024-02-{day:02d}T00:00:00Z" if n % 4 != 0 and n % 2 == 1 else None,
+            "updated_at": f"2024-02-{day:02d}T{n % 24:02d}:{n % 60:02d}:00Z",
+        }
+        comments[n] = [
+            {
+                "user": {"login": f"reviewer{(n + i) % 5}"},
+                "created_at": f"2024-02-{day:02d}T00:00:00Z",
+                "body": f"Review note {i} on PR {n}: consider renaming helper_{n}_{i}.",
+            }
+            for i in range(comments_per_pr)
+        ]
+        commits[n] = [
+            {
+                "sha": hashlib.sha1(f"{n}-{i}".encode()).hexdigest(),
+                "commit": {
+                    "message": f"Commit {i} for PR {n}: adjust module_{n % 50}",
+                    "author": {"name": f"dev{n % 7}", "date": f"2024-01-{day:02d}T00:00:00Z"},
+                },
+            }
+            for i in range(commits_per_pr)
+        ]
+    return prs, comments, commits
+
+
+def paginate(request: Request, items: list):
+    per_page = int(request.query_params.get("per_page", 30))
+    page = int(request.query_params.get("page", 1))
+    body = items[(page - 1) * per_page:page * per_page]
+    headers = {}
+    if page * per_page < len(items):
+        params = dict(request.query_params)
+        params["page"] = str(page + 1)
+        next_url = request.url.replace_query_params(**params)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return JSONResponse(body, headers=headers)
+
+
+def create_github_app(pr_count: int = 200, latency_ms: float = 20, comments_per_pr: int = 3, commits_per_pr: int = 3,
+                      rate_limit: int = 0, rate_window_seconds: int = 3600):
+    app = FastAPI()
+    prs, comments, commits = synthetic_prs(pr_count, comments_per_pr, commits_per_pr)
+    delay = latency_ms / 1000
+    # Per-token quotas (only with rate_limit) and request counts by outcome
+    app.state.quotas = {}
+    app.state.requests = {"ok": 0, "not_modified": 0, "rate_limited": 0}
+
+    @app.middleware("http")
+    async def conditional_requests(request: Request, call_next):
+        # Like GitHub: every response carries an ETag, a matching If-None-Match gets an empty 304
+        # that doesn't use quota, and an exhausted quota gets a 403 until the window resets
+        quota_headers = {}
+        if rate_limit:
+            now = time.time()
+            resource = "graphql" if request.url.path == "/graphql" else "core"
+            key = (request.headers.get("authorization", "anonymous"), resource)
+            quota = app.state.quotas.setdefault(key, {"used": 0, "reset": 0})
+            if now >= quota["reset"]:
+                quota["used"], quota["reset"] = 0, int(now) + rate_window_seconds
+            quota_headers = {
+                "x-ratelimit-limit": str(rate_limit),
+                "x-ratelimit-remaining": str(max(0, rate_limit - quota["used"])),
+                "x-ratelimit-reset": str(quota["reset"]),
+                "x-ratelimit-resource": resource,
+            }
+            if quota["used"] >= rate_limit:
+                app.state.requests["rate_limited"] += 1
+                return JSONResponse({"message": "API rate limit exceeded"}, status_code=403, headers=quota_headers)
+
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if request.headers.get("if-none-match") == etag:
+            app.state.requests["not_modified"] += 1
+            return Response(status_code=304, headers={"etag": etag, **quota_headers})
+
+        app.state.requests["ok"] += 1
+        if rate_limit:
+            quota["used"] += 1
+            quota_headers["x-ratelimit-remaining"] = str(max(0, rate_limit - quota["used"]))
+        headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+        return Response(body, status_code=response.status_code, headers={**headers, "etag": etag, **quota_headers})
+
+    @app.get("/repos/{owner}/{repo}/pulls")
+    async def list_pulls(request: Request, owner: str, repo: str, state: str = "open", sort: str = "created", direction: str = "desc"):
+        await asyncio.sleep(delay)
+        items = [pr for pr in prs.values() if state == "all" or pr["state"] == state]
+        key = "updated_at" if sort == "updated" else "number"
+        items.sort(key=lambda pr: pr[key], reverse=direction == "desc")
+        return paginate(request, items)
+
+    @app.get("/repos/{owner}/{repo}/pulls/{number}")
+    async def get_pull(owner: str, repo: str, number: int):
+        await asyncio.sleep(delay)
+        if number not in prs:
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+        # The single-PR endpoint is the only one that also reports "merged"
+        return {**prs[number], "merged": prs[number]["merged_at"] is not None}
+
+    @app.get("/repos/{owner}/{repo}/pulls/{number}/commits")
+    async def list_commits(request: Request, owner: str, repo: str, number: int):
+        await asyncio.sleep(delay)
+        return paginate(request, commits.get(number, []))
+
+    @app.get("/repos/{owner}/{repo}/issues/{number}/comments")
+    async def list_comments(request: Request, owner: str, repo: str, number: int):
+        await asyncio.sleep(delay)
+        return paginate(request, comments.get(number, []))
+
+    def graphql_commits(number: int) -> list:
+        return [
+            {"commit": {"oid": c["sha"], "message": c["commit"]["message"], "author": c["commit"]["author"]}}
+            for c in commits.get(number, [])
+        ]
+
+    def graphql_comments(number: int) -> list:
+        return [{"author": c["user"], "createdAt": c["created_at"], "body": c["body"]} for c in comments.get(number, [])]
+
+    def graphql_pr(pr: dict, nested: int) -> dict:
+        return {
+            "number": pr["number"],
+            "title": pr["title"],
+            "body": pr["body"],
+            "state": "OPEN" if pr["state"] == "open" else ("MERGED" if pr["merged_at"] else "CLOSED"),
+            "createdAt": pr["created_at"],
+            "updatedAt": pr["updated_at"],
+            "mergedAt": pr["merged_at"],
+            "author": pr["user"],
+            "commits": graphql_page(graphql_commits(pr["number"]), nested, None),
+            "comments": graphql_page(graphql_comments(pr["number"]), nested, None),
+        }
+
+    @app.post("/graphql")
+    async def graphql(request: Request):
+        # Answers the three operations specialization.github_graphql sends; cursors are list offsets
+        payload = await request.json()
+        operation, variables = payload.get("operationName"), payload.get("variables") or {}
+        await asyncio.sleep(delay)
+        nested = variables.get("nested", 100)
+
+        if operation == "PullRequests":
+            states = {"OPEN": "open", "CLOSED": "closed", "MERGED": "closed"}
+            wanted = {states[state] for state in variables["states"]}
+            items = [pr for pr in prs.values() if pr["state"] in wanted]
+            key = "updated_at" if variables["orderBy"]["field"] == "UPDATED_AT" else "number"
+            items.sort(key=lambda pr: pr[key], reverse=variables["orderBy"]["direction"] == "DESC")
+            page = graphql_page(items, variables["first"], variables.get("after"))
+            page["nodes"] = [graphql_pr(pr, nested) for pr in page["nodes"]]
+            return {"data": {"repository": {"pullRequests": page}}}
+
+        number = variables.get("number")
+        if number not in prs:
+            return {"data": {"repository": {"pullRequest": None}}}
+        if operation == "PullRequest":
+            return {"data": {"repository": {"pullRequest": graphql_pr(prs[number], nested)}}}
+        if operation == "PullRequestConnection":
+            field = "commits" if "commits(" in payload["query"] else "comments"
+            nodes = graphql_commits(number) if field == "commits" else graphql_comments(number)
+            return {"data": {"repository": {"pullRequest": {field: graphql_page(nodes, nested, variables.get("after"))}}}}
+        return {"errors": [{"message": f"Unknown operation {operation}"}]}
+
+    return app
+
+
+def create_fixture_github_app(fixtures_dir: str = FIXTURES_DIR):
+    # Serves the recorded repository in fixtures_dir: REST and GraphQL responses written down separately
+    # in GitHub's own shapes (not derived from each other), so a backend that maps a field wrongly
+    # disagrees with expected_records.json instead of with a stub built from the same dict
+    with open(os.path.join(fixtures_dir, "github_rest.json")) as f:
+        rest = json.load(f)
+    with open(os.path.join(fixtures_dir, "github_graphql.json")) as f:
+        graphql_nodes = {node["number"]: node for node in json.load(f)["pullRequests"]}
+    owner_repo = rest["repository"]
+    pulls = {pr["number"]: pr for pr in rest["pulls"]}
+    app = FastAPI()
+    app.state.requests = {"ok": 0}
+
+    @app.middleware("http")
+    async def count_requests(request: Request, call_next):
+        app.state.requests["ok"] += 1
+        return await call_next(request)
+
+    def known(owner: str, repo: str) -> bool:
+        return f"{owner}/{repo}" == owner_repo
+
+    @app.get("/repos/{owner}/{repo}/pulls")
+    async def list_pulls(request: Request, owner: str, repo: str, state: str = "open", sort: str = "created", direction: str = "desc"):
+        if not known(owner, repo):
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+        items = [pr for pr in pulls.values() if state == "all" or pr["state"] == state]
+        key = "updated_at" if sort == "updated" else "created_at"
+        items.sort(key=lambda pr: pr[key], reverse=direction == "desc")
+        return paginate(request, items)
+
+    @app.get("/repos/{owner}/{repo}/pulls/{number}")
+    async def get_pull(owner: str, repo: str, number: int):
+        if not known(owner, repo) or number not in pulls:
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+        return {**pulls[number], **rest["pull_details"][str(number)]}
+
+    @app.get("/repos/{owner}/{repo}/pulls/{number}/commits")
+    async def list_commits(request: Request, owner: str, repo: str, number: int):
+        return paginate(request, rest["commits"].get(str(number), []) if known(owner, repo) else [])
+
+    @app.get("/repos/{owner}/{repo}/issues/{number}/comments")
+    async def list_comments(request: Request, owner: str, repo: str, number: int):
+        return paginate(request, rest["comments"].get(str(number), []) if known(owner, repo) else [])
+
+    @app.post("/graphql")
+    async def graphql(request: Request):
+        payload = await request.json()
+        operation, variables = payload.get("operationName"), payload.get("variables") or {}
+        if f"{variables.get('owner')}/{variables.get('repo')}" != owner_repo:
+            return {"data": {"repository": None}, "errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}]}
+        if operation == "PullRequests":
+            key = "updatedAt" if variables["orderBy"]["field"] == "UPDATED_AT" else "createdAt"
+            items = [node for node in graphql_nodes.values() if node["state"] in variables["states"]]
+            items.sort(key=lambda node: node[key], reverse=variables["orderBy"]["direction"] == "DESC")
+            return {"data": {"repository": {"pullRequests": graphql_page(items, variables["first"], variables.get("after"))}}}
+        if operation == "PullRequest":
+            return {"data": {"repository": {"pullRequest": graphql_nodes.get(variables["number"])}}}
+        return {"errors": [{"message": f"Unknown operation {operation}"}]}
+
+    return app
+
+
+def load_expected_records(fixtures_dir: str = FIXTURES_DIR) -> dict:
+    # {"repository", "since", "records"}: what both backends must build from the recorded repository
+    with open(os.path.join(fixtures_dir, "expected_records.json")) as f:
+        return json.load(f)
+
+
+def graphql_page(items: list, first: int, after) -> dict:
+    start = int(after) if after else 0
+    nodes = items[start:start + first]
+    end = start + len(nodes)
+    return {"pageInfo": {"hasNextPage": end < len(items), "endCursor": str(end)}, "nodes": nodes}
+
+
+def stub_embedding(text: str, dim: int = EMBED_DIM) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_openai_app(embed_latency_ms: float = 50, llm_latency_ms: float = 300, embed_dim: int = EMBED_DIM,
+                      answer_words: int = ANSWER_WORDS, embed_tokens_per_minute: int = 0):
+    app = FastAPI()
+    # cl100k_base, so usage and rate limits count tokens the way OpenAI does
+    tokenizer = get_tokenizer()
+    # Token bucket refilled continuously, like OpenAI's limiter, and request counts by outcome
+    app.state.bucket = {"tokens": float(embed_tokens_per_minute), "updated": time.monotonic()}
+    app.state.embed_requests = {"ok": 0, "rate_limited": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        payload = await request.json()
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        tokens = sum(len(tokenizer(str(text))) for text in texts)
+
+        if embed_tokens_per_minute:
+            bucket, rate = app.state.bucket, embed_tokens_per_minute / 60
+            now = time.monotonic()
+            bucket["tokens"] = min(embed_tokens_per_minute, bucket["tokens"] + (now - bucket["updated"]) * rate)
+            bucket["updated"] = now
+            if tokens > bucket["tokens"]:
+                app.state.embed_requests["rate_limited"] += 1
+                retry_after = (tokens - bucket["tokens"]) / rate
+                return JSONResponse(
+                    {"error": {"message": "Rate limit reached for tokens per min", "type": "tokens", "code": "rate_limit_exceeded"}},
+                    status_code=429,
+                    headers={"retry-after": f"{retry_after:.2f}"}
+                )
+            bucket["tokens"] -= tokens
+
+        await asyncio.sleep(embed_latency_ms / 1000)
+        app.state.embed_requests["ok"] += 1
+        data = []
+        for i, text in enumerate(texts):
+            vector = stub_embedding(str(text), embed_dim)
+            # The openai client asks for base64 unless told otherwise
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "stub")
+        words = [f"word{i}" for i in range(answer_words)]
+        created = int(time.time())
+
+        if not payload.get("stream"):
+            await asyncio.sleep(llm_latency_ms / 1000)
+            return {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": answer_words, "total_tokens": answer_words},
+            }
+
+        async def events():
+            # Spread the configured latency over the tokens so time-to-first-token is meaningful
+            per_word = llm_latency_ms / 1000 / max(1, answer_words)
+            for i, word in enumerate(words):
+                await asyncio.sleep(per_word)
+                delta = {"content": word if i == 0 else " " + word}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def start_server(app, port: int, host: str = "127.0.0.1"):
+    # Runs uvicorn on a daemon thread and returns once it is accepting connections
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"Stub server failed to start on {host}:{port}")
+        time.sleep(0.05)
+    return server, thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--github-port", type=int, default=9101)
+    parser.add_argument("--openai-port", type=int, default=9102)
+    parser.add_argument("--prs", type=int, default=200)
+    parser.add_argument("--github-latency-ms", type=float, default=20)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--github-rate-limit", type=int, default=0, help="GitHub requests per token per hour (0: unlimited)")
+    parser.add_argument("--embed-tpm", type=int, default=0, help="Embedding tokens per minute before 429s (0: unlimited)")
+    args = parser.parse_args()
+
+    start_server(create_github_app(args.prs, args.github_latency_ms, rate_limit=args.github_rate_limit), args.github_port)
+    start_server(create_openai_app(args.embed_latency_ms, args.llm_latency_ms, embed_tokens_per_minute=args.embed_tpm), args.openai_port)
+    print(f"GitHub stub on http://127.0.0.1:{args.github_port}, OpenAI stub on http://127.0.0.1:{args.openai_port}/v1", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Runs every test case in the testset on a worker pool and writes a per-repo precision/recall/F1 report.
+
+Each test case is scored the way /run-test scores it: the repository is indexed (an existing index is
+reused), EVAL_QUESTION is asked, and the answer is matched against the commits recorded for the repo.
+Repos are evaluated in parallel threads that share the app's embedding scheduler, GitHub rate governor
+and Chroma client.
+
+    python -m evaluation.batch_eval --workers 4 --report evaluation/report.json
+    python -m evaluation.batch_eval --generate https://github.com/owner/repo owner/other   # add test cases
+    python -m evaluation.batch_eval --offline
+
+With --offline nothing leaves the machine: benchmarks.stubs serves synthetic repositories and
+deterministic embeddings and chat answers in place of GitHub and OpenAI, test cases are generated from
+the stub, Chroma and the SQLite stores live in a scratch directory, and Redis is an in-process fakeredis
+server (REDIS_BACKEND=memory) unless REDIS_BACKEND is set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+# The app modules read their settings (API URLs, storage paths) when first imported, so they are
+# imported inside the functions below, after --offline has pointed everything at the stubs.
+
+
+def start_offline_stack(args, workdir: str):
+    from benchmarks.loadtest import free_port
+    from benchmarks.stubs import create_github_app, create_openai_app, start_server
+
+    github_port, openai_port = free_port(), free_port()
+    start_server(create_github_app(args.prs, latency_ms=args.github_latency_ms), github_port)
+    start_server(create_openai_app(embed_latency_ms=args.embed_latency_ms, llm_latency_ms=args.llm_latency_ms), openai_port)
+    os.environ.update(
+        GITHUB_API_URL=f"http://127.0.0.1:{github_port}",
+        OPENAI_API_BASE=f"http://127.0.0.1:{openai_port}/v1",
+        OPENAI_API_KEY="stub",
+        EMBEDDING_CACHE_PATH=os.path.join(workdir, "embedding_cache.db")
+    )
+    os.environ.setdefault("REDIS_BACKEND", "memory")
+    os.chdir(workdir)
+
+
+def repo_name(repo: str) -> str:
+    # "owner/repo" from a GitHub URL or an owner/repo string
+    return urlparse(repo).path.strip("/")
+
+
+async def generate_entries(repos: list, testset: str):
+    from evaluation.testutils import build_test_entry, save_test_entry
+    from specialization.github_client import fetch_pr_commits_async
+
+    results = await asyncio.gather(
+        *(fetch_pr_commits_async(*repo.split("/", 1), state="open", per_page=20, max_prs=20) for repo in repos),
+        return_exceptions=True
+    )
+    for repo, prs in zip(repos, results):
+        if isinstance(prs, Exception):
+            print(f"{repo}: failed to fetch commits: {prs}", flush=True)
+        elif not prs:
+            print(f"{repo}: skipped, no open PRs", flush=True)
+        else:
+            entry = build_test_entry(repo, prs)
+            save_test_entry(entry, testset)
+            print(f"{repo}: {entry['total_commits']} commits recorded", flush=True)
+
+
+def evaluate_repo(entry: dict) -> dict:
+    from baseline.generator.generator import ask_query
+    from baseline.retriever.retriever import build_index_from_github
+    from baseline.router import structured_answer
+    from evaluation.scoring import score_answer
+    from evaluation.testutils import EVAL_QUESTION
+    from utils.accounting import usage_scope
+
+    repo = entry["repo"]
+    owner, name = repo.split("/", 1)
+    started = time.perf_counter()
+    try:
+        with usage_scope(repo) as usage:
+            index, _ = build_index_from_github(owner, name)
+            structured = structured_answer(owner, name, EVAL_QUESTION)
+            if structured is not None:
+                route, answer = "structured", structured["answer"]
+            else:
+                route = "llm"
+                answer, _, _, _ = ask_query(index, EVAL_QUESTION, use_custom_prompt=False)
+        scores = score_answer([commit["message"] for commit in entry["commits"]], answer)
+        return {"repo": repo, "route": route, **scores, "usage": usage.to_dict(),
+                "seconds": round(time.perf_counter() - started, 2), "error": ""}
+    except Exception as e:
+        return {"repo": repo, "seconds": round(time.perf_counter() - started, 2), "error": str(e)}
+
+
+def summarize(rows: list) -> dict:
+    # Macro averages weigh every repo equally; micro averages weigh every commit equally
+    scored = [row for row in rows if not row["error"]]
+    matched = sum(row["commits_matched"] for row in scored)
+    predicted = sum(row["total_commits_predicted"] for row in scored)
+    expected = sum(row["total_commits_expected"] for row in scored)
+    precision = matched / predicted if predicted else 0.0
+    recall = matched / expected if expected else 0.0
+    return {
+        "repos": len(rows),
+        "failed": len(rows) - len(scored),
+        "macro_precision": round(sum(row["precision"] for row in scored) / len(scored), 3) if scored else 0.0,
+        "macro_recall": round(sum(row["recall"] for row in scored) / len(scored), 3) if scored else 0.0,
+        "macro_f1": round(sum(row["f1_score"] for row in scored) / len(scored), 3) if scored else 0.0,
+        "micro_precision": round(precision, 3),
+        "micro_recall": round(recall, 3),
+        "micro_f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        "cost_usd": round(sum(row["usage"]["cost_usd"] for row in scored), 6),
+    }
+
+
+def print_table(rows: list, summary: dict):
+    print(f"{'repo':<45} {'route':>10} {'expected':>9} {'matched':>8} {'P':>6} {'R':>6} {'F1':>6} {'s':>7}")
+    for row in rows:
+        if row["error"]:
+            print(f"{row['repo']:<45} {'error':>10}  {row['error'][:60]}")
+            continue
+        print(f"{row['repo']:<45} {row['route']:>10} {row['total_commits_expected']:>9} {row['commits_matched']:>8} "
+              f"{row['precision']:>6} {row['recall']:>6} {row['f1_score']:>6} {row['seconds']:>7}")
+    print(f"\nmacro P/R/F1 {summary['macro_precision']}/{summary['macro_recall']}/{summary['macro_f1']}, "
+          f"micro P/R/F1 {summary['micro_precision']}/{summary['micro_recall']}/{summary['micro_f1']}, "
+          f"{summary['failed']} of {summary['repos']} failed, ${summary['cost_usd']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--testset", help="JSONL test cases (default evaluation/testset.jsonl, or a scratch file with --offline)")
+    parser.add_argument("--repos", nargs="+", help="evaluate only these owner/repo names")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--report", default="evaluation/report.json", help="where to write the JSON report")
+    parser.add_argument("--generate", nargs="+", metavar="REPO", help="record test cases for these repos first")
+    parser.add_argument("--offline", action="store_true", help="use the local GitHub and OpenAI stubs")
+    parser.add_argument("--offline-repos", type=int, default=4, help="synthetic repos to evaluate with --offline")
+    parser.add_argument("--prs", type=int, default=40, help="PRs per synthetic repo with --offline")
+    parser.add_argument("--github-latency-ms", type=float, default=5)
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    report_path = os.path.abspath(args.report)
+    testset = os.path.abspath(args.testset) if args.testset else None
+    generate = [repo_name(repo) for repo in args.generate or []]
+    if args.offline:
+        workdir = tempfile.mkdtemp(prefix="batch-eval-")
+        testset = testset or os.path.join(workdir, "testset.jsonl")
+        start_offline_stack(args, workdir)
+        generate += [f"stub/repo-{i}" for i in range(1, args.offline_repos + 1)]
+
+    from evaluation.testutils import TESTSET_FILE, load_test_entries
+
+    testset = testset or TESTSET_FILE
+    if generate:
+        asyncio.run(generate_entries(generate, testset))
+
+    entries = load_test_entries(testset)
+    if args.repos:
+        entries = {repo: entries[repo] for repo in args.repos if repo in entries}
+    if not entries:
+        parser.error(f"No test cases to run in {testset}")
+
+    print(f"Evaluating {len(entries)} repos with {args.workers} workers", flush=True)
+    rows = []
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for future in as_completed([pool.submit(evaluate_repo, entry) for entry in entries.values()]):
+            row = future.result()
+            rows.append(row)
+            status = row["error"] or f"F1 {row['f1_score']}"
+            print(f"{row['repo']}: {status} ({row['seconds']}s)", flush=True)
+
+    rows.sort(key=lambda row: row["repo"])
+    summary = summarize(rows)
+    print()
+    print_table(rows, summary)
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({"question_set": testset, "workers": args.workers, "summary": summary, "repos": rows}, f, indent=2)
+    print(f"Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
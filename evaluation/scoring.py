@@ -0,0 +1,83 @@
+import re
+from bisect import bisect_right
+
+# "- ", "* ", "1. ", "2) " in front of a listed item
+LIST_MARKER = re.compile(r"^(?:[-*\u2022]|\d+[.)])\s+")
+WHITESPACE = re.compile(r"\s+")
+WORD = re.compile(r"\w+")
+
+def normalize(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip().lower()
+
+def normalize_line(line: str) -> str:
+    return LIST_MARKER.sub("", normalize(line)).strip("`\"' ")
+
+def commit_subject(message: str) -> str:
+    # Answers list commits by their first line, so that is what is matched
+    return normalize(message.strip().split("\n", 1)[0])
+
+class LineIndex:
+    # The predicted lines, indexed so each expected message is checked against a few candidate lines
+    # instead of all of them: whole lines through a dict, otherwise through an inverted index of words.
+    # A message's first and last words may be cut off inside a longer word of the line, so only the
+    # words between them must appear whole; the rarest of those picks the candidates.
+
+    def __init__(self, lines: list):
+        self.lines = lines
+        self.exact = {}
+        self.postings = {}  # word -> indexes of the lines containing it, ascending
+        for i, line in enumerate(lines):
+            self.exact.setdefault(line, i)
+            for word in set(WORD.findall(line)):
+                self.postings.setdefault(word, []).append(i)
+        self.text = "\n".join(lines)
+        self.starts = []
+        offset = 0
+        for line in lines:
+            self.starts.append(offset)
+            offset += len(line) + 1
+
+    def find(self, needle: str):
+        # Index of the first line containing needle, or None
+        if not needle:
+            return None
+        if needle in self.exact:
+            return self.exact[needle]
+        inner = WORD.findall(needle)[1:-1]
+        if inner:
+            candidates = min((self.postings.get(word, []) for word in inner), key=len)
+            return next((i for i in candidates if needle in self.lines[i]), None)
+        # Too short to index: one search over all lines joined by newlines (which normalized text never
+        # contains), mapped back to the line by its offset
+        position = self.text.find(needle)
+        return None if position < 0 else bisect_right(self.starts, position) - 1
+
+def score_answer(expected_messages: list, answer: str) -> dict:
+    # An expected commit counts as matched when its subject appears in any predicted line. Precision is
+    # over the answer's non-empty lines, recall over the expected commits.
+    predicted = [normalize_line(line) for line in answer.splitlines() if line.strip()]
+    index = LineIndex(predicted)
+
+    matched_count = 0
+    unmatched = []
+    for message in expected_messages:
+        subject = commit_subject(message)
+        line = index.find(subject)
+        found = line is not None
+        matched_count += found
+        unmatched.append({"expected": subject, "predicted": predicted[line] if found else None, "found": found})
+
+    total_expected, total_predicted = len(expected_messages), len(predicted)
+    precision = matched_count / total_predicted if total_predicted else 0.0
+    recall = matched_count / total_expected if total_expected else 0.0
+    f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) else 0.0
+
+    return {
+        "total_commits_expected": total_expected,
+        "total_commits_predicted": total_predicted,
+        "commits_matched": matched_count,
+        "precision": round(precision, 3),
+        "recall": round(recall, 3),
+        "f1_score": round(f1_score, 3),
+        "unmatched_commits": unmatched,
+    }
@@ -2,34 +2,64 @@ import os
 import json
 from utils.logger import logger
 
-TESTSET_FILE = "evaluation/testset.json"
+# One test entry per line. Saving appends; a later line for the same repo replaces earlier ones.
+TESTSET_FILE = "evaluation/testset.jsonl"
+# The original format (one JSON array rewritten on every save); still read if present
+LEGACY_TESTSET_FILE = "evaluation/testset.json"
+# What every test case asks; the expected answer is the commits of the repo's open PRs
+EVAL_QUESTION = "List all commit messages from open PRs."
 
-def save_test_entry(entry: dict):
+def build_test_entry(repo: str, prs: list) -> dict:
+    # prs is [(pr, commits)] as returned by fetch_pr_commits_async
+    commits = [
+        {"message": commit["commit"]["message"], "author": commit["commit"]["author"]["name"]}
+        for _, pr_commits in prs
+        for commit in pr_commits
+    ]
+    return {"repo": repo, "total_commits": len(commits), "commits": commits}
+
+def save_test_entry(entry: dict, path: str = TESTSET_FILE):
     try:
-        if not os.path.exists("evaluation"):
-            os.makedirs("evaluation")
-        if not os.path.exists(TESTSET_FILE):
-            with open(TESTSET_FILE, "w") as f:
-                json.dump([entry], f, indent=2)
-        else:
-            with open(TESTSET_FILE, "r+", encoding="utf-8") as f:
-                data = json.load(f)
-                data.append(entry)
-                f.seek(0)
-                json.dump(data, f, indent=2)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
         logger.info(f"Test entry saved for repo: {entry['repo']}")
     except Exception as e:
         logger.error(f"Failed to save test entry: {e}", exc_info=True)
 
-def load_test_entry(repo: str) -> dict:
+def load_test_entries(path: str = TESTSET_FILE) -> dict:
+    # repo -> entry, newest entry per repo
+    entries = {}
     try:
-        with open("evaluation/testset.json", "r", encoding="utf-8") as f:
-            all_tests = json.load(f)
-        for entry in all_tests:
-            if entry["repo"] == repo:
-                return entry
-        return None
+        if path == TESTSET_FILE and os.path.exists(LEGACY_TESTSET_FILE):
+            with open(LEGACY_TESTSET_FILE, "r", encoding="utf-8") as f:
+                entries.update((entry["repo"], entry) for entry in json.load(f))
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A save interrupted mid-line; the entries around it are intact
+                        logger.warning(f"Skipping unreadable line {line_number} in {path}")
+                        continue
+                    entries[entry["repo"]] = entry
     except Exception as e:
-        logger.error(f"Failed to load test entry: {e}", exc_info=True)
-        return None
+        logger.error(f"Failed to load test entries: {e}", exc_info=True)
+    return entries
+
+def load_test_entry(repo: str, path: str = TESTSET_FILE) -> dict:
+    return load_test_entries(path).get(repo)
 
+def compact_testset(path: str = TESTSET_FILE) -> int:
+    # Rewrites the file with one line per repo, dropping superseded entries
+    entries = load_test_entries(path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry) + "\n")
+    os.replace(tmp_path, path)
+    logger.info(f"Compacted {path} to {len(entries)} entries")
+    return len(entries)
@@ -119,7 +119,7 @@ function QueryPage() {
     setRetrievedChunks(null); // Reset chunks
     setShowChunks(false); // Hide chunks panel
 
-    try {
+    const sendQuery = async () => {
       let res;
 
       // Use authenticated endpoint if user is logged in via GitHub
@@ -139,6 +139,7 @@ function QueryPage() {
             repo: repo,
             question: question,
             access_token: authState.accessToken,
+            stream: true,
           }),
         });
       } else {
@@ -146,17 +147,78 @@ function QueryPage() {
         res = await fetch("http://localhost:8000/query", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ repo_url: repoUrl, question }),
+          body: JSON.stringify({ repo_url: repoUrl, question, stream: true }),
         });
       }
 
-      const data = await res.json();
+      // Errors raised before streaming starts come back as plain JSON
+      if (!res.headers.get("content-type")?.includes("text/event-stream")) {
+        return res.json();
+      }
+      return readAnswerStream(res);
+    };
+
+    // Server-sent events: retrieved chunks first, then answer tokens as they arrive.
+    // Resolves with the "indexing" payload, an { error }, or {} once the answer is done.
+    const readAnswerStream = async (res) => {
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let answer = "";
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) return {};
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let event = "message";
+          let data = "";
+          for (const line of raw.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          const payload = JSON.parse(data);
+
+          if (event === "indexing") return payload;
+          if (event === "error") return { error: payload.error };
+          if (event === "chunks") {
+            setRetrievedChunks(payload.retrieved_chunks); // Store chunks
+            setLoading(false); // Let the answer render as it streams in
+          } else if (event === "token") {
+            answer += payload.delta;
+            setResponse(answer);
+          }
+        }
+      }
+    };
+
+    // Cold repos are indexed in the background; wait for the job, then ask again
+    const waitForIndex = async (jobId) => {
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const res = await fetch(`http://localhost:8000/index/${jobId}`);
+        const job = await res.json();
+        if (job.status === "completed") return;
+        if (job.status === "failed" || job.status === "cancelled") {
+          throw new Error(job.error || `Indexing ${job.status}`);
+        }
+      }
+    };
+
+    try {
+      let data = await sendQuery();
+      if (data.status === "indexing") {
+        await waitForIndex(data.job.job_id);
+        data = await sendQuery();
+      }
 
       if (data.error) {
         setError(data.error);
-      } else {
-        setResponse(data.answer);
-        setRetrievedChunks(data.retrieved_chunks); // Store chunks
       }
     } catch (err) {
       setError("Something went wrong: " + err.message);
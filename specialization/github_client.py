@@ -1,19 +1,26 @@
-import requests
+import asyncio
+import httpx
 import os
+import sys
+from urllib.parse import urlencode
 from dotenv import load_dotenv
-from utils.cache import get_cached_repo, set_cached_repo
+from specialization.rate_limit import GITHUB_MAX_RETRIES, governor, token_identity
+from utils.cache import begin_cached_repo, cache_pr_records, finish_cached_repo, iter_cached_repo
+from utils.http_cache import cache_key, get_entry, set_entry, touch_entry
 from utils.logger import logger
 
 load_dotenv()
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-
-HEADERS = {
-    "Accept": "application/vnd.github+json"
-}
-
-if GITHUB_TOKEN:
-    HEADERS["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+# Point at a GitHub Enterprise host or a local stub server (see benchmarks/stubs.py)
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", 10))
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", 30))
+GITHUB_PAGE_SIZE = 100  # GitHub's maximum per_page
+# PR records written to the repo cache per round trip while a fetch streams through
+CACHE_WRITE_BATCH = int(os.getenv("CACHE_WRITE_BATCH", 100))
+# How PR records are fetched: "rest" (2 + 2N requests for N PRs) or "graphql" (a query per page of PRs)
+GITHUB_BACKEND = os.getenv("GITHUB_BACKEND", "rest").lower()
 
 def build_headers(access_token=None):
     headers = {
@@ -25,123 +32,321 @@ def build_headers(access_token=None):
         headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
     return headers
 
-def fetch_pull_requests(owner: str, repo: str, state="open", per_page=10, access_token=None):
-    url = f"https://api.github.com/repos/{owner}/{repo}/pulls"
-    params = {"state": state, "per_page": per_page}
-    headers = build_headers(access_token)
+def next_page_url(response):
+    # httpx parses the Link header into response.links
+    return response.links.get("next", {}).get("url")
+
+def full_url(url: str, params=None) -> str:
+    return f"{url}?{urlencode(params)}" if params else url
+
+def conditional_headers(entry) -> dict:
+    # Revalidate a cached response; a 304 answer doesn't count against the rate limit
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def resolve_response(key: str, entry, response):
+    # (body, next page url) for a conditional GET: the cached copy on a 304, else the fresh body, cached
+    if response.status_code == 304 and entry is not None:
+        touch_entry(key)
+        return entry["body"], entry["next_url"]
+    response.raise_for_status()
+    body = response.json()
+    next_url = next_page_url(response)
+    set_entry(key, response.headers.get("etag"), response.headers.get("last-modified"), next_url, body)
+    return body, next_url
+
+def pr_status(pr: dict) -> str:
+    # PR list items have no "merged" flag (only the single-PR endpoint does); merged_at is in both
+    if pr["state"] == "open":
+        return "open"
+    return "merged" if pr.get("merged_at") else "closed"
+
+def build_pr_record(pr: dict, comments: list, commits: list) -> dict:
+    # The unit we index and cache: one PR, addressable by number and versioned by updated_at.
+    # Keeps the structured fields the indexer splits into typed nodes, plus the flat text.
+    record = {
+        "pr_number": pr["number"],
+        "title": pr["title"],
+        "author": pr["user"]["login"],
+        "status": pr_status(pr),
+        "body": pr.get("body") or "",
+        "created_at": pr["created_at"],
+        "updated_at": pr["updated_at"],
+        "commits": [
+            {
+                "sha": commit["sha"],
+                "message": commit["commit"]["message"],
+                "author": commit["commit"]["author"]["name"],
+                "date": commit["commit"]["author"]["date"]
+            }
+            for commit in commits
+        ],
+        "comments": [
+            {
+                "author": comment["user"]["login"],
+                "created_at": comment["created_at"],
+                "body": comment["body"]
+            }
+            for comment in comments
+        ]
+    }
+    record["text"] = format_record(record)
+    return record
+
+def format_pr_header(record: dict) -> str:
+    text = f"PR #{record['pr_number']}: {record['title']}\n"
+    text += f"Author: {record['author']}\n"
+    text += f"Status: {record['status'].upper()}\n"
+    text += f"Created: {record['created_at']}\n"
+    text += f"Updated: {record['updated_at']}\n"
+    if record["status"] == "merged":
+        text += f"Merged: Yes\n"
+    text += f"Description: {record['body']}\n"
+    return text
+
+def format_pr_commits(commits: list, total: int = None) -> str:
+    # Show ALL commits in this PR (regardless of author)
+    text = f"Commits ({len(commits) if total is None else total}):\n"
+    for commit in commits:
+        text += f"- {commit['message']} (by {commit['author']} on {commit['date']}) [{commit['sha'][:7]}]\n"
+    return text
+
+def format_pr_comments(comments: list, total: int = None) -> str:
+    # Show ALL comments in this PR
+    if not comments:
+        return "Comments: None\n"
+    text = f"Comments ({len(comments) if total is None else total}):\n"
+    for comment in comments:
+        text += f"Comment by {comment['author']} on {comment['created_at']}: {comment['body']}\n"
+    return text
+
+def format_record(record: dict) -> str:
+    return format_pr_header(record) + format_pr_commits(record["commits"]) + format_pr_comments(record["comments"])
+
+def build_async_client(access_token=None) -> httpx.AsyncClient:
+    # One pooled keep-alive client per ingestion run, sized to the concurrency limit
+    limits = httpx.Limits(
+        max_connections=GITHUB_MAX_CONCURRENCY,
+        max_keepalive_connections=GITHUB_MAX_CONCURRENCY
+    )
+    return httpx.AsyncClient(
+        headers=build_headers(access_token),
+        limits=limits,
+        timeout=GITHUB_TIMEOUT
+    )
+
+async def get_json_async(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, params=None):
+    # Conditional GET through the ETag cache, paced by the token's rate-limit governor; returns
+    # (body, next page url). Waiting on the governor happens outside the semaphore so a throttled
+    # token doesn't hold connection slots.
+    url = full_url(url, params)
+    identity = token_identity(client.headers.get("Authorization"))
+    key = cache_key(identity, url)
+    entry = await asyncio.to_thread(get_entry, key)
+    headers = conditional_headers(entry)
+    for _ in range(GITHUB_MAX_RETRIES + 1):
+        await governor.await_slot(identity)
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+        if not governor.observe(identity, response):
+            break
+    return await asyncio.to_thread(resolve_response, key, entry, response)
+
+async def iter_pages_async(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str, params=None):
+    while url:
+        page, url = await get_json_async(client, semaphore, url, params)
+        yield page
+        params = None
+
+async def collect_pages_async(client, semaphore, url: str, params=None, limit: int = None):
+    # Follows every page, or stops once `limit` items have been collected
+    items = []
+    pages = iter_pages_async(client, semaphore, url, params)
+    try:
+        async for page in pages:
+            items.extend(page)
+            if limit is not None and len(items) >= limit:
+                return items[:limit]
+    finally:
+        await pages.aclose()
+    return items
+
+async def iter_pull_request_pages_async(client, semaphore, owner: str, repo: str, state="open"):
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls"
+    params = {"state": state, "per_page": GITHUB_PAGE_SIZE}
     logger.info(f"Fetching pull requests for {owner}/{repo} with state='{state}'")
+    pages = iter_pages_async(client, semaphore, url, params)
+    try:
+        async for page in pages:
+            logger.info(f"Fetched page of {len(page)} {state} PRs from {owner}/{repo}")
+            yield page
+    finally:
+        # `async for` doesn't close the inner generator when we stop early
+        await pages.aclose()
 
+async def fetch_pr_details_async(client, semaphore, owner: str, repo: str, pr_number: int):
+    comments_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/issues/{pr_number}/comments"
+    commits_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls/{pr_number}/commits"
+    params = {"per_page": GITHUB_PAGE_SIZE}
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        prs = response.json()
-        logger.info(f"Fetched {len(prs)} PRs from {owner}/{repo}")
-        return prs
+        comments, commits = await asyncio.gather(
+            collect_pages_async(client, semaphore, comments_url, params),
+            collect_pages_async(client, semaphore, commits_url, params)
+        )
+        logger.info(f"Fetched {len(comments)} comments and {len(commits)} commits for PR #{pr_number}")
+        return comments, commits
     except Exception as e:
-        logger.error(f"Failed to fetch PRs: {e}", exc_info=True)
+        logger.error(f"Failed to fetch details for PR #{pr_number}: {e}", exc_info=True)
         raise
 
-def fetch_comments(owner: str, repo: str, pr_number: int, access_token=None):
-    url = f"https://api.github.com/repos/{owner}/{repo}/issues/{pr_number}/comments"
-    headers = build_headers(access_token)
-    logger.info(f"Fetching comments for PR #{pr_number} in {owner}/{repo}")
+async def fetch_pr_async(client, semaphore, owner: str, repo: str, pr_number: int):
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls/{pr_number}"
+    logger.info(f"Fetching PR #{pr_number} in {owner}/{repo}")
+    pr, _ = await get_json_async(client, semaphore, url)
+    return pr
+
+async def build_pr_records_async(client, semaphore, owner: str, repo: str, prs: list):
+    # Fan out comment and commit fetches for a batch of PRs; the semaphore bounds in-flight requests
+    details = await asyncio.gather(*(
+        fetch_pr_details_async(client, semaphore, owner, repo, pr["number"]) for pr in prs
+    ))
+    return [build_pr_record(pr, comments, commits) for pr, (comments, commits) in zip(prs, details)]
+
+async def iter_pr_records_async(owner: str, repo: str, access_token=None):
+    # Yields one record per PR, a page of PRs at a time (open first, then closed)
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+
+    async with build_async_client(access_token) as client:
+        for state in ("open", "closed"):
+            pages = iter_pull_request_pages_async(client, semaphore, owner, repo, state=state)
+            try:
+                async for prs in pages:
+                    for record in await build_pr_records_async(client, semaphore, owner, repo, prs):
+                        yield record
+            finally:
+                await pages.aclose()
+
+async def iter_updated_pr_records_async(owner: str, repo: str, since: str = None, access_token=None):
+    # Walks PRs most-recently-updated first and stops at the first one not newer than `since`
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls"
+    params = {"state": "all", "sort": "updated", "direction": "desc", "per_page": GITHUB_PAGE_SIZE}
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+    logger.info(f"Fetching PRs updated since {since} for {owner}/{repo}")
+
+    async with build_async_client(access_token) as client:
+        pages = iter_pages_async(client, semaphore, url, params)
+        try:
+            async for page in pages:
+                changed = [pr for pr in page if since is None or pr["updated_at"] > since]
+                for record in await build_pr_records_async(client, semaphore, owner, repo, changed):
+                    yield record
+                if len(changed) < len(page):
+                    break
+        finally:
+            await pages.aclose()
+
+async def fetch_pr_record_async(owner: str, repo: str, pr_number: int, access_token=None):
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+    async with build_async_client(access_token) as client:
+        pr = await fetch_pr_async(client, semaphore, owner, repo, pr_number)
+        records = await build_pr_records_async(client, semaphore, owner, repo, [pr])
+    return records[0]
+
+async def fetch_pr_commits_async(owner: str, repo: str, state="open", per_page=GITHUB_PAGE_SIZE, access_token=None, max_prs=None):
+    # Returns [(pr, commits)] for every PR in `state` (at most `max_prs` of them); the per-PR
+    # commit fetches run concurrently
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls"
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        comments = response.json()
-        logger.info(f"Fetched {len(comments)} comments for PR #{pr_number}")
-        return comments
+        async with build_async_client(access_token) as client:
+            prs = await collect_pages_async(client, semaphore, url, {"state": state, "per_page": per_page}, limit=max_prs)
+            logger.info(f"Fetched {len(prs)} {state} PRs from {owner}/{repo}")
+            commits = await asyncio.gather(*(
+                collect_pages_async(
+                    client, semaphore, f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls/{pr['number']}/commits",
+                    {"per_page": GITHUB_PAGE_SIZE}
+                )
+                for pr in prs
+            ))
+        return list(zip(prs, commits))
     except Exception as e:
-        logger.error(f"Failed to fetch comments for PR #{pr_number}: {e}", exc_info=True)
+        logger.error(f"Failed to fetch PR commits for {owner}/{repo}: {e}", exc_info=True)
         raise
 
-def fetch_commits(owner: str, repo: str, pr_number: int, access_token=None):
-    url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/commits"
-    headers = build_headers(access_token)
-    logger.info(f"Fetching commits for PR #{pr_number} in {owner}/{repo}")
+def record_source(access_token=None):
+    # The module whose *_pr_records_async functions fetch records: this one (REST) or
+    # github_graphql. Both produce identical records.
+    if GITHUB_BACKEND == "graphql":
+        if access_token or GITHUB_TOKEN:
+            from specialization import github_graphql  # imports this module, so not at the top
+            return github_graphql
+        logger.warning("GITHUB_BACKEND=graphql needs a GitHub token; using the REST backend")
+    return sys.modules[__name__]
+
+def iter_sync(stream):
+    # Synchronous view over an async generator, driven on a private event loop
+    loop = asyncio.new_event_loop()
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        commits = response.json()
-        logger.info(f"Fetched {len(commits)} commits for PR #{pr_number}")
-        return commits
-    except Exception as e:
-        logger.error(f"Failed to fetch commits for PR #{pr_number}: {e}", exc_info=True)
-        raise
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
 
-def fetch_and_format(owner: str, repo: str, access_token=None):
+def iter_updated_pr_records(owner: str, repo: str, since: str = None, access_token=None):
+    source = record_source(access_token)
+    return iter_sync(source.iter_updated_pr_records_async(owner, repo, since=since, access_token=access_token))
+
+def fetch_pr_record(owner: str, repo: str, pr_number: int, access_token=None):
+    source = record_source(access_token)
+    return asyncio.run(source.fetch_pr_record_async(owner, repo, pr_number, access_token=access_token))
+
+def iter_pr_records(owner: str, repo: str, access_token=None):
     logger.info(f"Starting to fetch and format PR data for {owner}/{repo}")
 
-    # Check cache
-    cached = get_cached_repo(owner, repo)
-    if cached:
-        return cached
+    # Check cache; PRs invalidated since it was written are refetched one by one
+    cached = iter_cached_repo(owner, repo)
+    if cached is not None:
+        for pr_number, record in cached:
+            if record is None:
+                record = fetch_pr_record(owner, repo, pr_number, access_token=access_token)
+                cache_pr_records(owner, repo, [record])
+            yield record
+        return
 
-    data = []
-    
-    # Fetch PRs (both open and closed)
-    open_prs = fetch_pull_requests(owner, repo, state="open", per_page=50, access_token=access_token)
-    closed_prs = fetch_pull_requests(owner, repo, state="closed", per_page=50, access_token=access_token)
-    all_prs = open_prs + closed_prs
+    # Cache records in batches as they stream through; the copy is only used once complete
+    begin_cached_repo(owner, repo)
+    batch = []
+    count = 0
+    source = record_source(access_token)
+    for record in iter_sync(source.iter_pr_records_async(owner, repo, access_token=access_token)):
+        count += 1
+        batch.append(record)
+        if len(batch) >= CACHE_WRITE_BATCH:
+            cache_pr_records(owner, repo, batch)
+            batch = []
+        yield record
 
-    if not all_prs:
+    if not count:
         logger.warning(f"No PRs found for {owner}/{repo}")
-        return data
-
-    for pr in all_prs:
-        pr_number = pr["number"]
-        title = pr["title"]
-        author = pr["user"]["login"]
-        body = pr.get("body", "")
-        state = pr["state"]
-        merged = pr.get("merged", False)
-        created_at = pr["created_at"]
-        updated_at = pr["updated_at"]
-        
-        if state == "open":
-            status = "OPEN"
-        elif merged:
-            status = "MERGED"
-        else:
-            status = "CLOSED"
-        
-        comments = fetch_comments(owner, repo, pr_number, access_token=access_token)
-        commits = fetch_commits(owner, repo, pr_number, access_token=access_token)
-
-        text = f"PR #{pr_number}: {title}\n"
-        text += f"Author: {author}\n"
-        text += f"Status: {status}\n"
-        text += f"Created: {created_at}\n"
-        text += f"Updated: {updated_at}\n"
-        if merged:
-            text += f"Merged: Yes\n"
-        text += f"Description: {body}\n"
-
-        # Show ALL commits in this PR (regardless of author)
-        text += f"Commits ({len(commits)}):\n"
-        for commit in commits:
-            msg = commit["commit"]["message"]
-            commit_author = commit["commit"]["author"]["name"]
-            commit_date = commit["commit"]["author"]["date"]
-            sha = commit["sha"][:7]
-            text += f"- {msg} (by {commit_author} on {commit_date}) [{sha}]\n"
-
-        # Show ALL comments in this PR
-        if comments:
-            text += f"Comments ({len(comments)}):\n"
-            for comment in comments:
-                commenter = comment["user"]["login"]
-                comment_date = comment["created_at"]
-                text += f"Comment by {commenter} on {comment_date}: {comment['body']}\n"
-        else:
-            text += "Comments: None\n"
-
-        data.append(text)
-    
-    logger.info(f"Formatted {len(data)} PR documents for {owner}/{repo}")
-
-    # Cache the result
-    set_cached_repo(owner, repo, data)
-
-    return data
+        return
 
+    logger.info(f"Formatted {count} PR documents for {owner}/{repo}")
+
+    cache_pr_records(owner, repo, batch)
+    finish_cached_repo(owner, repo)
+
+def iter_documents(owner: str, repo: str, access_token=None):
+    for record in iter_pr_records(owner, repo, access_token=access_token):
+        yield record["text"]
+
+def fetch_and_format(owner: str, repo: str, access_token=None):
+    return list(iter_documents(owner, repo, access_token=access_token))
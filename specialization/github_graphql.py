@@ -0,0 +1,219 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from specialization.github_client import GITHUB_API_URL, GITHUB_MAX_CONCURRENCY, build_async_client, build_pr_record
+from specialization.rate_limit import GITHUB_MAX_RETRIES, governor, token_identity
+from utils.logger import logger
+
+load_dotenv()
+
+# api.github.com serves GraphQL at /graphql, GitHub Enterprise at /api/graphql
+GITHUB_GRAPHQL_URL = os.getenv("GITHUB_GRAPHQL_URL", f"{GITHUB_API_URL}/graphql")
+# PRs per query. Each PR brings up to GRAPHQL_NESTED_PAGE_SIZE commits and comments, so large pages
+# can hit GitHub's query timeout.
+GITHUB_GRAPHQL_PAGE_SIZE = int(os.getenv("GITHUB_GRAPHQL_PAGE_SIZE", 25))
+GRAPHQL_NESTED_PAGE_SIZE = 100  # GitHub's maximum for a connection
+
+PR_FIELDS = """
+    number title body state createdAt updatedAt mergedAt
+    author { login }
+    commits(first: $nested) {
+      pageInfo { hasNextPage endCursor }
+      nodes { commit { oid message author { name date } } }
+    }
+    comments(first: $nested) {
+      pageInfo { hasNextPage endCursor }
+      nodes { author { login } createdAt body }
+    }
+"""
+
+PULL_REQUESTS_QUERY = """
+query PullRequests($owner: String!, $repo: String!, $states: [PullRequestState!], $orderBy: IssueOrder!,
+                   $first: Int!, $after: String, $nested: Int!) {
+  repository(owner: $owner, name: $repo) {
+    pullRequests(states: $states, orderBy: $orderBy, first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %s }
+    }
+  }
+}
+""" % PR_FIELDS
+
+PULL_REQUEST_QUERY = """
+query PullRequest($owner: String!, $repo: String!, $number: Int!, $nested: Int!) {
+  repository(owner: $owner, name: $repo) {
+    pullRequest(number: $number) { %s }
+  }
+}
+""" % PR_FIELDS
+
+# Further pages of one PR's commits or comments, for PRs with more than GRAPHQL_NESTED_PAGE_SIZE
+CONNECTION_QUERIES = {
+    connection: """
+query PullRequestConnection($owner: String!, $repo: String!, $number: Int!, $nested: Int!, $after: String) {
+  repository(owner: $owner, name: $repo) {
+    pullRequest(number: $number) {
+      %s(first: $nested, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes { %s }
+      }
+    }
+  }
+}
+""" % (connection, nodes)
+    for connection, nodes in (
+        ("commits", "commit { oid message author { name date } }"),
+        ("comments", "author { login } createdAt body"),
+    )
+}
+
+STATES = {"open": ["OPEN"], "closed": ["CLOSED", "MERGED"], "all": ["OPEN", "CLOSED", "MERGED"]}
+
+
+class GraphQLError(Exception):
+    pass
+
+
+async def run_query(client, semaphore: asyncio.Semaphore, operation: str, query: str, variables: dict) -> dict:
+    identity = token_identity(client.headers.get("Authorization"))
+    for _ in range(GITHUB_MAX_RETRIES + 1):
+        await governor.await_slot(identity, "graphql")
+        async with semaphore:
+            response = await client.post(
+                GITHUB_GRAPHQL_URL,
+                json={"query": query, "operationName": operation, "variables": variables}
+            )
+        if not governor.observe(identity, response):
+            break
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get("errors"):
+        raise GraphQLError("; ".join(error.get("message", str(error)) for error in payload["errors"]))
+    return payload["data"]
+
+
+def login_of(actor) -> str:
+    # Deleted accounts come back as null; REST reports them as the "ghost" user
+    return actor["login"] if actor else "ghost"
+
+
+def utc_timestamp(value: str) -> str:
+    # Commit dates are GitTimestamps, which keep the committer's UTC offset; REST reports them in UTC
+    if not value:
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def to_rest_shapes(node: dict, commits: list, comments: list):
+    # The REST shapes build_pr_record expects, so both backends produce identical records
+    pr = {
+        "number": node["number"],
+        "title": node["title"],
+        "user": {"login": login_of(node["author"])},
+        "body": node["body"],
+        "state": "open" if node["state"] == "OPEN" else "closed",
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "merged_at": node["mergedAt"],
+    }
+    rest_commits = [
+        {
+            "sha": c["commit"]["oid"],
+            "commit": {
+                "message": c["commit"]["message"],
+                "author": {"name": c["commit"]["author"]["name"], "date": utc_timestamp(c["commit"]["author"]["date"])},
+            },
+        }
+        for c in commits
+    ]
+    rest_comments = [
+        {"user": {"login": login_of(c["author"])}, "created_at": c["createdAt"], "body": c["body"]}
+        for c in comments
+    ]
+    return pr, rest_comments, rest_commits
+
+
+async def rest_of_connection(client, semaphore, owner: str, repo: str, number: int, connection: str, page: dict) -> list:
+    # All nodes of a PR's commits or comments, fetching the pages after the embedded first one
+    nodes = list(page["nodes"])
+    page_info = page["pageInfo"]
+    while page_info["hasNextPage"]:
+        data = await run_query(client, semaphore, "PullRequestConnection", CONNECTION_QUERIES[connection], {
+            "owner": owner, "repo": repo, "number": number,
+            "nested": GRAPHQL_NESTED_PAGE_SIZE, "after": page_info["endCursor"],
+        })
+        page = data["repository"]["pullRequest"][connection]
+        nodes.extend(page["nodes"])
+        page_info = page["pageInfo"]
+    return nodes
+
+
+async def build_record(client, semaphore, owner: str, repo: str, node: dict) -> dict:
+    commits, comments = await asyncio.gather(
+        rest_of_connection(client, semaphore, owner, repo, node["number"], "commits", node["commits"]),
+        rest_of_connection(client, semaphore, owner, repo, node["number"], "comments", node["comments"])
+    )
+    return build_pr_record(*to_rest_shapes(node, commits, comments))
+
+
+async def iter_pull_request_pages(client, semaphore, owner: str, repo: str, state: str, order_field: str):
+    cursor = None
+    while True:
+        data = await run_query(client, semaphore, "PullRequests", PULL_REQUESTS_QUERY, {
+            "owner": owner, "repo": repo, "states": STATES[state],
+            "orderBy": {"field": order_field, "direction": "DESC"},
+            "first": GITHUB_GRAPHQL_PAGE_SIZE, "after": cursor, "nested": GRAPHQL_NESTED_PAGE_SIZE,
+        })
+        repository = data["repository"]
+        if repository is None:
+            raise GraphQLError(f"Repository {owner}/{repo} not found")
+        connection = repository["pullRequests"]
+        logger.info(f"Fetched page of {len(connection['nodes'])} {state} PRs from {owner}/{repo} (GraphQL)")
+        yield connection["nodes"]
+        if not connection["pageInfo"]["hasNextPage"]:
+            break
+        cursor = connection["pageInfo"]["endCursor"]
+
+
+async def iter_pr_records_async(owner: str, repo: str, access_token=None):
+    # Same records and order as the REST backend (open PRs first, then closed, newest first),
+    # with each PR's commits and comments embedded in the page query
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+    async with build_async_client(access_token) as client:
+        for state in ("open", "closed"):
+            pages = iter_pull_request_pages(client, semaphore, owner, repo, state, "CREATED_AT")
+            try:
+                async for nodes in pages:
+                    for record in await asyncio.gather(*(build_record(client, semaphore, owner, repo, n) for n in nodes)):
+                        yield record
+            finally:
+                await pages.aclose()
+
+
+async def iter_updated_pr_records_async(owner: str, repo: str, since: str = None, access_token=None):
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+    logger.info(f"Fetching PRs updated since {since} for {owner}/{repo} (GraphQL)")
+    async with build_async_client(access_token) as client:
+        pages = iter_pull_request_pages(client, semaphore, owner, repo, "all", "UPDATED_AT")
+        try:
+            async for nodes in pages:
+                changed = [n for n in nodes if since is None or n["updatedAt"] > since]
+                for record in await asyncio.gather(*(build_record(client, semaphore, owner, repo, n) for n in changed)):
+                    yield record
+                if len(changed) < len(nodes):
+                    break
+        finally:
+            await pages.aclose()
+
+
+async def fetch_pr_record_async(owner: str, repo: str, pr_number: int, access_token=None):
+    semaphore = asyncio.Semaphore(GITHUB_MAX_CONCURRENCY)
+    async with build_async_client(access_token) as client:
+        data = await run_query(client, semaphore, "PullRequest", PULL_REQUEST_QUERY, {
+            "owner": owner, "repo": repo, "number": pr_number, "nested": GRAPHQL_NESTED_PAGE_SIZE,
+        })
+        node = (data["repository"] or {}).get("pullRequest")
+        if node is None:
+            raise GraphQLError(f"PR #{pr_number} not found in {owner}/{repo}")
+        return await build_record(client, semaphore, owner, repo, node)
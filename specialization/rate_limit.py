@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from utils.logger import logger
+from utils.tracing import count_github_request
+
+load_dotenv()
+
+# Requests left unspent in each token's quota: fetches wait for the reset instead of using them,
+# so the token never runs fully dry for other clients sharing it
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 50))
+# Below this share of the quota, requests are spread evenly over the rest of the window
+GITHUB_THROTTLE_FRACTION = float(os.getenv("GITHUB_THROTTLE_FRACTION", 0.2))
+# Longest a fetch waits for a quota reset before giving up
+GITHUB_MAX_RATE_WAIT_SECONDS = float(os.getenv("GITHUB_MAX_RATE_WAIT_SECONDS", 3600))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", 5))
+# GitHub asks clients to wait at least a minute after a secondary rate limit without Retry-After
+SECONDARY_LIMIT_WAIT_SECONDS = 60
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+def token_identity(authorization: str = None) -> str:
+    # Quotas are per token: the server's GITHUB_TOKEN, each OAuth access token, or the caller's IP
+    if not authorization:
+        return "anonymous"
+    token = authorization.split(" ", 1)[-1]
+    if token == os.getenv("GITHUB_TOKEN"):
+        return "server"
+    return "oauth:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+
+class TokenQuota:
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None  # epoch seconds
+        self.blocked_until = 0.0  # epoch seconds, after a secondary limit
+        self.next_slot = 0.0  # epoch seconds, when throttling
+
+
+class RateLimitGovernor:
+    # Tracks each token's REST/GraphQL quota from the X-RateLimit-* headers and hands out request
+    # slots: free while the quota is healthy, evenly spaced once it runs low, and held until the
+    # reset when only the reserve is left, so long ingests slow down instead of failing halfway.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotas = {}  # (identity, resource) -> TokenQuota
+
+    def _quota(self, identity: str, resource: str) -> TokenQuota:
+        key = (identity, resource)
+        if key not in self._quotas:
+            self._quotas[key] = TokenQuota()
+        return self._quotas[key]
+
+    def reserve(self, identity: str, resource: str = "core") -> float:
+        # Seconds the caller must wait before sending its request
+        with self._lock:
+            quota = self._quota(identity, resource)
+            now = time.time()
+            start = max(now, quota.blocked_until)
+
+            if quota.remaining is not None and quota.reset_at is not None and quota.reset_at > now:
+                spare = quota.remaining - GITHUB_RATE_LIMIT_RESERVE
+                if spare <= 0:
+                    start = max(start, quota.reset_at + 1)
+                elif quota.limit and quota.remaining < quota.limit * GITHUB_THROTTLE_FRACTION:
+                    interval = (quota.reset_at - now) / spare
+                    start = max(start, quota.next_slot)
+                    quota.next_slot = start + interval
+                # Count the request now so concurrent callers see it before its headers arrive
+                quota.remaining -= 1
+
+            wait = start - now
+        if wait > GITHUB_MAX_RATE_WAIT_SECONDS:
+            raise RateLimitExceeded(
+                f"GitHub quota for {identity} ({resource}) resets in {wait:.0f}s, "
+                f"beyond GITHUB_MAX_RATE_WAIT_SECONDS={GITHUB_MAX_RATE_WAIT_SECONDS:.0f}"
+            )
+        if wait > 1:
+            logger.info(f"GitHub rate governor: delaying {identity} ({resource}) request by {wait:.1f}s")
+        return max(0.0, wait)
+
+    async def await_slot(self, identity: str, resource: str = "core"):
+        delay = self.reserve(identity, resource)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def observe(self, identity: str, response) -> bool:
+        # Updates the quota from an httpx response; True when the request was rejected by a
+        # rate limit and should be retried
+        status_code, headers = response.status_code, response.headers
+        resource = headers.get("x-ratelimit-resource", "core")
+        retry = self._update(identity, resource, response)
+        if retry:
+            outcome = "rate_limited"
+        elif status_code == 304:
+            outcome = "not_modified"
+        else:
+            outcome = "error" if status_code >= 400 else "ok"
+        count_github_request(resource, outcome)
+        return retry
+
+    def _update(self, identity: str, resource: str, response) -> bool:
+        status_code, headers = response.status_code, response.headers
+        with self._lock:
+            quota = self._quota(identity, resource)
+            if headers.get("x-ratelimit-remaining") is not None:
+                quota.limit = int(headers.get("x-ratelimit-limit", quota.limit or 0))
+                quota.remaining = int(headers["x-ratelimit-remaining"])
+                quota.reset_at = float(headers.get("x-ratelimit-reset", quota.reset_at or 0))
+
+            if status_code not in (403, 429):
+                return False
+            retry_after = headers.get("retry-after")
+            if retry_after is not None:
+                quota.blocked_until = max(quota.blocked_until, time.time() + float(retry_after))
+            elif quota.remaining == 0 and quota.reset_at:
+                quota.blocked_until = max(quota.blocked_until, quota.reset_at + 1)
+            elif status_code == 429 or "rate limit" in response.text.lower():
+                quota.blocked_until = max(quota.blocked_until, time.time() + SECONDARY_LIMIT_WAIT_SECONDS)
+            else:
+                # A plain 403 (no access, SSO, ...) is not a rate limit
+                return False
+        logger.warning(f"GitHub rate limit hit for {identity} ({resource}); retrying after the quota frees up")
+        return True
+
+    def stats(self) -> list:
+        with self._lock:
+            now = time.time()
+            return [
+                {
+                    "token": identity,
+                    "resource": resource,
+                    "limit": quota.limit,
+                    "remaining": quota.remaining,
+                    "resets_in_seconds": max(0, round(quota.reset_at - now)) if quota.reset_at else None,
+                    "blocked_for_seconds": max(0, round(quota.blocked_until - now))
+                }
+                for (identity, resource), quota in self._quotas.items()
+            ]
+
+
+governor = RateLimitGovernor()
@@ -0,0 +1,47 @@
+import os
+import socket
+import sys
+import tempfile
+
+# App modules read their settings when first imported and the logger writes app.log to the working
+# directory, so everything points at a scratch directory, the in-process Redis stand-in and the
+# GitHub stub's port before any of them loads
+_workdir = tempfile.mkdtemp(prefix="codereview-tests-")
+for name, filename in (("PR_STORE_PATH", "pr_store.db"), ("LEXICAL_INDEX_PATH", "lexical_index.db"),
+                       ("EMBEDDING_CACHE_PATH", "embedding_cache.db"), ("HTTP_CACHE_PATH", "http_cache.db"),
+                       ("CHROMA_PATH", "chroma_db")):
+    os.environ[name] = os.path.join(_workdir, filename)
+with socket.socket() as _sock:
+    _sock.bind(("127.0.0.1", 0))
+    GITHUB_STUB_PORT = _sock.getsockname()[1]
+os.environ.update(REDIS_BACKEND="memory", GITHUB_API_URL=f"http://127.0.0.1:{GITHUB_STUB_PORT}", GITHUB_BACKEND="rest")
+os.environ.pop("GITHUB_TOKEN", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(_workdir)
+
+import pytest
+
+from benchmarks.stubs import create_github_app, start_server, synthetic_prs
+
+GITHUB_STUB_PRS = 12
+
+
+@pytest.fixture(scope="session")
+def github_stub():
+    # The stub GitHub app serving GITHUB_STUB_PRS synthetic PRs; app.state.requests counts its responses
+    app = create_github_app(GITHUB_STUB_PRS, latency_ms=0, comments_per_pr=2, commits_per_pr=2)
+    server, thread = start_server(app, GITHUB_STUB_PORT)
+    yield app
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def pr_records():
+    # build_pr_record output for the stub's synthetic repository, as indexing stores it
+    from specialization.github_client import build_pr_record
+
+    def build(pr_count: int = 12, comments_per_pr: int = 2, commits_per_pr: int = 2):
+        prs, comments, commits = synthetic_prs(pr_count, comments_per_pr, commits_per_pr)
+        return [build_pr_record(prs[n], comments[n], commits[n]) for n in prs]
+    return build
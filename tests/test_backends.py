@@ -0,0 +1,75 @@
+import asyncio
+import socket
+import uuid
+
+import pytest
+
+from benchmarks.stubs import create_fixture_github_app, load_expected_records, start_server
+from specialization import github_client, github_graphql
+from specialization.github_graphql import utc_timestamp
+
+# The GraphQL backend needs a token; the fixture server accepts any
+TOKEN = "fixture-token"
+EXPECTED = load_expected_records()
+OWNER, REPO = EXPECTED["repository"].split("/")
+
+
+@pytest.fixture(scope="module")
+def fixture_server():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server, thread = start_server(create_fixture_github_app(), port)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture(params=["rest", "graphql"])
+def source(request, fixture_server, monkeypatch):
+    monkeypatch.setattr(github_client, "GITHUB_API_URL", fixture_server)
+    monkeypatch.setattr(github_graphql, "GITHUB_GRAPHQL_URL", f"{fixture_server}/graphql")
+    monkeypatch.setattr(github_client, "GITHUB_BACKEND", request.param)
+    return github_client.record_source(TOKEN)
+
+
+def without_text(records: list) -> list:
+    return [{key: value for key, value in record.items() if key != "text"} for record in records]
+
+
+def test_full_fetch_matches_the_recorded_repository(source):
+    records = github_client.iter_sync(source.iter_pr_records_async(OWNER, REPO, access_token=TOKEN))
+
+    assert without_text(records) == EXPECTED["records"]
+
+
+def test_updated_since_fetch_stops_at_older_prs(source):
+    since = EXPECTED["since"]
+    records = github_client.iter_sync(source.iter_updated_pr_records_async(OWNER, REPO, since=since, access_token=TOKEN))
+
+    wanted = sorted((r for r in EXPECTED["records"] if r["updated_at"] > since), key=lambda r: r["updated_at"], reverse=True)
+    assert without_text(records) == wanted
+
+
+def test_single_pr_fetch_reports_merged_status(source):
+    merged = next(r for r in EXPECTED["records"] if r["status"] == "merged")
+
+    record = asyncio.run(source.fetch_pr_record_async(OWNER, REPO, merged["pr_number"], access_token=TOKEN))
+
+    assert without_text([record]) == [merged]
+
+
+def test_git_timestamps_are_converted_to_utc():
+    assert utc_timestamp("2024-05-06T09:10:02-07:00") == "2024-05-06T16:10:02Z"
+    assert utc_timestamp("2024-04-29T13:55:31Z") == "2024-04-29T13:55:31Z"
+
+
+def test_pr_commit_fetch_stops_paging_at_max_prs(github_stub):
+    repo = f"capped-{uuid.uuid4().hex[:8]}"
+    requests_before = sum(github_stub.state.requests.values())
+
+    prs = asyncio.run(github_client.fetch_pr_commits_async("stub", repo, state="closed", per_page=2, max_prs=3))
+
+    assert [len(commits) for _, commits in prs] == [2, 2, 2]
+    # Two pages of PRs and one commit page per PR; the remaining closed PRs are never listed
+    assert sum(github_stub.state.requests.values()) - requests_before == 5
@@ -0,0 +1,62 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from baseline.generator.generator import RRF_K, fuse_rankings, pack_context
+
+
+def node(node_id: str, text: str, score: float = None) -> NodeWithScore:
+    return NodeWithScore(node=TextNode(id_=node_id, text=text), score=score)
+
+
+def ids(nodes) -> list:
+    return [n.node.node_id for n in nodes]
+
+
+def test_rrf_ranks_nodes_found_by_both_searches_first():
+    vector = [node("a", "alpha"), node("b", "beta"), node("c", "gamma")]
+    lexical = [node("c", "gamma"), node("d", "delta")]
+
+    fused = fuse_rankings(vector, lexical)
+
+    # b and d are both second in their lists, so they tie
+    assert ids(fused) == ["c", "a", "b", "d"]
+    assert fused[2].score == fused[3].score
+    assert fused[0].score == 1 / (RRF_K + 3) + 1 / (RRF_K + 1)
+
+
+def test_pack_context_stays_within_the_token_budget():
+    long_text = " ".join(f"word{i}" for i in range(200))
+    candidates = [
+        node("best", "the best chunk about caching", 0.9),
+        node("long", long_text, 0.85),
+        node("small", "a short note on eviction", 0.8),
+    ]
+
+    chosen, tokens = pack_context(candidates, budget=50, score_cliff=None)
+
+    assert ids(chosen) == ["best", "small"]
+    assert sum(tokens) <= 50
+
+
+def test_pack_context_skips_near_duplicates():
+    candidates = [
+        node("a", "refactor the cache module and add eviction", 0.9),
+        node("a-copy", "refactor the cache module and add eviction", 0.89),
+        node("b", "document the webhook endpoint", 0.7),
+    ]
+
+    chosen, _ = pack_context(candidates, budget=1000, score_cliff=None)
+
+    assert ids(chosen) == ["a", "b"]
+
+
+def test_pack_context_stops_at_a_score_cliff():
+    candidates = [
+        node("a", "first relevant chunk", 0.90),
+        node("b", "second relevant chunk here", 0.88),
+        node("c", "third chunk that still matters", 0.86),
+        node("d", "an unrelated chunk", 0.40),
+    ]
+
+    chosen, _ = pack_context(candidates, budget=1000, score_cliff=0.1)
+
+    assert ids(chosen) == ["a", "b", "c"]
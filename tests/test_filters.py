@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+from baseline.retriever.filters import DAY_SECONDS, is_identifier_query, parse_filters, query_filters
+
+NOW = datetime(2024, 3, 15, 13, 30, tzinfo=timezone.utc).timestamp()
+
+
+def utc(*args) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+def test_pr_number_status_and_author():
+    filters = parse_filters("What did alice change in PR #42, by @alice, while it was open or merged?", NOW)
+
+    assert filters["pr_number"] == 42
+    assert filters["statuses"] == ["merged", "open"]
+    assert filters["author"] == "alice"
+
+
+def test_by_phrases_that_name_no_author():
+    assert parse_filters("PRs sorted by date", NOW)["author"] is None
+    assert parse_filters("commits from open PRs", NOW)["author"] is None
+
+
+def test_content_type_only_when_unambiguous():
+    assert parse_filters("List all commits", NOW)["node_type"] == "commits"
+    assert parse_filters("Show review comments", NOW)["node_type"] == "comments"
+    assert parse_filters("Commits and comments on PR 3", NOW)["node_type"] is None
+
+
+def test_since_dates_are_utc():
+    assert parse_filters("PRs since 2024-02-01", NOW)["since"] == utc(2024, 2, 1)
+
+
+def test_relative_periods():
+    assert parse_filters("PRs from the last 3 days", NOW)["since"] == int(NOW - 3 * DAY_SECONDS)
+    assert parse_filters("merged this week", NOW)["since"] == int(NOW - 7 * DAY_SECONDS)
+    assert parse_filters("What was merged yesterday?", NOW)["since"] == utc(2024, 3, 14)
+    assert parse_filters("What was merged today?", NOW)["since"] == utc(2024, 3, 15)
+    assert parse_filters("Summarize the PRs", NOW)["since"] is None
+
+
+def test_query_filters_match_node_metadata():
+    filters = query_filters("open PRs by bob since 2024-02-01", NOW)
+
+    assert {(f.key, f.value) for f in filters.filters} == {
+        ("status", "open"), ("author", "bob"), ("updated_ts", utc(2024, 2, 1))
+    }
+    assert query_filters("How does caching work?", NOW) is None
+
+
+def test_identifier_queries():
+    assert is_identifier_query("What changed in utils/cache.py?")
+    assert is_identifier_query("Which PR added 3f2a9c1b?")
+    assert not is_identifier_query("Why was the cache rewritten?")
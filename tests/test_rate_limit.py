@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from specialization.rate_limit import GITHUB_RATE_LIMIT_RESERVE, RateLimitExceeded, RateLimitGovernor
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200, text: str = "", **headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {name.replace("_", "-"): str(value) for name, value in headers.items()}
+
+
+def quota_response(remaining: int, limit: int = 5000, reset_in: float = 600, status_code: int = 200):
+    return FakeResponse(status_code, x_ratelimit_limit=limit, x_ratelimit_remaining=remaining,
+                        x_ratelimit_reset=time.time() + reset_in)
+
+
+def test_healthy_quota_needs_no_wait():
+    governor = RateLimitGovernor()
+    governor.observe("server", quota_response(remaining=4000))
+
+    assert governor.reserve("server") == 0.0
+
+
+def test_low_quota_spreads_requests_over_the_window():
+    governor = RateLimitGovernor()
+    governor.observe("server", quota_response(remaining=GITHUB_RATE_LIMIT_RESERVE + 100, limit=5000, reset_in=100))
+
+    assert governor.reserve("server") == 0.0
+    # 100 spare requests over 100 seconds: one a second
+    assert governor.reserve("server") == pytest.approx(1.0, abs=0.1)
+    assert governor.reserve("server") == pytest.approx(2.0, abs=0.1)
+
+
+def test_reserve_is_held_until_the_reset():
+    governor = RateLimitGovernor()
+    governor.observe("server", quota_response(remaining=GITHUB_RATE_LIMIT_RESERVE, reset_in=30))
+
+    assert governor.reserve("server") == pytest.approx(31, abs=1)
+
+
+def test_wait_beyond_the_limit_raises(monkeypatch):
+    monkeypatch.setattr("specialization.rate_limit.GITHUB_MAX_RATE_WAIT_SECONDS", 10)
+    governor = RateLimitGovernor()
+    governor.observe("server", quota_response(remaining=0, reset_in=600))
+
+    with pytest.raises(RateLimitExceeded):
+        governor.reserve("server")
+
+
+def test_secondary_limit_is_retried_after_retry_after():
+    governor = RateLimitGovernor()
+
+    assert governor.observe("server", FakeResponse(403, "secondary rate limit", retry_after=20))
+    assert governor.reserve("server") == pytest.approx(20, abs=1)
+
+
+def test_plain_forbidden_is_not_a_rate_limit():
+    governor = RateLimitGovernor()
+
+    assert not governor.observe("server", FakeResponse(403, "Resource not accessible by integration"))
+    assert governor.reserve("server") == 0.0
+
+
+def test_quotas_are_tracked_per_token_and_resource():
+    governor = RateLimitGovernor()
+    governor.observe("server", quota_response(remaining=0, reset_in=30))
+
+    assert governor.reserve("oauth:abc") == 0.0
+    assert governor.reserve("server", "graphql") == 0.0
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+from specialization.github_client import iter_pr_records
+from utils.cache import (
+    ainvalidate_repo_cache, cache_pr_records, finish_cached_repo, invalidate_repo_cache, iter_cached_repo, repo_cache_stats
+)
+
+
+def cached_repo(records):
+    owner, repo = "tests", f"cache-{uuid.uuid4().hex[:8]}"
+    cache_pr_records(owner, repo, records)
+    finish_cached_repo(owner, repo)
+    return owner, repo
+
+
+def test_invalidating_a_pr_leaves_a_tombstone(pr_records):
+    records = pr_records(pr_count=4)
+    owner, repo = cached_repo(records)
+    size_before = repo_cache_stats(owner, repo)["repo"]["bytes"]
+
+    invalidate_repo_cache(owner, repo, 2)
+
+    cached = dict(iter_cached_repo(owner, repo))
+    assert cached[2] is None
+    assert [cached[n]["pr_number"] for n in (1, 3, 4)] == [1, 3, 4]
+    assert repo_cache_stats(owner, repo)["repo"]["bytes"] < size_before
+
+
+def test_invalidating_an_uncached_repo_creates_no_partial_copy():
+    owner, repo = "tests", f"cache-{uuid.uuid4().hex[:8]}"
+
+    invalidate_repo_cache(owner, repo, 2)
+
+    assert iter_cached_repo(owner, repo) is None
+    assert repo_cache_stats(owner, repo)["repo"]["prs"] == 0
+
+
+def test_invalidating_the_repo_drops_the_copy(pr_records):
+    owner, repo = cached_repo(pr_records(pr_count=3))
+
+    invalidate_repo_cache(owner, repo)
+
+    assert iter_cached_repo(owner, repo) is None
+
+
+def test_tombstoned_pr_is_refetched_alone(github_stub):
+    owner, repo = "stub", f"tombstones-{uuid.uuid4().hex[:8]}"
+    first = {record["pr_number"]: record for record in iter_pr_records(owner, repo)}
+    invalidate_repo_cache(owner, repo, 5)
+
+    requests_before = sum(github_stub.state.requests.values())
+    second = {record["pr_number"]: record for record in iter_pr_records(owner, repo)}
+
+    # The PR itself, its comments and its commits; every other PR comes from the cache
+    assert sum(github_stub.state.requests.values()) - requests_before == 3
+    assert second == first
+    assert dict(iter_cached_repo(owner, repo))[5] == first[5]
+
+
+def test_async_invalidation_matches_the_sync_one(pr_records):
+    records = pr_records(pr_count=3)
+    owner, repo = cached_repo(records)
+
+    asyncio.run(ainvalidate_repo_cache(owner, repo, 1))
+    assert dict(iter_cached_repo(owner, repo))[1] is None
+
+    asyncio.run(ainvalidate_repo_cache(owner, repo))
+    assert iter_cached_repo(owner, repo) is None
@@ -0,0 +1,54 @@
+import uuid
+
+from baseline.router import content_terms, is_enumeration, structured_answer
+from evaluation.scoring import score_answer
+from evaluation.testutils import EVAL_QUESTION
+from utils.pr_store import replace_pr_records
+
+
+def store_repo(records):
+    owner, repo = "tests", f"router-{uuid.uuid4().hex[:8]}"
+    replace_pr_records(f"{owner}/{repo}", records)
+    return owner, repo
+
+
+def test_filter_only_questions_are_enumerations():
+    assert is_enumeration("List all commits in open PRs")
+    assert is_enumeration("How many PRs by dev3 were merged?")
+    assert content_terms("List all comments since 2024-02-01") == []
+
+
+def test_questions_with_a_topic_go_to_the_llm():
+    assert content_terms("Which PRs touch module_7?") == ["touch", "module_7"]
+    assert not is_enumeration("List the PRs that change the README")
+
+
+def test_perfect_routed_answer_scores_one(pr_records):
+    records = pr_records(pr_count=12)
+    owner, repo = store_repo(records)
+    expected = [c["message"] for r in records if r["status"] == "open" for c in r["commits"]]
+
+    structured = structured_answer(owner, repo, EVAL_QUESTION)
+
+    assert structured is not None
+    assert structured["rows"] == len(expected)
+    scores = score_answer(expected, structured["answer"])
+    assert (scores["precision"], scores["recall"], scores["f1_score"]) == (1.0, 1.0, 1.0)
+
+
+def test_truncated_listing_reports_the_total_in_the_summary(pr_records, monkeypatch):
+    monkeypatch.setattr("baseline.router.STRUCTURED_MAX_ROWS", 2)
+    owner, repo = store_repo(pr_records(pr_count=12))
+
+    structured = structured_answer(owner, repo, "List all commits")
+
+    assert structured["answer"].count("\n") == 1
+    assert structured["summary"] == "24 commits, showing the first 2"
+
+
+def test_count_questions_answer_with_the_total(pr_records):
+    owner, repo = store_repo(pr_records(pr_count=12))
+
+    structured = structured_answer(owner, repo, "How many open PRs are there?")
+
+    assert structured["answer"] == "There are 3 open PRs."
@@ -0,0 +1,21 @@
+import time
+import uuid
+
+from utils import cache
+from utils.cache import single_flight
+
+
+def test_held_lock_is_renewed_past_its_timeout():
+    key = f"tests:{uuid.uuid4().hex[:8]}"
+    with single_flight(key, timeout=1, renew_interval=0.2):
+        time.sleep(1.5)
+        assert cache.r.exists(f"lock:{key}")
+    assert not cache.r.exists(f"lock:{key}")
+
+
+def test_local_locks_are_dropped_once_released():
+    keys = [f"tests:{uuid.uuid4().hex[:8]}" for _ in range(3)]
+    for key in keys:
+        with single_flight(key):
+            assert key in cache._local_locks
+    assert not any(key in cache._local_locks for key in keys)
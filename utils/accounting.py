@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.token_counting import get_llm_token_counts
+from llama_index.core.utilities.token_counting import TokenCounter
+from specialization.rate_limit import token_identity
+from utils.cache import ar, r
+from utils.logger import logger
+from utils.tracing import count_tokens
+
+load_dotenv()
+
+# USD per million tokens. Override or extend with a JSON file of the same shape at ACCOUNTING_CONFIG_PATH.
+MODEL_PRICING = {
+    "gpt-4.1": {"prompt": 2.00, "completion": 8.00},
+    "gpt-4.1-mini": {"prompt": 0.40, "completion": 1.60},
+    "gpt-4.1-nano": {"prompt": 0.10, "completion": 0.40},
+    "gpt-4o": {"prompt": 2.50, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "completion": 0.60},
+    "text-embedding-3-small": {"embedding": 0.02},
+    "text-embedding-3-large": {"embedding": 0.13},
+    "text-embedding-ada-002": {"embedding": 0.10},
+}
+# Monthly spend allowed per repo and per user in USD; 0 means unlimited
+REPO_BUDGET_USD = float(os.getenv("REPO_BUDGET_USD", 0))
+USER_BUDGET_USD = float(os.getenv("USER_BUDGET_USD", 0))
+# Optional JSON file: {"pricing": {model: {kind: usd per 1M}}, "repo_budgets_usd": {"owner/repo": usd},
+# "user_budgets_usd": {user: usd}}
+ACCOUNTING_CONFIG_PATH = os.getenv("ACCOUNTING_CONFIG_PATH", "./accounting.json")
+# Spend counters are kept per calendar month (UTC) and expire after this long
+USAGE_RETENTION_SECONDS = 100 * 24 * 60 * 60
+
+TOKEN_KINDS = ("embedding", "prompt", "completion")
+
+
+def load_config(path: str = ACCOUNTING_CONFIG_PATH) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to read accounting config {path}: {e}", exc_info=True)
+        return {}
+
+
+_config = load_config()
+for _model, _prices in _config.get("pricing", {}).items():
+    MODEL_PRICING[_model] = {**MODEL_PRICING.get(_model, {}), **_prices}
+REPO_BUDGETS_USD = _config.get("repo_budgets_usd", {})
+USER_BUDGETS_USD = _config.get("user_budgets_usd", {})
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def token_cost(model: str, kind: str, tokens: int) -> float:
+    price = MODEL_PRICING.get(model, {}).get(kind)
+    if price is None:
+        if tokens:
+            logger.warning(f"No {kind} price for model '{model}'; counting its tokens at $0")
+        return 0.0
+    return tokens * price / 1_000_000
+
+
+class RequestUsage:
+    # Tokens and dollars spent on behalf of one repo and user. A scope opened inside another one
+    # (e.g. ask_query within a request) gets its own usage that also adds to its parent's.
+
+    def __init__(self, repo: str = None, user: str = None, parent=None):
+        self.repo = repo or (parent.repo if parent else None)
+        self.user = user or (parent.user if parent else None)
+        self.parent = parent
+        self.tokens = {}  # (kind, model) -> tokens
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, model: str, tokens: int):
+        if not tokens:
+            return
+        usage = self
+        while usage is not None:
+            with usage._lock:
+                usage.tokens[(kind, model)] = usage.tokens.get((kind, model), 0) + tokens
+            usage = usage.parent
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.tokens)
+
+    def since(self, snapshot: dict):
+        # What was spent after snapshot was taken, as a detached RequestUsage
+        usage = RequestUsage(self.repo, self.user)
+        with self._lock:
+            usage.tokens = {key: tokens - snapshot.get(key, 0) for key, tokens in self.tokens.items() if tokens != snapshot.get(key, 0)}
+        return usage
+
+    def total(self, kind: str) -> int:
+        with self._lock:
+            return sum(tokens for (k, _), tokens in self.tokens.items() if k == kind)
+
+    @property
+    def embedding_tokens(self) -> int:
+        return self.total("embedding")
+
+    @property
+    def llm_tokens(self) -> int:
+        return self.total("prompt") + self.total("completion")
+
+    def cost_usd(self, kinds=TOKEN_KINDS) -> float:
+        with self._lock:
+            return sum(token_cost(model, kind, tokens) for (kind, model), tokens in self.tokens.items() if kind in kinds)
+
+    def to_dict(self) -> dict:
+        return {
+            "embedding_tokens": self.embedding_tokens,
+            "prompt_tokens": self.total("prompt"),
+            "completion_tokens": self.total("completion"),
+            "cost_usd": round(self.cost_usd(), 6)
+        }
+
+
+_current_usage = ContextVar("current_usage", default=None)
+
+
+def current_usage():
+    return _current_usage.get()
+
+
+@contextmanager
+def usage_scope(repo: str = None, user: str = None):
+    # Everything spent inside is attributed to this scope. The outermost scope with a repo is
+    # added to the repo's and user's monthly spend when it closes.
+    parent = _current_usage.get()
+    usage = RequestUsage(repo, user, parent=parent)
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        try:
+            _current_usage.reset(token)
+        except ValueError:
+            pass  # a generator closed from another context; its context is discarded anyway
+        if parent is None and usage.repo:
+            record_spend(usage)
+
+
+def record_tokens(kind: str, model: str, tokens: int):
+    # For spending that bypasses llama-index callbacks (e.g. the embedding scheduler)
+    count_tokens(kind, tokens)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(kind, model, tokens)
+
+
+def user_identity(access_token: str = None) -> str:
+    # The same identities as the GitHub rate governor: anonymous, server or oauth:<hash>
+    return token_identity(f"Bearer {access_token}" if access_token else None)
+
+
+class UsageHandler(BaseCallbackHandler):
+    # Registered once on the shared callback manager; attributes every LLM and embedding call to the
+    # usage scope of the request that made it, so concurrent requests never see each other's tokens
+    # and no per-request handler is ever added.
+
+    def __init__(self, llm_model: str, embed_model: str):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self.llm_model = llm_model
+        self.embed_model = embed_model
+        self._token_counter = TokenCounter()
+
+    def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+        return event_id
+
+    def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+        if payload is None:
+            return
+        if event_type == CBEventType.LLM:
+            counts = get_llm_token_counts(self._token_counter, payload, event_id)
+            record_tokens("prompt", self.llm_model, counts.prompt_token_count)
+            record_tokens("completion", self.llm_model, counts.completion_token_count)
+        elif event_type == CBEventType.EMBEDDING:
+            tokens = sum(self._token_counter.get_string_tokens(chunk) for chunk in payload.get(EventPayload.CHUNKS, []))
+            record_tokens("embedding", self.embed_model, tokens)
+
+    def start_trace(self, trace_id=None):
+        pass
+
+    def end_trace(self, trace_id=None, trace_map=None):
+        pass
+
+
+def spend_keys(repo: str, user: str, period: str = None) -> list:
+    period = period or datetime.now(timezone.utc).strftime("%Y-%m")
+    keys = [("repo", repo, f"spend:{period}:repo:{repo}")]
+    if user:
+        keys.append(("user", user, f"spend:{period}:user:{user}"))
+    return keys
+
+
+def record_spend(usage: RequestUsage):
+    # One HINCRBYFLOAT per field per key, in a single round trip
+    try:
+        pipe = r.pipeline(transaction=False)
+        for _, _, key in spend_keys(usage.repo, usage.user):
+            pipe.hincrbyfloat(key, "cost_usd", usage.cost_usd())
+            for kind in TOKEN_KINDS:
+                pipe.hincrby(key, f"{kind}_tokens", usage.total(kind))
+            pipe.hincrby(key, "requests", 1)
+            pipe.expire(key, USAGE_RETENTION_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to record spend for {usage.repo} ({usage.user}): {e}", exc_info=True)
+
+
+def budget_for(scope: str, name: str) -> float:
+    if scope == "repo":
+        return float(REPO_BUDGETS_USD.get(name, REPO_BUDGET_USD))
+    return float(USER_BUDGETS_USD.get(name, USER_BUDGET_USD))
+
+
+def budgeted_keys(repo: str = None, user: str = None) -> list:
+    # The spend keys with a budget to check, for the given or the current scope's repo and user
+    usage = _current_usage.get()
+    repo = repo or (usage.repo if usage else None)
+    user = user or (usage.user if usage else None)
+    if not repo:
+        return []
+    return [(scope, name, key) for scope, name, key in spend_keys(repo, user) if budget_for(scope, name) > 0]
+
+
+def check_spent(keys: list, spent: list):
+    for (scope, name, _), amount in zip(keys, spent):
+        budget = budget_for(scope, name)
+        if float(amount or 0) >= budget:
+            raise BudgetExceeded(f"Monthly {scope} budget of ${budget:.2f} for {name} is used up (${float(amount):.4f} spent)")
+
+
+def enforce_budget(repo: str = None, user: str = None):
+    # Raises BudgetExceeded if the repo or user has used up this month's budget. Called before
+    # anything that spends money. Budgets are not enforced while Redis is unreachable.
+    keys = budgeted_keys(repo, user)
+    if not keys:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        for _, _, key in keys:
+            pipe.hget(key, "cost_usd")
+        spent = pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to read spend for {keys[0][1]}: {e}; not enforcing budgets", exc_info=True)
+        return
+    check_spent(keys, spent)
+
+
+async def aenforce_budget(repo: str = None, user: str = None):
+    keys = budgeted_keys(repo, user)
+    if not keys:
+        return
+    try:
+        pipe = ar.pipeline(transaction=False)
+        for _, _, key in keys:
+            pipe.hget(key, "cost_usd")
+        spent = await pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to read spend for {keys[0][1]}: {e}; not enforcing budgets", exc_info=True)
+        return
+    check_spent(keys, spent)
+
+
+def spend_report(repo: str = None, user: str = None, period: str = None) -> dict:
+    period = period or datetime.now(timezone.utc).strftime("%Y-%m")
+    report = {"period": period}
+    targets = ([("repo", repo)] if repo else []) + ([("user", user)] if user else [])
+    for scope, name in targets:
+        key = f"spend:{period}:{scope}:{name}"
+        try:
+            values = r.hgetall(key)
+        except Exception as e:
+            logger.error(f"Failed to read spend for {key}: {e}", exc_info=True)
+            values = {}
+        budget = budget_for(scope, name)
+        report[scope] = {
+            "name": name,
+            "cost_usd": round(float(values.get("cost_usd", 0)), 6),
+            **{f"{kind}_tokens": int(values.get(f"{kind}_tokens", 0)) for kind in TOKEN_KINDS},
+            "requests": int(values.get("requests", 0)),
+            "budget_usd": budget or None
+        }
+    return report
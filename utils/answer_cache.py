@@ -0,0 +1,103 @@
+import base64
+import hashlib
+import json
+import os
+import numpy as np
+from dotenv import load_dotenv
+from utils.cache import aget_repo_version, ar
+from utils.logger import logger
+
+load_dotenv()
+
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60))
+# Cosine similarity a new question needs to reuse a cached answer; set above 1 to disable the semantic tier
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+ANSWER_CACHE_MAX_VECTORS = int(os.getenv("ANSWER_CACHE_MAX_VECTORS", 1000))
+
+
+def semantic_tier_enabled() -> bool:
+    return ANSWER_CACHE_SIMILARITY <= 1
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def format_scope(owner, repo, mode: str, version):
+    # Bumping the repo version (on webhook invalidation or sync) orphans every entry of the old scope
+    if version is None:
+        return None
+    return f"{owner}/{repo}:v{version}:{mode}"
+
+
+async def aanswer_cache_scope(owner, repo, mode: str):
+    return format_scope(owner, repo, mode, await aget_repo_version(owner, repo))
+
+
+async def aget_exact_answer(scope: str, question: str):
+    key = f"answer:{scope}:{question_hash(question)}"
+    try:
+        value = await ar.get(key)
+        if value:
+            logger.info(f"Answer cache exact HIT for {key}")
+            return json.loads(value)
+        return None
+    except Exception as e:
+        logger.error(f"Redis GET error for {key}: {e}", exc_info=True)
+        return None
+
+
+def nearest_question(entries: dict, embedding: list):
+    # (question hash, similarity) of the closest cached question above the threshold, else None
+    if not entries:
+        return None
+    hashes = list(entries.keys())
+    matrix = np.stack([np.frombuffer(base64.b64decode(entries[h]), dtype=np.float32) for h in hashes])
+    query = np.asarray(embedding, dtype=np.float32)
+    scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    best = int(np.argmax(scores))
+    if scores[best] < ANSWER_CACHE_SIMILARITY:
+        return None
+    return hashes[best], float(scores[best])
+
+
+async def afind_similar_answer(scope: str, embedding: list):
+    vectors_key = f"answer_vectors:{scope}"
+    try:
+        match = nearest_question(await ar.hgetall(vectors_key), embedding)
+        if match is None:
+            return None
+        value = await ar.get(f"answer:{scope}:{match[0]}")
+        if not value:
+            return None
+        logger.info(f"Answer cache semantic HIT for {vectors_key} (similarity {match[1]:.3f})")
+        return json.loads(value)
+    except Exception as e:
+        logger.error(f"Answer cache similarity lookup failed for {vectors_key}: {e}", exc_info=True)
+        return None
+
+
+def queue_answer(pipe, scope: str, question: str, payload: dict, embedding: list = None):
+    # Queues one answer's writes on the pipeline, so they go out in a single round trip
+    h = question_hash(question)
+    pipe.setex(f"answer:{scope}:{h}", ANSWER_CACHE_TTL, json.dumps(payload))
+    if embedding is not None:
+        pipe.hset(f"answer_vectors:{scope}", h, base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii"))
+        pipe.expire(f"answer_vectors:{scope}", ANSWER_CACHE_TTL)
+
+
+async def aset_answer(scope: str, question: str, payload: dict, embedding: list = None):
+    key = f"answer:{scope}:{question_hash(question)}"
+    try:
+        if embedding is not None and await ar.hlen(f"answer_vectors:{scope}") >= ANSWER_CACHE_MAX_VECTORS:
+            embedding = None
+        pipe = ar.pipeline(transaction=False)
+        queue_answer(pipe, scope, question, payload, embedding)
+        await pipe.execute()
+        logger.info(f"Cached answer for {key}")
+    except Exception as e:
+        logger.error(f"Redis SET error for {key}: {e}", exc_info=True)
@@ -1,54 +1,371 @@
+import asyncio
 import redis
+import redis.asyncio
 import os
 import json
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from utils.logger import logger
+from utils.tracing import count_cache_lookup
 
 load_dotenv()
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+# Connections per pool; callers wait up to REDIS_POOL_TIMEOUT seconds for a free one
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+# How often the background health check pings Redis
+REDIS_HEALTH_CHECK_INTERVAL = float(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 10))
+# "redis" (the server at REDIS_HOST/REDIS_PORT) or "memory" (in-process, needs fakeredis)
+REDIS_BACKEND = os.getenv("REDIS_BACKEND", "redis").lower()
 
-# Create redis client
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+def build_pool(pool_class, decode_responses: bool):
+    return pool_class(
+        host=REDIS_HOST, port=REDIS_PORT, max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=decode_responses
+    )
+
+
+def build_clients():
+    # r for text values, rb (same server) for compressed bytes, and ar for async handlers. Each has its
+    # own pool, so worker threads and the event loop never share connections. REDIS_BACKEND=memory
+    # swaps in an in-process fakeredis server (an optional dependency) for offline runs and tests.
+    if REDIS_BACKEND == "memory":
+        import fakeredis
+        server = fakeredis.FakeServer()
+        return (
+            fakeredis.FakeRedis(server=server, decode_responses=True),
+            fakeredis.FakeRedis(server=server),
+            fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        )
+    return (
+        redis.Redis(connection_pool=build_pool(redis.BlockingConnectionPool, decode_responses=True)),
+        redis.Redis(connection_pool=build_pool(redis.BlockingConnectionPool, decode_responses=False)),
+        redis.asyncio.Redis(connection_pool=build_pool(redis.asyncio.BlockingConnectionPool, decode_responses=True))
+    )
+
+
+r, rb, ar = build_clients()
 
 CACHE_TTL = 60 * 60  # 1 hour TTL
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", 6))
+# Hash fields fetched per HSCAN round trip when streaming a cached repo
+CACHE_SCAN_COUNT = int(os.getenv("CACHE_SCAN_COUNT", 200))
+# Marks a PR whose cached record was invalidated; readers refetch just that PR
+TOMBSTONE = b""
+BUILD_LOCK_TIMEOUT = int(os.getenv("BUILD_LOCK_TIMEOUT", 30 * 60))
+# How often a held build lock has its TTL reset; must be well under BUILD_LOCK_TIMEOUT
+BUILD_LOCK_RENEW_INTERVAL = float(os.getenv("BUILD_LOCK_RENEW_INTERVAL", BUILD_LOCK_TIMEOUT / 3))
+
+# key -> [threading.Lock, number of threads holding or waiting]; entries go when unused
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+# Last health check result, refreshed by monitor_redis_health
+_redis_health = {"ok": False, "checked_at": None}
+
+
+def record_redis_health(ok: bool, error=None):
+    if ok != _redis_health["ok"] or _redis_health["checked_at"] is None:
+        if ok:
+            logger.info("Redis connection is healthy")
+        else:
+            logger.error(f"Redis connection failed: {error}")
+    _redis_health["ok"] = ok
+    _redis_health["checked_at"] = time.monotonic()
 
 
 def check_redis_connection() -> bool:
+    # Cached status, so request handlers don't pay for a ping. Without a running monitor (scripts,
+    # or before startup) a stale status is refreshed inline.
+    checked_at = _redis_health["checked_at"]
+    if checked_at is None or time.monotonic() - checked_at > 2 * REDIS_HEALTH_CHECK_INTERVAL:
+        try:
+            record_redis_health(r.ping())
+        except Exception as e:
+            record_redis_health(False, e)
+    return _redis_health["ok"]
+
+
+async def monitor_redis_health():
+    # An exception escaping this loop would end the task and leave the cached status frozen
+    while True:
+        try:
+            record_redis_health(await ar.ping())
+        except redis.RedisError as e:
+            record_redis_health(False, e)
+        except Exception as e:
+            logger.error(f"Redis health check failed unexpectedly: {e}", exc_info=True)
+            record_redis_health(False, e)
+        await asyncio.sleep(REDIS_HEALTH_CHECK_INTERVAL)
+
+
+# Process-wide repo cache counters, served by repo_cache_stats
+_repo_cache_stats = {"hits": 0, "misses": 0, "records_read": 0, "bytes_read": 0,
+                     "records_written": 0, "bytes_written": 0, "raw_bytes_written": 0}
+_repo_cache_stats_guard = threading.Lock()
+
+
+def _count(**deltas):
+    with _repo_cache_stats_guard:
+        for name, delta in deltas.items():
+            _repo_cache_stats[name] += delta
+
+
+def repo_cache_keys(owner, repo):
+    # A hash of PR number -> zlib-compressed record JSON, and a hash of bookkeeping for it:
+    # version (bumped on every change), complete (set once a full fetch has been written),
+    # and bytes (stored size of the records)
+    return f"repo_docs:{owner}/{repo}", f"repo_docs_meta:{owner}/{repo}"
+
+
+def pack_record(record) -> bytes:
+    return zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"), CACHE_COMPRESSION_LEVEL)
+
+
+def unpack_record(value: bytes):
+    return json.loads(zlib.decompress(value))
+
+
+def iter_cached_repo(owner, repo):
+    # Streams a fully cached repo as (pr_number, record) pairs, a few hundred fields per round trip;
+    # record is None for a PR invalidated since. Returns None on a miss or when Redis is unavailable.
+    docs_key, meta_key = repo_cache_keys(owner, repo)
     try:
-        return r.ping()
-    except redis.RedisError as e:
-        logger.error(f"Redis connection failed: {e}", exc_info=True)
-        return False
+        complete = r.hget(meta_key, "complete")
+    except Exception as e:
+        logger.error(f"Redis HGET error for {meta_key}: {e}", exc_info=True)
+        return None
+    if complete != "1":
+        logger.info(f"Cache MISS for {docs_key}")
+        _count(misses=1)
+        count_cache_lookup("repo_documents", "miss")
+        return None
 
+    logger.info(f"Cache HIT for {docs_key}")
+    _count(hits=1)
+    count_cache_lookup("repo_documents", "hit")
 
-def get_cached_repo(owner, repo):
-    key = f"repo:{owner}/{repo}"
+    def stream():
+        # HSCAN may repeat a field if the hash is resized mid-scan
+        seen = set()
+        for field, value in rb.hscan_iter(docs_key, count=CACHE_SCAN_COUNT):
+            pr_number = int(field)
+            if pr_number in seen:
+                continue
+            seen.add(pr_number)
+            _count(records_read=1, bytes_read=len(value))
+            yield pr_number, (unpack_record(value) if value != TOMBSTONE else None)
+
+    return stream()
+
+def begin_cached_repo(owner, repo):
+    # Drops any previous copy before a full fetch is written field by field
     try:
-        value = r.get(key)
-        if value:
-            logger.info(f"Cache HIT for {key}")
-            return json.loads(value)
-        else:
-            logger.info(f"Cache MISS for {key}")
-            return None
+        r.delete(*repo_cache_keys(owner, repo))
+    except Exception as e:
+        logger.error(f"Redis DEL error for {owner}/{repo}: {e}", exc_info=True)
+
+def cache_pr_records(owner, repo, records, only_if_cached: bool = False):
+    # Writes (or overwrites) one field per PR and bumps the version. With only_if_cached, records are
+    # only written into a complete cached copy, so an update never creates a partial one.
+    docs_key, meta_key = repo_cache_keys(owner, repo)
+    if not records:
+        return
+    try:
+        fields = {str(record["pr_number"]): pack_record(record) for record in records}
+        previous = rb.pipeline(transaction=False)
+        previous.hget(meta_key, "complete")
+        for field in fields:
+            previous.hstrlen(docs_key, field)
+        complete, *sizes = previous.execute()
+        if only_if_cached and complete != b"1":
+            return
+        replaced_bytes = sum(sizes)
+
+        written = sum(len(value) for value in fields.values())
+        raw = sum(len(json.dumps(record, separators=(",", ":"))) for record in records)
+        pipe = rb.pipeline()
+        pipe.hset(docs_key, mapping=fields)
+        pipe.hincrby(meta_key, "version", 1)
+        pipe.hincrby(meta_key, "bytes", written - replaced_bytes)
+        pipe.expire(docs_key, CACHE_TTL)
+        pipe.expire(meta_key, CACHE_TTL)
+        pipe.execute()
+        _count(records_written=len(records), bytes_written=written, raw_bytes_written=raw)
+    except Exception as e:
+        logger.error(f"Redis HSET error for {docs_key}: {e}", exc_info=True)
+
+def finish_cached_repo(owner, repo):
+    docs_key, meta_key = repo_cache_keys(owner, repo)
+    try:
+        pipe = r.pipeline()
+        pipe.hset(meta_key, "complete", "1")
+        pipe.expire(meta_key, CACHE_TTL)
+        pipe.execute()
+        logger.info(f"Cached data for {docs_key}")
+    except Exception as e:
+        logger.error(f"Redis HSET error for {meta_key}: {e}", exc_info=True)
+
+def queue_existence_check(pipe, owner, repo, pr_number):
+    # Whether the repo has a cached copy, and the stored size of the PR's record if it does
+    docs_key, meta_key = repo_cache_keys(owner, repo)
+    pipe.exists(meta_key)
+    pipe.hstrlen(docs_key, str(pr_number))
+
+def queue_invalidation(pipe, owner, repo, pr_number, checks):
+    # A PR tombstone only goes into a copy that exists, so it never creates a partial one
+    docs_key, meta_key = repo_cache_keys(owner, repo)
+    if pr_number is None:
+        pipe.delete(docs_key, meta_key)
+    elif checks[0]:
+        pipe.hset(docs_key, str(pr_number), TOMBSTONE)
+        pipe.hincrby(meta_key, "version", 1)
+        pipe.hincrby(meta_key, "bytes", -checks[1])
+    pipe.incr(f"repo_version:{owner}/{repo}")
+
+def log_invalidation(owner, repo, pr_number):
+    logger.info(f"Cache invalidated for {owner}/{repo}" + (f" PR #{pr_number}" if pr_number is not None else ""))
+
+def invalidate_repo_cache(owner, repo, pr_number=None):
+    # With pr_number only that PR's field is replaced by a tombstone; otherwise the whole copy goes.
+    # Also bumps the repo's version. One pipelined round trip, plus an existence check for a PR.
+    try:
+        checks = None
+        if pr_number is not None:
+            check = r.pipeline(transaction=False)
+            queue_existence_check(check, owner, repo, pr_number)
+            checks = check.execute()
+        pipe = rb.pipeline(transaction=False)
+        queue_invalidation(pipe, owner, repo, pr_number, checks)
+        pipe.execute()
+        log_invalidation(owner, repo, pr_number)
+    except Exception as e:
+        logger.error(f"Redis error invalidating cache for {owner}/{repo}: {e}", exc_info=True)
+
+async def ainvalidate_repo_cache(owner, repo, pr_number=None):
+    try:
+        checks = None
+        if pr_number is not None:
+            check = ar.pipeline(transaction=False)
+            queue_existence_check(check, owner, repo, pr_number)
+            checks = await check.execute()
+        pipe = ar.pipeline(transaction=False)
+        queue_invalidation(pipe, owner, repo, pr_number, checks)
+        await pipe.execute()
+        log_invalidation(owner, repo, pr_number)
+    except Exception as e:
+        logger.error(f"Redis error invalidating cache for {owner}/{repo}: {e}", exc_info=True)
+
+def repo_cache_stats(owner=None, repo=None) -> dict:
+    with _repo_cache_stats_guard:
+        stats = dict(_repo_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else None
+    stats["compression_ratio"] = stats["raw_bytes_written"] / stats["bytes_written"] if stats["bytes_written"] else None
+
+    if owner and repo:
+        docs_key, meta_key = repo_cache_keys(owner, repo)
+        try:
+            meta = r.hgetall(meta_key)
+            stats["repo"] = {
+                "repo": f"{owner}/{repo}",
+                "cached": meta.get("complete") == "1",
+                "version": int(meta.get("version", 0)),
+                "prs": r.hlen(docs_key),
+                "bytes": int(meta.get("bytes", 0)),
+                "ttl_seconds": r.ttl(docs_key)
+            }
+        except Exception as e:
+            logger.error(f"Redis error reading cache stats for {docs_key}: {e}", exc_info=True)
+    return stats
+
+async def aget_repo_version(owner, repo):
+    # Anything derived from the repo's index (e.g. cached answers) is keyed by this version
+    key = f"repo_version:{owner}/{repo}"
+    try:
+        return int(await ar.get(key) or 0)
     except Exception as e:
         logger.error(f"Redis GET error for {key}: {e}", exc_info=True)
         return None
 
-def set_cached_repo(owner, repo, data):
-    key = f"repo:{owner}/{repo}"
+def bump_repo_version(owner, repo):
+    key = f"repo_version:{owner}/{repo}"
     try:
-        r.setex(key, CACHE_TTL, json.dumps(data))
-        logger.info(f"Cached data for {key}")
+        version = r.incr(key)
+        logger.info(f"Repo version for {owner}/{repo} is now {version}")
+        return version
     except Exception as e:
-        logger.error(f"Redis SET error for {key}: {e}", exc_info=True)
+        logger.error(f"Redis INCR error for {key}: {e}", exc_info=True)
+        return None
+
 
-def invalidate_repo_cache(owner, repo):
-    key = f"repo:{owner}/{repo}"
+def _renew_lock(redis_lock, key: str, stop: threading.Event, interval: float):
+    # Resets the lock's TTL until the holder is done, so a build that outlives the
+    # timeout does not let another worker start a duplicate build
+    while not stop.wait(interval):
+        try:
+            redis_lock.reacquire()
+        except redis.exceptions.LockError as e:
+            logger.error(f"Lost Redis lock for {key}: {e}")
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Failed to renew Redis lock for {key}: {e}")
+
+
+@contextmanager
+def _local_lock(key: str):
+    with _local_locks_guard:
+        entry = _local_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
     try:
-        r.delete(key)
-        logger.info(f"Cache invalidated for {key}")
-    except Exception as e:
-        logger.error(f"Redis DEL error for {key}: {e}", exc_info=True)
+        with entry[0]:
+            yield
+    finally:
+        with _local_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _local_locks[key]
+
+
+@contextmanager
+def single_flight(key: str, timeout: int = BUILD_LOCK_TIMEOUT, renew_interval: float = BUILD_LOCK_RENEW_INTERVAL):
+    # At most one holder per key: a local lock serialises threads in this worker,
+    # and a Redis lock serialises workers. Without Redis we fall back to the local lock.
+    # The Redis lock is renewed in the background for as long as it is held.
+    with _local_lock(key):
+        # thread_local=False so the renewal thread can see the lock's token
+        redis_lock = r.lock(f"lock:{key}", timeout=timeout, blocking_timeout=timeout, thread_local=False)
+        acquired = False
+        try:
+            acquired = redis_lock.acquire()
+        except redis.RedisError as e:
+            logger.warning(f"Redis lock unavailable for {key}, using in-process lock only: {e}")
+        else:
+            if not acquired:
+                raise TimeoutError(f"Timed out waiting for lock: {key}")
+
+        stop = threading.Event()
+        renewer = None
+        if acquired:
+            renewer = threading.Thread(target=_renew_lock, args=(redis_lock, key, stop, renew_interval), daemon=True)
+            renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            if renewer is not None:
+                renewer.join()
+            if acquired:
+                try:
+                    redis_lock.release()
+                except redis.RedisError as e:
+                    logger.warning(f"Failed to release Redis lock for {key}: {e}")
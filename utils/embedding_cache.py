@@ -0,0 +1,72 @@
+import hashlib
+import os
+from array import array
+from dotenv import load_dotenv
+from utils.logger import logger
+from utils.sqlite_connections import ThreadConnections
+
+load_dotenv()
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+
+
+def _setup(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+        "PRIMARY KEY (model, text_hash))"
+    )
+
+
+_connections = ThreadConnections(EMBEDDING_CACHE_PATH, _setup)
+_connect = _connections.get
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(blob: bytes) -> list:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+def get_cached_embeddings(model: str, texts: list) -> list:
+    # Returns one entry per text: the cached vector, or None on a miss
+    if not texts:
+        return []
+    hashes = [text_hash(t) for t in texts]
+    found = {}
+    try:
+        with _connect() as conn:
+            unique = list(set(hashes))
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                )
+                for h, blob in rows:
+                    found[h] = unpack_vector(blob)
+    except Exception as e:
+        logger.error(f"Embedding cache read failed: {e}", exc_info=True)
+    return [found.get(h) for h in hashes]
+
+
+def set_cached_embeddings(model: str, texts: list, vectors: list):
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, text_hash(t), pack_vector(v)) for t, v in zip(texts, vectors)]
+            )
+        logger.info(f"Cached {len(texts)} embeddings for model {model}")
+    except Exception as e:
+        logger.error(f"Embedding cache write failed: {e}", exc_info=True)
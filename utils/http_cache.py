@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from dotenv import load_dotenv
+from utils.logger import logger
+from utils.sqlite_connections import ThreadConnections
+
+load_dotenv()
+
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH", "./http_cache.db")
+# Entries not revalidated for this long are dropped by prune_entries
+HTTP_CACHE_MAX_AGE_SECONDS = int(os.getenv("HTTP_CACHE_MAX_AGE_SECONDS", 30 * 24 * 60 * 60))
+
+
+def _setup(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, next_url TEXT, body BLOB NOT NULL, "
+        "validated_at REAL NOT NULL)"
+    )
+
+
+_connections = ThreadConnections(HTTP_CACHE_PATH, _setup)
+_connect = _connections.get
+
+
+def cache_key(identity: str, url: str) -> str:
+    # Responses depend on who asked (private repos, per-token ETags), so the identity is part of the key
+    return hashlib.sha256(f"{identity} {url}".encode("utf-8")).hexdigest()
+
+
+def get_entry(key: str):
+    # Returns {"etag", "last_modified", "next_url", "body"} or None
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                "SELECT etag, last_modified, next_url, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, next_url, body = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "next_url": next_url,
+            "body": json.loads(zlib.decompress(body))
+        }
+    except Exception as e:
+        logger.error(f"HTTP cache read failed: {e}", exc_info=True)
+        return None
+
+
+def set_entry(key: str, etag: str, last_modified: str, next_url: str, body):
+    if not etag and not last_modified:
+        return
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, etag, last_modified, next_url, body, validated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, etag, last_modified, next_url, zlib.compress(json.dumps(body).encode("utf-8")), time.time())
+            )
+    except Exception as e:
+        logger.error(f"HTTP cache write failed: {e}", exc_info=True)
+
+
+def touch_entry(key: str):
+    try:
+        with _connect() as conn:
+            conn.execute("UPDATE responses SET validated_at = ? WHERE key = ?", (time.time(), key))
+    except Exception as e:
+        logger.error(f"HTTP cache write failed: {e}", exc_info=True)
+
+
+def prune_entries(max_age_seconds: int = HTTP_CACHE_MAX_AGE_SECONDS) -> int:
+    try:
+        with _connect() as conn:
+            removed = conn.execute(
+                "DELETE FROM responses WHERE validated_at < ?", (time.time() - max_age_seconds,)
+            ).rowcount
+        if removed:
+            logger.info(f"Pruned {removed} stale HTTP cache entries")
+        return removed
+    except Exception as e:
+        logger.error(f"HTTP cache prune failed: {e}", exc_info=True)
+        return 0
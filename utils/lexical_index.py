@@ -0,0 +1,126 @@
+import json
+import os
+import re
+from dotenv import load_dotenv
+from utils.logger import logger
+from utils.sqlite_connections import ThreadConnections
+
+load_dotenv()
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./lexical_index.db")
+
+# Keep snake_case identifiers whole; file names and paths become phrases of their parts
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+TERM_PATTERN = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_./#:-]*")
+# Double quotes and backticks only; apostrophes are too common in plain questions
+QUOTED_PATTERN = re.compile(r"[\"`]([^\"`]{3,})[\"`]")
+STOPWORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "as", "at", "be", "by", "can", "did", "do", "does", "for",
+    "from", "give", "how", "i", "in", "is", "it", "list", "me", "of", "on", "or", "pr", "prs", "pull", "request",
+    "show", "tell", "that", "the", "there", "this", "to", "was", "we", "were", "what", "when", "where", "which",
+    "who", "why", "with", "you"
+}
+
+
+def _setup(conn):
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+        "text, collection UNINDEXED, node_id UNINDEXED, doc_id UNINDEXED, pr_number UNINDEXED, "
+        "node_type UNINDEXED, status UNINDEXED, author UNINDEXED, updated_ts UNINDEXED, metadata UNINDEXED, "
+        "tokenize = \"unicode61 tokenchars '_'\")"
+    )
+
+
+_connections = ThreadConnections(LEXICAL_INDEX_PATH, _setup)
+_connect = _connections.get
+
+
+def replace_nodes(collection: str, doc_ids: list, nodes: list):
+    # Mirrors a batch of upserted nodes: drops the documents' old rows, then adds the new nodes.
+    # The lexical index only speeds retrieval up, so failures are logged rather than raised.
+    try:
+        with _connect() as conn:
+            conn.executemany(
+                "DELETE FROM chunks WHERE collection = ? AND doc_id = ?",
+                [(collection, doc_id) for doc_id in doc_ids]
+            )
+            conn.executemany(
+                "INSERT INTO chunks (text, collection, node_id, doc_id, pr_number, node_type, status, author, "
+                "updated_ts, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (node.text, collection, node.node_id, node.ref_doc_id, node.metadata.get("pr_number"),
+                     node.metadata.get("node_type"), node.metadata.get("status"), node.metadata.get("author"),
+                     node.metadata.get("updated_ts"), json.dumps(node.metadata))
+                    for node in nodes
+                ]
+            )
+    except Exception as e:
+        logger.error(f"Lexical index write failed for {collection}: {e}", exc_info=True)
+
+
+def clear_collection(collection: str):
+    try:
+        with _connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE collection = ?", (collection,))
+    except Exception as e:
+        logger.error(f"Lexical index clear failed for {collection}: {e}", exc_info=True)
+
+
+def match_expression(question: str):
+    # FTS5 query OR-ing every meaningful term; multi-part terms (paths, file names) and quoted
+    # strings are matched as phrases. None when nothing is left to search for.
+    phrases = []
+    for quoted in QUOTED_PATTERN.findall(question):
+        tokens = TOKEN_PATTERN.findall(quoted)
+        if tokens:
+            phrases.append(" ".join(tokens))
+    for term in TERM_PATTERN.findall(question):
+        tokens = TOKEN_PATTERN.findall(term)
+        if len(tokens) == 1 and tokens[0].lower() in STOPWORDS:
+            continue
+        if tokens:
+            phrases.append(" ".join(tokens))
+
+    unique = list(dict.fromkeys(p.lower() for p in phrases))
+    if not unique:
+        return None
+    return " OR ".join(f'"{phrase}"' for phrase in unique)
+
+
+def search(collection: str, question: str, limit: int, filters: dict = None) -> list:
+    # BM25-ranked (node_id, text, metadata, score) rows, best first; higher scores are better.
+    # filters takes the dict from baseline.retriever.filters.parse_filters.
+    expression = match_expression(question)
+    if expression is None:
+        return []
+
+    clauses, params = ["chunks MATCH ?", "collection = ?"], [expression, collection]
+    filters = filters or {}
+    if filters.get("pr_number") is not None:
+        clauses.append("pr_number = ?")
+        params.append(filters["pr_number"])
+    if filters.get("statuses"):
+        clauses.append(f"status IN ({','.join('?' * len(filters['statuses']))})")
+        params.extend(filters["statuses"])
+    if filters.get("author"):
+        clauses.append("author = ?")
+        params.append(filters["author"])
+    if filters.get("node_type"):
+        clauses.append("node_type = ?")
+        params.append(filters["node_type"])
+    if filters.get("since") is not None:
+        clauses.append("updated_ts >= ?")
+        params.append(filters["since"])
+
+    try:
+        with _connect() as conn:
+            rows = conn.execute(
+                f"SELECT node_id, text, metadata, bm25(chunks) FROM chunks WHERE {' AND '.join(clauses)} "
+                f"ORDER BY bm25(chunks) LIMIT {int(limit)}",
+                params
+            ).fetchall()
+        # SQLite's bm25() is negative, lower meaning more relevant
+        return [(node_id, text, json.loads(metadata), -score) for node_id, text, metadata, score in rows]
+    except Exception as e:
+        logger.error(f"Lexical search failed for {collection}: {e}", exc_info=True)
+        return []
@@ -1,16 +1,205 @@
+import glob
 import json
 import os
+import queue
+import statistics
+import threading
+import time
 from datetime import datetime
+from dotenv import load_dotenv
 from utils.logger import logger
 
-METRICS_FILE = "metrics.jsonl"
+load_dotenv()
+
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.jsonl")
+# The live file is rotated to METRICS_FILE.<UTC timestamp> once it reaches this size or age (0 disables either)
+METRICS_MAX_BYTES = int(os.getenv("METRICS_MAX_BYTES", 50 * 1024 * 1024))
+METRICS_ROTATE_SECONDS = int(os.getenv("METRICS_ROTATE_SECONDS", 24 * 60 * 60))
+# Rotated files kept; older ones are deleted
+METRICS_BACKUP_COUNT = int(os.getenv("METRICS_BACKUP_COUNT", 14))
+# Records waiting to be written; when full, new records are dropped rather than blocking a request
+METRICS_QUEUE_SIZE = int(os.getenv("METRICS_QUEUE_SIZE", 10000))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 1.0))
+# Retrieved chunk bodies make up most of a record; by default only their metadata is kept
+METRICS_INCLUDE_CHUNK_BODIES = os.getenv("METRICS_INCLUDE_CHUNK_BODIES", "false").lower() in ("1", "true", "yes")
+
+_STOP = object()
+
+
+class MetricsWriter:
+    # Appends records as compact JSONL from a background thread, so requests only pay for a queue
+    # put. Records are written in batches and the file is flushed every METRICS_FLUSH_SECONDS.
+
+    def __init__(self, path: str = METRICS_FILE):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=METRICS_QUEUE_SIZE)
+        self._file = None
+        self._opened_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: dict):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Metrics queue full; {self.dropped} records dropped so far")
+
+    def flush(self, timeout: float = 5.0):
+        # Waits until everything submitted so far is on disk
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout=10)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=METRICS_FLUSH_SECONDS)]
+            except queue.Empty:
+                self._rotate_if_due()
+                continue
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            records = [record for record in batch if record is not _STOP]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                logger.error(f"Failed to write {len(records)} metrics records: {e}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, records: list):
+        self._rotate_if_due()
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._opened_at = time.time()
+        self._file.write("".join(json.dumps(record, separators=(",", ":"), default=str) + "\n" for record in records))
+        self._file.flush()
+
+    def _rotate_if_due(self):
+        if self._file is None:
+            return
+        too_big = METRICS_MAX_BYTES and self._file.tell() >= METRICS_MAX_BYTES
+        too_old = METRICS_ROTATE_SECONDS and time.time() - self._opened_at >= METRICS_ROTATE_SECONDS
+        if not (too_big or too_old) or self._file.tell() == 0:
+            return
+        self._file.close()
+        self._file = None
+        rotated = f"{self.path}.{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}"
+        os.replace(self.path, rotated)
+        logger.info(f"Rotated metrics file to {rotated}")
+        for old in rotated_files(self.path)[:-METRICS_BACKUP_COUNT or None]:
+            os.remove(old)
+
+
+def rotated_files(path: str = METRICS_FILE) -> list:
+    # Oldest first; the timestamp suffix sorts chronologically
+    return sorted(glob.glob(glob.escape(path) + ".*"))
+
+
+def compact_chunks(chunks: list) -> list:
+    return [{k: v for k, v in chunk.items() if k != "content"} for chunk in chunks]
+
+
+metrics_writer = MetricsWriter()
+
 
 def log_metrics(data: dict):
     try:
         data["timestamp"] = datetime.utcnow().isoformat()
-        with open("metrics.json", "a", encoding="utf-8") as f:
-            f.write(json.dumps(data, indent=2) + ",\n")
-        logger.info("Metrics logged successfully.")
+        if not METRICS_INCLUDE_CHUNK_BODIES and data.get("retrieved_chunks"):
+            data["retrieved_chunks"] = compact_chunks(data["retrieved_chunks"])
+        metrics_writer.submit(data)
     except Exception as e:
         logger.error(f"Failed to log metrics: {e}", exc_info=True)
 
+
+def iter_metrics(path: str = METRICS_FILE):
+    # Every record on disk, oldest file first, one line at a time
+    for name in rotated_files(path) + [path]:
+        try:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+        except FileNotFoundError:
+            continue
+
+
+def repo_name(repo_url: str) -> str:
+    # Requests log either a GitHub URL or owner/repo
+    name = (repo_url or "").strip().rstrip("/")
+    if name.endswith(".git"):
+        name = name[:-4]
+    return "/".join(name.split("/")[-2:]) if name else "unknown"
+
+
+def latency_percentiles(latencies: list) -> dict:
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None}
+    if len(latencies) == 1:
+        return {"p50": latencies[0], "p95": latencies[0], "p99": latencies[0]}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50": round(cuts[49], 3), "p95": round(cuts[94], 3), "p99": round(cuts[98], 3)}
+
+
+def summarize_metrics(repo: str = None, since: str = None, path: str = METRICS_FILE) -> dict:
+    # Per-repo request counts, errors, latency percentiles, token totals and cost. Only latencies
+    # are held in memory; everything else is summed as the files stream past.
+    metrics_writer.flush()
+    repos = {}
+    for record in iter_metrics(path):
+        if since and record.get("timestamp", "") < since:
+            continue
+        name = repo_name(record.get("repo_url"))
+        if repo and name != repo:
+            continue
+        stats = repos.setdefault(name, {
+            "requests": 0, "errors": 0, "latencies": [], "llm_tokens": 0, "embedding_tokens": 0,
+            "tokens_total": 0, "cost_usd": 0.0
+        })
+        stats["requests"] += 1
+        if record.get("error"):
+            stats["errors"] += 1
+        if record.get("latency_seconds") is not None:
+            stats["latencies"].append(record["latency_seconds"])
+        for field in ("llm_tokens", "embedding_tokens", "tokens_total", "cost_usd"):
+            stats[field] += record.get(field) or 0
+
+    summary = {}
+    for name, stats in repos.items():
+        latencies = stats.pop("latencies")
+        stats["latency_seconds"] = latency_percentiles(latencies)
+        stats["cost_usd"] = round(stats["cost_usd"], 6)
+        summary[name] = stats
+    return {"repos": summary, "dropped_records": metrics_writer.dropped}
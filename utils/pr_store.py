@@ -0,0 +1,121 @@
+import os
+import sqlite3
+from dotenv import load_dotenv
+from utils.logger import logger
+from utils.sqlite_connections import ThreadConnections
+
+load_dotenv()
+
+PR_STORE_PATH = os.getenv("PR_STORE_PATH", "./pr_store.db")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS prs ("
+    "repo TEXT NOT NULL, pr_number INTEGER NOT NULL, title TEXT, author TEXT, status TEXT, body TEXT, "
+    "created_at TEXT, updated_at TEXT, PRIMARY KEY (repo, pr_number))",
+    "CREATE TABLE IF NOT EXISTS commits ("
+    "repo TEXT NOT NULL, pr_number INTEGER NOT NULL, sha TEXT, message TEXT, author TEXT, date TEXT)",
+    "CREATE TABLE IF NOT EXISTS comments ("
+    "repo TEXT NOT NULL, pr_number INTEGER NOT NULL, author TEXT, created_at TEXT, body TEXT)",
+    "CREATE INDEX IF NOT EXISTS commits_pr ON commits (repo, pr_number)",
+    "CREATE INDEX IF NOT EXISTS comments_pr ON comments (repo, pr_number)"
+]
+
+# Column compared against a `since` bound, per table
+DATE_COLUMNS = {"prs": "prs.updated_at", "commits": "commits.date", "comments": "comments.created_at"}
+AUTHOR_COLUMNS = {"prs": "prs.author", "commits": "commits.author", "comments": "comments.author"}
+
+
+def _setup(conn):
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.row_factory = sqlite3.Row
+
+
+_connections = ThreadConnections(PR_STORE_PATH, _setup)
+_connect = _connections.get
+
+
+def replace_pr_records(repo: str, records: list):
+    # Writes PR records (as built by github_client.build_pr_record), replacing each PR's previous rows.
+    # Failures propagate: the query router trusts this store to be complete for indexed repos.
+    if not records:
+        return
+    with _connect() as conn:
+        for record in records:
+            key = (repo, record["pr_number"])
+            conn.execute("DELETE FROM commits WHERE repo = ? AND pr_number = ?", key)
+            conn.execute("DELETE FROM comments WHERE repo = ? AND pr_number = ?", key)
+            conn.execute(
+                "INSERT OR REPLACE INTO prs (repo, pr_number, title, author, status, body, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, record["title"], record["author"], record["status"], record["body"],
+                 record["created_at"], record["updated_at"])
+            )
+            conn.executemany(
+                "INSERT INTO commits (repo, pr_number, sha, message, author, date) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*key, c["sha"], c["message"], c["author"], c["date"]) for c in record["commits"]]
+            )
+            conn.executemany(
+                "INSERT INTO comments (repo, pr_number, author, created_at, body) VALUES (?, ?, ?, ?, ?)",
+                [(*key, c["author"], c["created_at"], c["body"]) for c in record["comments"]]
+            )
+    logger.info(f"Stored {len(records)} PR records for {repo}")
+
+
+def clear_repo(repo: str):
+    with _connect() as conn:
+        for table in ("prs", "commits", "comments"):
+            conn.execute(f"DELETE FROM {table} WHERE repo = ?", (repo,))
+    logger.info(f"Cleared PR store for {repo}")
+
+
+def find_rows(table: str, repo: str, pr_number: int = None, statuses: list = None, author: str = None,
+              since: str = None, limit: int = None):
+    # Rows of `table` ("prs", "commits" or "comments") for a repo, with the PR's title and status
+    # joined in, oldest PR first. Returns (total matching rows, rows as dicts), or None on a read error.
+    if table == "prs":
+        select = "SELECT prs.*"
+        source = "prs"
+    else:
+        select = f"SELECT {table}.*, prs.title, prs.status"
+        source = f"{table} JOIN prs ON prs.repo = {table}.repo AND prs.pr_number = {table}.pr_number"
+
+    clauses, params = [f"{table}.repo = ?"], [repo]
+    if pr_number is not None:
+        clauses.append(f"{table}.pr_number = ?")
+        params.append(pr_number)
+    if statuses:
+        clauses.append(f"prs.status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if author:
+        clauses.append(f"{AUTHOR_COLUMNS[table]} = ? COLLATE NOCASE")
+        params.append(author)
+    if since:
+        clauses.append(f"{DATE_COLUMNS[table]} >= ?")
+        params.append(since)
+    where = " AND ".join(clauses)
+
+    try:
+        with _connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0]
+            query = f"{select} FROM {source} WHERE {where} ORDER BY {table}.pr_number, {DATE_COLUMNS[table]}"
+            if limit is not None:
+                query += f" LIMIT {int(limit)}"
+            rows = [dict(row) for row in conn.execute(query, params)]
+        return total, rows
+    except Exception as e:
+        logger.error(f"PR store read failed for {repo}: {e}", exc_info=True)
+        return None
+
+
+def has_author(repo: str, author: str) -> bool:
+    try:
+        with _connect() as conn:
+            for table, column in AUTHOR_COLUMNS.items():
+                if conn.execute(f"SELECT 1 FROM {table} WHERE repo = ? AND {column} = ? COLLATE NOCASE LIMIT 1",
+                                (repo, author)).fetchone():
+                    return True
+        return False
+    except Exception as e:
+        logger.error(f"PR store read failed for {repo}: {e}", exc_info=True)
+        return False
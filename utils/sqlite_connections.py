@@ -0,0 +1,46 @@
+import sqlite3
+import threading
+
+# Every pool, so shutdown can close all of them
+_pools = []
+
+
+class ThreadConnections:
+    # One connection per thread to a SQLite file, opened and set up (pragmas, schema) once and reused
+    # by every call made on that thread. Connections of threads that have exited are closed when the
+    # next thread connects; close_all_connections closes the rest on shutdown.
+
+    def __init__(self, path: str, setup):
+        self.path = path
+        self.setup = setup
+        self._local = threading.local()
+        self._connections = {}  # thread -> sqlite3.Connection
+        self._lock = threading.Lock()
+        _pools.append(self)
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        self.setup(conn)
+        with self._lock:
+            for thread in [t for t in self._connections if not t.is_alive()]:
+                self._connections.pop(thread).close()
+            self._connections[threading.current_thread()] = conn
+        self._local.conn = conn
+        return conn
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        self._local.__dict__.pop("conn", None)
+        for conn in connections:
+            conn.close()
+
+
+def close_all_connections():
+    for pool in _pools:
+        pool.close()
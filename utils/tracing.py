@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dotenv import load_dotenv
+from utils.logger import logger
+
+load_dotenv()
+
+# Off by default: span() then returns a shared no-op context and counters return immediately
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Set to a collector address (e.g. http://localhost:4317) to also export spans over OTLP
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "codereview-genie")
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRIC_PREFIX = "codereview"
+
+_NOOP = nullcontext()
+
+
+class StageHistogram:
+    def __init__(self):
+        self.buckets = [0] * len(STAGE_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Telemetry:
+    # Stage latency histograms and labelled counters, served in the Prometheus text format, plus an
+    # OpenTelemetry tracer when an OTLP endpoint is configured.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> StageHistogram
+        self._counters = {}  # (name, sorted label items) -> value
+        self._help = {}  # counter name -> help text
+        self.tracer = None
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, help_text: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._help.setdefault(name, help_text)
+
+    def stage_totals(self) -> dict:
+        # stage -> (times observed, total seconds), e.g. for benchmarks to diff before and after a run
+        with self._lock:
+            return {stage: (histogram.count, histogram.total) for stage, histogram in self._stages.items()}
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            if self._stages:
+                name = f"{METRIC_PREFIX}_stage_seconds"
+                lines += [f"# HELP {name} Time spent in each request and indexing stage", f"# TYPE {name} histogram"]
+                for stage, histogram in sorted(self._stages.items()):
+                    cumulative = 0
+                    for bound, count in zip(STAGE_BUCKETS, histogram.buckets):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+            for counter in sorted(self._help):
+                name = f"{METRIC_PREFIX}_{counter}_total"
+                lines += [f"# HELP {name} {self._help[counter]}", f"# TYPE {name} counter"]
+                for (key_name, labels), value in sorted(self._counters.items()):
+                    if key_name == counter:
+                        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
+
+
+def setup_otlp_exporter():
+    # opentelemetry-sdk and the OTLP exporter are optional; without them spans stay local
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        if os.getenv("OTEL_EXPORTER_OTLP_PROTOCOL", "grpc") == "grpc":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        else:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        logger.warning(f"OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK/exporter is not installed: {e}")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Exporting traces over OTLP to {OTEL_EXPORTER_OTLP_ENDPOINT}")
+    return trace.get_tracer("codereview")
+
+
+if TRACING_ENABLED and OTEL_EXPORTER_OTLP_ENDPOINT:
+    telemetry.tracer = setup_otlp_exporter()
+
+
+@contextmanager
+def _span(stage: str, attributes: dict):
+    started = time.perf_counter()
+    otel_span = telemetry.tracer.start_as_current_span(stage, attributes=attributes) if telemetry.tracer else _NOOP
+    with otel_span:
+        try:
+            yield
+        finally:
+            telemetry.observe(stage, time.perf_counter() - started)
+
+
+def span(stage: str, **attributes):
+    # Times a stage: with span("retrieve", repo="owner/repo"): ...
+    if not TRACING_ENABLED:
+        return _NOOP
+    return _span(stage, attributes)
+
+
+def record_stage(stage: str, started: float, **attributes):
+    # For stages that can't sit inside a with block (e.g. an LLM stream consumed across yields):
+    # started is the time.time() at which the stage began
+    if not TRACING_ENABLED:
+        return
+    telemetry.observe(stage, time.time() - started)
+    if telemetry.tracer is not None:
+        telemetry.tracer.start_span(stage, attributes=attributes, start_time=int(started * 1e9)).end()
+
+
+def timed_iter(stage: str, iterable, **attributes):
+    # Records the time spent waiting on an iterator (e.g. a paginated fetch consumed in batches)
+    # as one observation of stage, excluding the time the consumer spends on each item
+    if not TRACING_ENABLED:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    began = time.time()
+    waited = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                waited += time.perf_counter() - started
+            yield item
+    finally:
+        telemetry.observe(stage, waited)
+        if telemetry.tracer is not None:
+            # Spans the whole iteration; waited_seconds is the part spent in the iterator itself
+            telemetry.tracer.start_span(stage, attributes={**attributes, "waited_seconds": waited}, start_time=int(began * 1e9)).end()
+
+
+def count_github_request(api: str, outcome: str):
+    # outcome: ok, not_modified (served from the ETag cache), rate_limited or error
+    if TRACING_ENABLED:
+        telemetry.inc("github_requests", "GitHub API requests by API and outcome", api=api, outcome=outcome)
+
+
+def count_cache_lookup(cache: str, outcome: str, value: int = 1):
+    # outcome: hit or miss (answer cache: exact, semantic or miss)
+    if TRACING_ENABLED and value:
+        telemetry.inc("cache_lookups", "Cache lookups by cache and outcome", value=value, cache=cache, outcome=outcome)
+
+
+def count_tokens(kind: str, value: int):
+    if TRACING_ENABLED and value:
+        telemetry.inc("tokens", "Tokens used by kind", value=value, kind=kind)